@@ -7,9 +7,12 @@ import json
 import re
 import os
 from typing import Dict, List, Optional, Any
-import requests
 from google.cloud import bigquery
 import logging
+from llm_client import ClaudeClient
+from llm_resilience import ResilientClaudeClient
+from llm_scheduler import llm_scheduler
+from context_budget import fit_documents, truncate_to_tokens
 
 # CARREGAR API KEY GLOBALMENTE NA INICIALIZAÇÃO (antes do gunicorn)
 CLAUDE_API_KEY = None
@@ -45,6 +48,13 @@ def initialize_api_key():
             return env_key
         return None
 
+# Tokens (estimados) de conteúdo dos documentos enviados para análise
+ANALYSIS_CONTEXT_TOKENS = int(os.environ.get('ANALYSIS_CONTEXT_TOKENS', 1200))
+
+# Cliente Claude com pool de conexões (API key lida da inicialização acima),
+# com retry/backoff e circuit breaker
+claude_client = ResilientClaudeClient(ClaudeClient(api_key_provider=initialize_api_key), scheduler=llm_scheduler)
+
 class AIPromptGenerator:
     def __init__(self, project_id: str = "flower-ai-generator"):
         self.project_id = project_id
@@ -54,13 +64,17 @@ class AIPromptGenerator:
         if not CLAUDE_API_KEY:
             initialize_api_key()
         
-    def analyze_documents(self, chat_id: str) -> Dict[str, Any]:
-        """Analisa documentos do chat - SEM chamadas ao Secret Manager"""
+    def analyze_documents(self, chat_id: str, user_id: Optional[str] = None,
+                          plan: Optional[str] = None) -> Dict[str, Any]:
+        """Analisa documentos do chat - SEM chamadas ao Secret Manager
+
+        user_id/plan: dono do chat, para a fila do Claude (prioridade background)
+        """
         try:
             query = """
             SELECT filename, processed_content, file_type
             FROM `flower-ai-generator.saas_chat_generator.chat_documents`
-            WHERE chat_id = @chat_id
+            WHERE chat_id = @chat_id AND processing_status = 'completed'
             ORDER BY uploaded_at DESC
             LIMIT 3
             """
@@ -74,15 +88,17 @@ class AIPromptGenerator:
             if not results:
                 return self._default_analysis()
             
-            # Combinar conteúdo (limitado)
+            # Combinar conteúdo dentro do orçamento de tokens da análise
+            documents = fit_documents(
+                [{'filename': doc['filename'], 'content': doc['processed_content']} for doc in results],
+                ANALYSIS_CONTEXT_TOKENS
+            )
             all_content = ""
-            for doc in results[:2]:  # Máximo 2 documentos
-                if doc['processed_content']:
-                    content_chunk = doc['processed_content'][:800]  # 800 chars max
-                    all_content += f"\n{content_chunk}"
+            for doc in documents:
+                all_content += f"\n{doc['content']}"
             
             if all_content and CLAUDE_API_KEY:
-                return self._analyze_content_with_ai(all_content)
+                return self._analyze_content_with_ai(all_content, user_id or chat_id, plan)
             else:
                 return self._default_analysis()
                 
@@ -90,7 +106,8 @@ class AIPromptGenerator:
             logging.error(f"Erro ao analisar documentos: {e}")
             return self._default_analysis()
 
-    def _analyze_content_with_ai(self, content: str) -> Dict[str, Any]:
+    def _analyze_content_with_ai(self, content: str, tenant: Optional[str] = None,
+                                 plan: Optional[str] = None) -> Dict[str, Any]:
         """Análise com Claude - SEM acesso ao Secret Manager"""
         
         if not CLAUDE_API_KEY:
@@ -100,31 +117,20 @@ class AIPromptGenerator:
             # Prompt SUPER conciso para evitar timeout
             analysis_prompt = f"""
             Analise este conteúdo em JSON:
-            {content[:1500]}
+            {truncate_to_tokens(content, ANALYSIS_CONTEXT_TOKENS)}
             
             JSON:
             {{"company_info": {{"name": "Nome da empresa"}}, "services": ["serviço1"], "tone": "friendly"}}
             """
 
-            headers = {
-                "Content-Type": "application/json",
-                "x-api-key": CLAUDE_API_KEY,
-                "anthropic-version": "2023-06-01"
-            }
-            
             data = {
-                "model": "claude-3-haiku-20240307",
                 "max_tokens": 200,  # MUITO pequeno
                 "messages": [{"role": "user", "content": analysis_prompt}]
             }
             
-            # Timeout agressivo
-            response = requests.post(
-                "https://api.anthropic.com/v1/messages",
-                headers=headers,
-                json=data,
-                timeout=10
-            )
+            # Timeout agressivo; geração de prompt cede a vez às respostas ao vivo
+            with llm_scheduler.slot(tenant, plan, 'background'):
+                response = claude_client.create_message(data, timeout=10)
             
             if response.status_code == 200:
                 result = response.json()
@@ -145,7 +151,7 @@ class AIPromptGenerator:
             return self._default_analysis()
 
     def generate_optimized_prompt(self, chat_config: Dict, documents_analysis: Dict) -> str:
-        """Gera prompt - SEM Secret Manager"""
+        """Gera prompt - SEM Secret Manager (fila do Claude pelo user_id/plan do chat_config)"""
         
         if not CLAUDE_API_KEY:
             return self._fallback_prompt(chat_config, documents_analysis)
@@ -165,24 +171,13 @@ class AIPromptGenerator:
             Prompt deve ser natural, não mencionar arquivos, e ser {chat_config['personality']}.
             """
 
-            headers = {
-                "Content-Type": "application/json",
-                "x-api-key": CLAUDE_API_KEY,
-                "anthropic-version": "2023-06-01"
-            }
-            
             data = {
-                "model": "claude-3-haiku-20240307",
                 "max_tokens": 300,
                 "messages": [{"role": "user", "content": generation_prompt}]
             }
             
-            response = requests.post(
-                "https://api.anthropic.com/v1/messages",
-                headers=headers,
-                json=data,
-                timeout=10
-            )
+            with llm_scheduler.slot(chat_config.get('user_id'), chat_config.get('plan'), 'background'):
+                response = claude_client.create_message(data, timeout=10)
             
             if response.status_code == 200:
                 result = response.json()
@@ -0,0 +1,106 @@
+"""
+Índice aproximado (IVF) para bases grandes - usado pelo VectorIndex acima de ANN_MIN_CHUNKS
+Os vetores são agrupados por k-means esférico em listas; a busca compara a pergunta só
+com os centróides e com os trechos das ANN_NPROBE listas mais próximas.
+nprobe maior = recall maior e busca mais lenta (nprobe = nlist equivale à busca exata).
+Mesmo arquivo em backend/ e chat-engine/.
+"""
+
+import os
+import math
+import numpy as np
+
+# Abaixo disso a busca exata (produto matriz-vetor) já é rápida o bastante
+ANN_MIN_CHUNKS = int(os.environ.get('ANN_MIN_CHUNKS', 20000))
+# Listas consultadas por pergunta (troca recall x latência)
+ANN_NPROBE = int(os.environ.get('ANN_NPROBE', 8))
+ANN_MAX_LISTS = int(os.environ.get('ANN_MAX_LISTS', 1024))
+ANN_TRAIN_SAMPLE = int(os.environ.get('ANN_TRAIN_SAMPLE', 20000))
+ANN_KMEANS_ITERATIONS = int(os.environ.get('ANN_KMEANS_ITERATIONS', 8))
+# Retreinar quando a base crescer este fator desde o último treino
+ANN_RETRAIN_GROWTH = float(os.environ.get('ANN_RETRAIN_GROWTH', 4.0))
+
+ASSIGN_BATCH = 8192
+
+def lists_for(count):
+    """Número de listas para count vetores (~raiz quadrada)"""
+    return max(16, min(ANN_MAX_LISTS, int(math.sqrt(count))))
+
+class IVFIndex:
+    """Listas invertidas centróide -> linhas da matriz do VectorIndex"""
+
+    def __init__(self, centroids, nprobe=None):
+        self.centroids = centroids.astype(np.float32, copy=False)
+        self.nprobe = nprobe or ANN_NPROBE
+        self.assignments = np.zeros(0, dtype=np.int32)  # lista de cada linha
+        self._lists = [[] for _ in range(len(centroids))]  # pedaços (arrays de linhas)
+        self.trained_size = 0
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def train(cls, vectors, nlist=None, seed=0):
+        """k-means esférico numa amostra dos vetores (normalizados)"""
+        rng = np.random.default_rng(seed)
+        nlist = min(nlist or lists_for(len(vectors)), len(vectors))
+        sample_size = min(len(vectors), max(ANN_TRAIN_SAMPLE, nlist * 4))
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(ANN_KMEANS_ITERATIONS):
+            assigned = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assigned, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            # Lista vazia recebe um ponto aleatório da amostra
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            norms[empty] = 1.0
+            centroids = sums / norms
+        index = cls(centroids)
+        index.trained_size = len(vectors)
+        return index
+
+    def assign(self, vectors):
+        """Lista mais próxima de cada vetor (em lotes para limitar memória)"""
+        result = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), ASSIGN_BATCH):
+            batch = vectors[start:start + ASSIGN_BATCH]
+            result[start:start + len(batch)] = np.argmax(batch @ self.centroids.T, axis=1)
+        return result
+
+    def add(self, first_row, vectors, assignments=None):
+        """Inserir as linhas first_row.. (inserção incremental, sem retreinar)"""
+        if not len(vectors):
+            return
+        assignments = self.assign(vectors) if assignments is None else assignments
+        self.assignments = np.concatenate([self.assignments, assignments.astype(np.int32)])
+        rows = np.arange(first_row, first_row + len(vectors), dtype=np.int64)
+        order = np.argsort(assignments, kind='stable')
+        lists, starts = np.unique(assignments[order], return_index=True)
+        for list_id, part in zip(lists, np.split(rows[order], starts[1:])):
+            pieces = self._lists[list_id]
+            pieces.append(part)
+            if len(pieces) > 8:
+                self._lists[list_id] = [np.concatenate(pieces)]
+
+    def needs_retrain(self, count):
+        return count > self.trained_size * ANN_RETRAIN_GROWTH
+
+    def candidates(self, query, nprobe=None):
+        """Linhas das nprobe listas com centróide mais próximo da pergunta"""
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        scores = self.centroids @ query
+        probes = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        parts = [piece for list_id in probes for piece in self._lists[list_id]]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    def stats(self):
+        sizes = [sum(len(piece) for piece in pieces) for pieces in self._lists]
+        return {
+            'nlist': self.nlist,
+            'nprobe': self.nprobe,
+            'trained_size': self.trained_size,
+            'largest_list': max(sizes) if sizes else 0
+        }
@@ -11,6 +11,7 @@ from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity
 from datetime import timedelta, datetime, timezone
 import json
 import uuid
+import threading
 import requests
 from google.cloud import bigquery
 
@@ -20,6 +21,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import Config
 from auth.auth_service import auth_service
 from models.database import user_model, chat_model, message_model
+from llm_scheduler import llm_scheduler
+from hybrid_retrieval import retrieval_stats
 
 # Inicializar Flask
 app = Flask(__name__)
@@ -69,6 +72,8 @@ except ImportError as e:
 
 # Chat Engine URL
 CHAT_ENGINE_URL = "https://saas-chat-engine-365442086139.us-east1.run.app"
+# Segredo compartilhado com o chat-engine para rotas internas (invalidação de cache)
+INTERNAL_API_TOKEN = os.environ.get('INTERNAL_API_TOKEN', '')
 
 # ================================
 # FUNÇÕES UTILITÁRIAS
@@ -78,6 +83,26 @@ def get_current_timestamp():
     """Retorna timestamp atual UTC"""
     return datetime.now(timezone.utc)
 
+def notify_chat_engine_cache_invalidation(chat_id):
+    """Avisar o chat-engine que prompt/documentos do chat mudaram (best-effort, em background)"""
+    def notify():
+        try:
+            requests.post(f"{CHAT_ENGINE_URL}/api/cache/invalidate/{chat_id}", timeout=5,
+                          headers={'X-Internal-Token': INTERNAL_API_TOKEN})
+        except requests.RequestException as e:
+            print(f"⚠️ Falha ao invalidar cache do chat-engine: {e}")
+    
+    threading.Thread(target=notify, daemon=True).start()
+
+if KNOWLEDGE_BASE_ENABLED:
+    knowledge_service.add_change_listener(notify_chat_engine_cache_invalidation)
+    
+    # Processamento dos uploads fora da requisição (retoma pendentes do diário local)
+    from ingestion_queue import IngestionQueue
+    from bulk_upload import ALLOWED_CONTENT_TYPES, MAX_FILE_BYTES, iter_upload_entries
+    ingestion_queue = IngestionQueue(knowledge_service.process_document, knowledge_service.mark_document_failed)
+    ingestion_queue.start()
+
 def initialize_agent_system():
     """Inicializar sistema de agentes (chamar no startup do app.py)"""
     if not AGENT_SYSTEM_ENABLED:
@@ -313,7 +338,8 @@ def create_chat():
                         ]
                     )
                     
-                    bigquery_client.query(update_query, job_config=job_config)
+                    bigquery_client.query(update_query, job_config=job_config).result()
+                    notify_chat_engine_cache_invalidation(chat['chat_id'])
                     chat['system_prompt'] = specialized_prompt[:200] + '...'
                     
             except Exception as e:
@@ -499,7 +525,8 @@ def create_agent_configuration(chat_id):
             ]
         )
         
-        bigquery_client.query(update_query, job_config=job_config)
+        bigquery_client.query(update_query, job_config=job_config).result()
+        notify_chat_engine_cache_invalidation(chat_id)
         
         return jsonify({
             'success': True,
@@ -644,7 +671,8 @@ def update_agent_configuration(chat_id):
                 ]
             )
             
-            bigquery_client.query(update_query, job_config=job_config)
+            bigquery_client.query(update_query, job_config=job_config).result()
+            notify_chat_engine_cache_invalidation(chat_id)
         
         return jsonify({
             'success': True,
@@ -697,7 +725,7 @@ def regenerate_agent_prompt(chat_id):
                 if documents:
                     documents_context = "\n\nCONTEXTO DOS DOCUMENTOS:\n"
                     for doc in documents[:3]:  # Máximo 3 documentos
-                        content = doc.get('processed_content', '')[:500]  # Primeiros 500 chars
+                        content = (doc.get('processed_content') or '')[:500]  # Primeiros 500 chars (vazio se ainda processando)
                         documents_context += f"📄 {doc['filename']}: {content}\n"
             except Exception as e:
                 print(f"Erro ao buscar documentos: {e}")
@@ -735,7 +763,8 @@ def regenerate_agent_prompt(chat_id):
             ]
         )
         
-        bigquery_client.query(update_query, job_config=job_config)
+        bigquery_client.query(update_query, job_config=job_config).result()
+        notify_chat_engine_cache_invalidation(chat_id)
         
         return jsonify({
             'success': True,
@@ -887,7 +916,8 @@ def generate_ai_prompt(chat_id):
                             ]
                         )
                         
-                        bigquery_client.query(update_query, job_config=job_config)
+                        bigquery_client.query(update_query, job_config=job_config).result()
+                        notify_chat_engine_cache_invalidation(chat_id)
                 
                 return jsonify(result), 200
             else:
@@ -951,15 +981,7 @@ if KNOWLEDGE_BASE_ENABLED:
                 return jsonify({'success': False, 'error': 'Arquivo vazio'}), 400
             
             # Validar tipo de arquivo
-            allowed_types = [
-                'application/pdf',
-                'text/plain',
-                'text/markdown',
-                'application/json',
-                'text/csv'
-            ]
-            
-            if file.content_type not in allowed_types:
+            if file.content_type not in ALLOWED_CONTENT_TYPES:
                 return jsonify({
                     'success': False, 
                     'error': f'Tipo de arquivo não suportado: {file.content_type}'
@@ -967,11 +989,11 @@ if KNOWLEDGE_BASE_ENABLED:
             
             # Validar tamanho (máximo 10MB)
             file_data = file.read()
-            if len(file_data) > 10 * 1024 * 1024:
+            if len(file_data) > MAX_FILE_BYTES:
                 return jsonify({'success': False, 'error': 'Arquivo muito grande (máximo 10MB)'}), 400
             
-            # Upload do documento
-            result = knowledge_service.upload_document(
+            # Gravar arquivo e linha 'processing'; extração e índices ficam na fila
+            result = knowledge_service.accept_document(
                 chat_id=chat_id,
                 file_data=file_data,
                 filename=file.filename,
@@ -979,14 +1001,90 @@ if KNOWLEDGE_BASE_ENABLED:
                 user_id=user_id
             )
             
-            if result['success']:
-                return jsonify(result), 201
-            else:
+            if not result['success']:
                 return jsonify(result), 500
+            
+            # Mesmo arquivo já enviado a este chat: nada a processar
+            if result.get('duplicate'):
+                return jsonify(result), 200
+            
+            job = result.pop('job')
+            result['job_id'] = ingestion_queue.submit(job)
+            result['status_url'] = f"/api/chats/{chat_id}/documents/{result['document_id']}"
+            return jsonify(result), 202
                 
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)}), 500
 
+    @app.route('/api/chats/<chat_id>/documents/bulk', methods=['POST'])
+    @jwt_required()
+    def upload_documents_bulk(chat_id):
+        """Upload em lote: vários arquivos (campo 'files') e/ou ZIPs num único request"""
+        try:
+            user_id = get_jwt_identity()
+            
+            # Verificar se o chat pertence ao usuário
+            chat = chat_model.get_chat_by_id(chat_id, user_id)
+            if not chat:
+                return jsonify({'success': False, 'error': 'Chat não encontrado'}), 404
+            
+            files = request.files.getlist('files') + request.files.getlist('file')
+            if not files:
+                return jsonify({'success': False, 'error': 'Nenhum arquivo enviado'}), 400
+            
+            # Entradas lidas uma a uma; um único INSERT das linhas e depois o Storage em paralelo
+            skipped = []
+            results = knowledge_service.accept_documents(chat_id, iter_upload_entries(files, skipped), user_id)
+            
+            documents = []
+            for result in results:
+                job = result.pop('job', None)
+                if job:
+                    result['job_id'] = ingestion_queue.submit(job)
+                documents.append(result)
+            
+            accepted = sum(1 for doc in documents if doc['success'] and not doc.get('duplicate'))
+            duplicates = sum(1 for doc in documents if doc.get('duplicate'))
+            failed = [doc for doc in documents if not doc['success']]
+            print(f"📦 Lote no chat {chat_id}: {accepted} aceitos, {duplicates} duplicados, "
+                  f"{len(failed)} com erro, {len(skipped)} recusados")
+            
+            if accepted:
+                status_code = 202
+            elif duplicates:
+                status_code = 200
+            else:
+                status_code = 500 if failed else 400
+            
+            return jsonify({
+                'success': bool(accepted or duplicates),
+                'documents': documents,
+                'accepted': accepted,
+                'duplicates': duplicates,
+                'failed': len(failed),
+                'skipped': skipped
+            }), status_code
+                
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 500
+
+    @app.route('/api/chats/<chat_id>/documents/<document_id>', methods=['GET'])
+    @jwt_required()
+    def get_document_status(chat_id, document_id):
+        """Status do processamento de um documento (processing, completed, failed)"""
+        try:
+            user_id = get_jwt_identity()
+            chat = chat_model.get_chat_by_id(chat_id, user_id)
+            if not chat:
+                return jsonify({'success': False, 'error': 'Chat não encontrado'}), 404
+            
+            document = knowledge_service.get_document(document_id, chat_id)
+            if not document:
+                return jsonify({'success': False, 'error': 'Documento não encontrado'}), 404
+            return jsonify({'success': True, 'document': document}), 200
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 500
+
 # ================================
 # ROUTES DO SISTEMA
 # ================================
@@ -1035,6 +1133,15 @@ def health():
             'error': str(e)
         }), 503
 
+@app.route('/metrics')
+def metrics():
+    """Métricas internas (fila do Claude por prioridade, latência da busca, fila de ingestão)"""
+    return jsonify({
+        'scheduler': llm_scheduler.stats(),
+        'retrieval': retrieval_stats.stats(),
+        'ingestion': ingestion_queue.stats() if KNOWLEDGE_BASE_ENABLED else None
+    })
+
 # ================================
 # ROUTES DE FRONTEND
 # ================================
@@ -0,0 +1,166 @@
+"""
+Índice invertido BM25 por chat - busca de trechos de documentos
+Montado no upload e atualizado a cada documento enviado/removido; a consulta só
+percorre as listas dos termos da pergunta (sub-milissegundo para bases de clínicas).
+Forma serializada: JSON compactado com gzip (dumps/loads).
+Mesmo arquivo em backend/ e chat-engine/.
+"""
+
+import os
+import gzip
+import json
+import math
+import heapq
+from collections import Counter
+from text_normalizer import normalize_tokens, chunk_tokens
+from chunk_dedup import ChunkDeduplicator, chunk_fingerprint
+
+BM25_K1 = float(os.environ.get('BM25_K1', 1.2))
+BM25_B = float(os.environ.get('BM25_B', 0.75))
+INDEX_FORMAT_VERSION = 3
+
+# Campos do trecho guardados no índice (o suficiente para montar o contexto e reordenar)
+CHUNK_FIELDS = ('document_id', 'filename', 'chunk_index', 'start_offset', 'end_offset', 'content',
+                'token_count', 'tokens', 'fingerprint')
+
+def chunk_key(chunk):
+    return f"{chunk['document_id']}-{chunk['chunk_index']}"
+
+class BM25Index:
+    """Listas invertidas termo (radical normalizado, text_normalizer) -> {trecho: frequência}"""
+
+    def __init__(self, k1=None, b=None):
+        self.k1 = BM25_K1 if k1 is None else k1
+        self.b = BM25_B if b is None else b
+        self.chunks = {}      # chave -> trecho (com 'tf' e 'length')
+        self.postings = {}    # termo -> {chave: tf}
+        self.documents = {}   # document_id -> [chaves]
+        self.total_length = 0
+        self.dedup = ChunkDeduplicator()
+
+    @classmethod
+    def from_chunks(cls, chunks, **kwargs):
+        index = cls(**kwargs)
+        index.add_chunks(chunks)
+        return index
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def _add(self, key, chunk):
+        tokens = chunk_tokens(chunk)
+        tf = Counter(tokens)
+        length = len(tokens)
+        entry = {field: chunk.get(field) for field in CHUNK_FIELDS}
+        entry.update(tokens=' '.join(tokens), tf=tf, length=length)
+        self.chunks[key] = entry
+        self.documents.setdefault(chunk['document_id'], []).append(key)
+        self.total_length += length
+        for term, count in tf.items():
+            self.postings.setdefault(term, {})[key] = count
+
+    def add_chunks(self, chunks):
+        for chunk in chunks:
+            key = chunk_key(chunk)
+            if key in self.chunks or key in self.dedup.shadowed:
+                continue
+            # Quase idêntico a um trecho já indexado: fica fora da busca (chunk_dedup.py)
+            entry = {field: chunk.get(field) for field in CHUNK_FIELDS}
+            entry['tokens'] = ' '.join(chunk_tokens(chunk))
+            entry['fingerprint'] = chunk_fingerprint(entry)
+            if self.dedup.add(key, entry):
+                self._add(key, entry)
+
+    def add_document(self, document_id, filename, chunks):
+        """Indexar (ou reindexar) os trechos de um documento"""
+        self.remove_document(document_id)
+        self.add_chunks([dict(chunk, document_id=document_id, filename=filename) for chunk in chunks])
+
+    def remove_document(self, document_id):
+        keys = self.documents.pop(document_id, [])
+        for key in keys:
+            entry = self.chunks.pop(key)
+            self.total_length -= entry['length']
+            for term in entry['tf']:
+                postings = self.postings.get(term)
+                if postings is None:
+                    continue
+                postings.pop(key, None)
+                if not postings:
+                    del self.postings[term]
+        # Trechos de outros documentos que estavam colapsados sobre os removidos
+        self.add_chunks(self.dedup.remove_document(document_id, keys))
+
+    def search(self, query, k=10):
+        """[(trecho, score)] dos k trechos com maior BM25 para a pergunta"""
+        if not self.chunks:
+            return []
+        n = len(self.chunks)
+        avg_length = self.total_length / n or 1.0
+        scores = {}
+        for term in set(normalize_tokens(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for key, tf in postings.items():
+                length = self.chunks[key]['length']
+                norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (self.k1 + 1) / norm
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.chunks[key], score) for key, score in top]
+
+    def leading_chunks(self, k):
+        """Começo dos documentos, alternando entre eles (1º trecho de cada, depois o 2º...)"""
+        return heapq.nsmallest(
+            k, self.chunks.values(),
+            key=lambda chunk: (chunk['chunk_index'], chunk['document_id'])
+        )
+
+    def ranked_chunks(self, query, k=10):
+        """Trechos mais relevantes; se faltar, completa com o começo dos documentos"""
+        ranked = [chunk for chunk, score in self.search(query, k)]
+        if len(ranked) < k:
+            seen = {chunk_key(chunk) for chunk in ranked}
+            ranked += [chunk for chunk in self.leading_chunks(k) if chunk_key(chunk) not in seen][:k - len(ranked)]
+        return ranked
+
+    def dumps(self):
+        """Forma serializada (gzip + JSON); frequências e listas invertidas são refeitas no loads"""
+        data = {
+            'format': INDEX_FORMAT_VERSION,
+            'k1': self.k1,
+            'b': self.b,
+            'chunks': [{field: entry[field] for field in CHUNK_FIELDS} for entry in self.chunks.values()],
+            'collapsed': self.dedup.shadowed_chunks()
+        }
+        return gzip.compress(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+    @classmethod
+    def loads(cls, payload):
+        data = json.loads(gzip.decompress(payload).decode('utf-8'))
+        if data.get('format') != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Formato de índice não suportado: {data.get('format')}")
+        index = cls(k1=data['k1'], b=data['b'])
+        index.add_chunks(data['chunks'])
+        index.add_chunks(data['collapsed'])
+        return index
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.dumps())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.loads(f.read())
+
+    def stats(self):
+        return {
+            'chunks': len(self.chunks),
+            'documents': len(self.documents),
+            'terms': len(self.postings),
+            'collapsed': len(self.dedup),
+            'avg_chunk_length': round(self.total_length / len(self.chunks), 1) if self.chunks else 0
+        }
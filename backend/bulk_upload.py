@@ -0,0 +1,125 @@
+"""
+Upload em lote de documentos - vários arquivos e/ou arquivos ZIP num único request
+Os arquivos enviados ficam no disco temporário do Werkzeug e são passados adiante como
+(filename, content_type, read) para KnowledgeBaseService.accept_documents, que chama read()
+uma vez para o hash e outra para gravar no Storage (só a entrada atual vai para a memória).
+"""
+
+import os
+import zipfile
+
+# Tipos aceitos no upload de documentos (um arquivo ou lote)
+ALLOWED_CONTENT_TYPES = (
+    'application/pdf',
+    'text/plain',
+    'text/markdown',
+    'application/json',
+    'text/csv'
+)
+EXTENSION_TYPES = {
+    '.pdf': 'application/pdf',
+    '.txt': 'text/plain',
+    '.md': 'text/markdown',
+    '.json': 'application/json',
+    '.csv': 'text/csv'
+}
+ZIP_CONTENT_TYPES = ('application/zip', 'application/x-zip-compressed')
+
+MAX_FILE_BYTES = 10 * 1024 * 1024
+# Limites do lote (entradas e bytes descompactados somados) - proteção contra zip bomb
+BULK_MAX_FILES = int(os.environ.get('BULK_MAX_FILES', 100))
+BULK_MAX_BYTES = int(os.environ.get('BULK_MAX_BYTES', 200 * 1024 * 1024))
+
+def detect_content_type(filename, content_type=None):
+    """Tipo aceito do arquivo (o enviado pelo navegador ou pela extensão); None se não suportado"""
+    if content_type in ALLOWED_CONTENT_TYPES:
+        return content_type
+    return EXTENSION_TYPES.get(os.path.splitext(filename or '')[1].lower())
+
+def is_zip(file):
+    return file.content_type in ZIP_CONTENT_TYPES or (file.filename or '').lower().endswith('.zip')
+
+def iter_upload_entries(files, skipped):
+    """(filename, content_type, read) de cada documento dos arquivos enviados
+
+    files: FileStorage do Flask (documentos soltos ou ZIPs). Entradas recusadas vão para
+    `skipped` como {'filename', 'error'}; read() que falha (entrada do ZIP corrompida ou
+    maior que o declarado) vira erro no resultado de accept_documents.
+    """
+    budget = {'files': 0, 'bytes': 0}
+
+    def admit(filename, size):
+        if budget['files'] >= BULK_MAX_FILES:
+            skipped.append({'filename': filename, 'error': f'Limite de {BULK_MAX_FILES} arquivos por lote'})
+            return False
+        if size > MAX_FILE_BYTES:
+            skipped.append({'filename': filename, 'error': 'Arquivo muito grande (máximo 10MB)'})
+            return False
+        if budget['bytes'] + size > BULK_MAX_BYTES:
+            skipped.append({'filename': filename, 'error': 'Limite de tamanho do lote atingido'})
+            return False
+        budget['files'] += 1
+        budget['bytes'] += size
+        return True
+
+    for file in files:
+        if not file.filename:
+            continue
+
+        if is_zip(file):
+            yield from _iter_zip(file, admit, skipped)
+            continue
+
+        content_type = detect_content_type(file.filename, file.content_type)
+        if not content_type:
+            skipped.append({'filename': file.filename, 'error': f'Tipo de arquivo não suportado: {file.content_type}'})
+            continue
+        if admit(file.filename, _stream_size(file.stream)):
+            yield file.filename, content_type, _stream_reader(file.stream)
+
+def _stream_size(stream):
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+def _stream_reader(stream):
+    def read():
+        stream.seek(0)
+        return stream.read(MAX_FILE_BYTES + 1)
+    return read
+
+def _iter_zip(file, admit, skipped):
+    # Sem `with`: as entradas são lidas de novo depois do gerador terminar (o ZipFile não
+    # fecha file.stream, que o Werkzeug descarta no fim do request)
+    try:
+        archive = zipfile.ZipFile(file.stream)
+    except zipfile.BadZipFile:
+        skipped.append({'filename': file.filename, 'error': 'ZIP inválido'})
+        return
+
+    for info in archive.infolist():
+        name = os.path.basename(info.filename)
+        # Pastas e metadados do macOS/arquivos ocultos
+        if info.is_dir() or not name or name.startswith('.') or '__MACOSX' in info.filename:
+            continue
+        content_type = detect_content_type(name)
+        if not content_type:
+            skipped.append({'filename': info.filename, 'error': 'Tipo de arquivo não suportado'})
+            continue
+        if not admit(info.filename, info.file_size):
+            continue
+        yield name, content_type, _zip_reader(archive, info)
+
+def _zip_reader(archive, info):
+    def read():
+        try:
+            with archive.open(info) as entry:
+                # Não confiar no tamanho declarado no cabeçalho
+                data = entry.read(MAX_FILE_BYTES + 1)
+        except (zipfile.BadZipFile, RuntimeError, NotImplementedError) as e:
+            raise ValueError(f'Erro ao ler do ZIP: {e}')
+        if len(data) > MAX_FILE_BYTES:
+            raise ValueError('Arquivo muito grande (máximo 10MB)')
+        return data
+    return read
@@ -0,0 +1,118 @@
+"""
+Colapso de trechos quase idênticos nos índices do chat
+Cada trecho recebe uma impressão digital simhash (64 bits sobre pares de termos
+normalizados); trechos a até CHUNK_DEDUP_DISTANCE bits de um trecho já indexado não
+entram na busca e ficam guardados à parte. Se o trecho indexado sair (documento
+removido), o primeiro guardado assume o lugar. Mesma tabela de preços reenviada, rodapés
+repetidos em todas as páginas etc. deixam de ocupar vagas do contexto.
+Mesmo arquivo em backend/ e chat-engine/.
+"""
+
+import os
+import zlib
+from text_normalizer import chunk_tokens
+
+# Bits de diferença aceitos entre impressões (0 = só idênticos após normalização).
+# Trechos de 300 termos com ~2% de palavras trocadas ficam a ~5 bits; sem relação, 15+
+CHUNK_DEDUP_DISTANCE = int(os.environ.get('CHUNK_DEDUP_DISTANCE', 6))
+# Trechos com menos termos que isso não são colapsados (impressão pouco confiável)
+CHUNK_DEDUP_MIN_TOKENS = int(os.environ.get('CHUNK_DEDUP_MIN_TOKENS', 8))
+
+FINGERPRINT_BITS = 64
+
+def _shingle_hash(shingle):
+    data = shingle.encode('utf-8')
+    return (zlib.crc32(data) << 32) | zlib.crc32(data, 0x9E3779B9)
+
+def simhash(tokens):
+    """Impressão de 64 bits dos pares de termos consecutivos"""
+    shingles = [f"{a} {b}" for a, b in zip(tokens, tokens[1:])] or tokens
+    if not shingles:
+        return 0
+    # Contagem de bits 1 por posição via colunas das strings binárias (laço em C)
+    rows = [format(_shingle_hash(shingle), '064b') for shingle in shingles]
+    half = len(rows) / 2
+    bits = ''.join('1' if column.count('1') > half else '0' for column in zip(*rows))
+    return int(bits, 2)
+
+def chunk_fingerprint(chunk):
+    """Impressão do trecho em hexadecimal (a gravada no índice ou calculada na hora); '' se curto"""
+    fingerprint = chunk.get('fingerprint')
+    if fingerprint is not None:
+        return fingerprint
+    tokens = chunk_tokens(chunk)
+    if len(tokens) < CHUNK_DEDUP_MIN_TOKENS:
+        return ''
+    return format(simhash(tokens), '016x')
+
+class ChunkDeduplicator:
+    """Trechos canônicos (indexados) e trechos colapsados sobre eles"""
+
+    def __init__(self, distance=None):
+        self.distance = CHUNK_DEDUP_DISTANCE if distance is None else distance
+        # distance + 1 faixas: impressões a até `distance` bits são iguais em pelo menos uma
+        self.bands = self.distance + 1
+        self.band_bits = FINGERPRINT_BITS // self.bands
+        self.fingerprints = {}   # chave canônica -> impressão (int)
+        self._bands = {}         # (faixa, valor) -> {chaves canônicas}
+        self.shadowed = {}       # chave colapsada -> (chave canônica, trecho)
+        self._shadows = {}       # chave canônica -> [chaves colapsadas]
+
+    def __len__(self):
+        return len(self.shadowed)
+
+    def _band_keys(self, fingerprint):
+        mask = (1 << self.band_bits) - 1
+        return [(band, (fingerprint >> (band * self.band_bits)) & mask) for band in range(self.bands)]
+
+    def find(self, fingerprint):
+        """Chave canônica a até `distance` bits da impressão (ou None)"""
+        for band_key in self._band_keys(fingerprint):
+            for key in self._bands.get(band_key, ()):
+                if bin(self.fingerprints[key] ^ fingerprint).count('1') <= self.distance:
+                    return key
+        return None
+
+    def add(self, key, chunk):
+        """True: trecho novo, indexar; False: quase idêntico a um indexado, guardado à parte
+
+        chunk['fingerprint'] deve vir de chunk_fingerprint ('' = não colapsar).
+        """
+        if not chunk.get('fingerprint'):
+            return True
+        fingerprint = int(chunk['fingerprint'], 16)
+        canonical = self.find(fingerprint)
+        if canonical is not None:
+            self.shadowed[key] = (canonical, chunk)
+            self._shadows.setdefault(canonical, []).append(key)
+            return False
+        self.fingerprints[key] = fingerprint
+        for band_key in self._band_keys(fingerprint):
+            self._bands.setdefault(band_key, set()).add(key)
+        return True
+
+    def remove_document(self, document_id, keys):
+        """Esquecer os trechos do documento; retorna os colapsados de outros documentos que
+        perderam o canônico (o índice adiciona de novo com add)"""
+        for key, (canonical, chunk) in list(self.shadowed.items()):
+            if chunk['document_id'] == document_id:
+                del self.shadowed[key]
+                self._shadows[canonical].remove(key)
+
+        released = []
+        for key in keys:
+            fingerprint = self.fingerprints.pop(key, None)
+            if fingerprint is None:
+                continue
+            for band_key in self._band_keys(fingerprint):
+                members = self._bands[band_key]
+                members.discard(key)
+                if not members:
+                    del self._bands[band_key]
+            for shadow_key in self._shadows.pop(key, []):
+                released.append(self.shadowed.pop(shadow_key)[1])
+        return released
+
+    def shadowed_chunks(self):
+        """Trechos colapsados (para serializar junto do índice)"""
+        return [chunk for _, chunk in self.shadowed.values()]
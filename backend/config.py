@@ -22,29 +22,38 @@ class Config:
     JWT_ACCESS_TOKEN_EXPIRES = 3600  # 1 hora
     
     # Planos do SaaS
+    # max_concurrent_llm / llm_weight: teto e peso do cliente na fila do Claude (llm_scheduler.py)
     PLANS = {
         'free': {
             'name': 'Gratuito',
             'max_chats': 1,
             'max_messages_per_month': 100,
-            'price': 0
+            'price': 0,
+            'max_concurrent_llm': 1,
+            'llm_weight': 1
         },
         'basic': {
             'name': 'Básico',
             'max_chats': 3,
             'max_messages_per_month': 1000,
-            'price': 29.90
+            'price': 29.90,
+            'max_concurrent_llm': 2,
+            'llm_weight': 2
         },
         'premium': {
             'name': 'Premium',
             'max_chats': 10,
             'max_messages_per_month': 5000,
-            'price': 99.90
+            'price': 99.90,
+            'max_concurrent_llm': 4,
+            'llm_weight': 4
         },
         'enterprise': {
             'name': 'Enterprise',
             'max_chats': -1,  # ilimitado
             'max_messages_per_month': -1,  # ilimitado
-            'price': 299.90
+            'price': 299.90,
+            'max_concurrent_llm': 8,
+            'llm_weight': 8
         }
     }
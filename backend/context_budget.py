@@ -0,0 +1,203 @@
+"""
+Orçamento de contexto por requisição - system prompt, documentos e histórico
+Estima tokens localmente (sem chamar a API) e corta em fim de frase.
+Mesmo arquivo em backend/ e chat-engine/.
+"""
+
+import os
+import re
+import unicodedata
+
+# Português fica em torno de 3-4 caracteres por token no tokenizer do Claude
+CONTEXT_CHARS_PER_TOKEN = float(os.environ.get('CONTEXT_CHARS_PER_TOKEN', 3.5))
+# Teto de tokens de entrada por requisição (bem abaixo da janela do modelo: custo e latência)
+CONTEXT_INPUT_BUDGET = int(os.environ.get('CONTEXT_INPUT_BUDGET', 6000))
+# Fração máxima do orçamento para o system prompt do chat
+CONTEXT_SYSTEM_SHARE = float(os.environ.get('CONTEXT_SYSTEM_SHARE', 0.4))
+# Fração do que sobra reservada ao histórico (o restante vai para os documentos)
+CONTEXT_HISTORY_SHARE = float(os.environ.get('CONTEXT_HISTORY_SHARE', 0.35))
+
+# Janela de contexto por família de modelo (tokens)
+MODEL_CONTEXT_WINDOWS = {
+    'claude-3': 200000,
+    'claude-sonnet-4': 200000,
+    'claude-opus-4': 200000,
+}
+DEFAULT_CONTEXT_WINDOW = 200000
+
+# Overhead aproximado de cada mensagem/bloco (papel, delimitadores)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SENTENCE_END = re.compile(r'[.!?…](?=\s)|\n')
+WORD_RE = re.compile(r'\w+')
+
+def estimate_tokens(text):
+    """Estimativa local de tokens de um texto"""
+    if not text:
+        return 0
+    return int(len(text) / CONTEXT_CHARS_PER_TOKEN) + 1
+
+def estimate_messages_tokens(messages):
+    """Estimativa de tokens de uma lista de mensagens da Messages API"""
+    total = 0
+    for msg in messages:
+        content = msg.get('content', '')
+        if isinstance(content, list):
+            content = ' '.join(block.get('text', '') for block in content if isinstance(block, dict))
+        total += estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+    return total
+
+def context_window(model):
+    for prefix, window in MODEL_CONTEXT_WINDOWS.items():
+        if model and model.startswith(prefix):
+            return window
+    return DEFAULT_CONTEXT_WINDOW
+
+def input_budget(model=None, max_tokens=500, limit=None):
+    """Tokens de entrada disponíveis: teto configurado, limitado pela janela menos a saída"""
+    limit = limit or CONTEXT_INPUT_BUDGET
+    return max(0, min(limit, context_window(model) - (max_tokens or 0)))
+
+def truncate_to_tokens(text, max_tokens):
+    """Cortar texto no último fim de frase que cabe em max_tokens"""
+    if not text or max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    max_chars = int(max_tokens * CONTEXT_CHARS_PER_TOKEN)
+    head = text[:max_chars]
+
+    cut = None
+    for match in SENTENCE_END.finditer(head):
+        cut = match.end()
+    # Frase muito longa: corta na última palavra completa
+    if cut is None or cut < max_chars // 2:
+        space = head.rfind(' ')
+        cut = space if space > max_chars // 2 else max_chars
+    return head[:cut].rstrip()
+
+def _words(text):
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return {word for word in WORD_RE.findall(text) if len(word) > 2}
+
+def select_passages(text, query, max_tokens):
+    """Parágrafos mais relevantes para a query que cabem em max_tokens (ordem original)"""
+    paragraphs = [p.strip() for p in re.split(r'\n\s*\n', text) if p.strip()]
+    query_words = _words(query or '')
+    if not query_words or len(paragraphs) < 2:
+        return truncate_to_tokens(text, max_tokens)
+
+    ranked = sorted(
+        range(len(paragraphs)),
+        key=lambda i: len(query_words & _words(paragraphs[i])),
+        reverse=True
+    )
+
+    chosen = []
+    remaining = max_tokens
+    for i in ranked:
+        cost = estimate_tokens(paragraphs[i]) + 1
+        if cost <= remaining:
+            chosen.append(i)
+            remaining -= cost
+        elif not chosen:
+            # Nem o melhor parágrafo cabe inteiro: usa o começo dele
+            return truncate_to_tokens(paragraphs[i], max_tokens)
+
+    return '\n\n'.join(paragraphs[i] for i in sorted(chosen))
+
+def fit_documents(documents, max_tokens, query=None):
+    """Distribuir max_tokens entre documentos (em ordem de relevância)
+
+    documents: lista de {'filename', 'content'}. Cada documento recebe uma fatia
+    igual do que sobra; o que um documento curto não usa passa para os seguintes.
+    Retorna a lista com 'content' ajustado (documentos sem espaço ficam de fora).
+    """
+    fitted = []
+    remaining = max_tokens
+    documents = [doc for doc in documents if doc.get('content')]
+
+    for index, doc in enumerate(documents):
+        header_tokens = estimate_tokens(doc.get('filename', '')) + MESSAGE_OVERHEAD_TOKENS
+        share = remaining // (len(documents) - index) - header_tokens
+        if share <= 0:
+            continue
+
+        content = doc['content']
+        if estimate_tokens(content) > share:
+            content = select_passages(content, query, share) if query else truncate_to_tokens(content, share)
+        if not content:
+            continue
+
+        fitted.append(dict(doc, content=content))
+        remaining -= estimate_tokens(content) + header_tokens
+
+    return fitted
+
+def fit_history(messages, max_tokens):
+    """Mensagens mais recentes que cabem em max_tokens (conversa começando pelo usuário)"""
+    kept = []
+    used = 0
+    for msg in reversed(messages):
+        cost = estimate_messages_tokens([msg])
+        if used + cost > max_tokens:
+            break
+        kept.append(msg)
+        used += cost
+    kept.reverse()
+
+    while kept and kept[0].get('role') != 'user':
+        kept.pop(0)
+    return kept
+
+def assemble_context(system_prompt, documents, history, message, model=None, max_tokens=500,
+                     budget=None, documents_limit=None, summary=None):
+    """Montar o contexto de uma requisição dentro do orçamento de tokens
+
+    Prioridade: mensagem atual > system prompt (até CONTEXT_SYSTEM_SHARE) >
+    resumo da conversa (até CONTEXT_HISTORY_SHARE) > documentos (até documents_limit)
+    e histórico recente (CONTEXT_HISTORY_SHARE reservado ao histórico; o que os
+    documentos não usam fica para o histórico).
+
+    Retorna {'system_prompt', 'summary', 'documents', 'history', 'tokens'}.
+    """
+    total = input_budget(model, max_tokens, budget)
+    message_tokens = estimate_tokens(message) + MESSAGE_OVERHEAD_TOKENS
+
+    system_prompt = truncate_to_tokens(system_prompt or '', int(total * CONTEXT_SYSTEM_SHARE))
+    system_tokens = estimate_tokens(system_prompt)
+
+    remaining = max(0, total - message_tokens - system_tokens)
+    summary = truncate_to_tokens(summary or '', int(remaining * CONTEXT_HISTORY_SHARE))
+    summary_tokens = estimate_tokens(summary)
+    remaining -= summary_tokens
+    history = list(history or [])
+    history_reserve = min(estimate_messages_tokens(history), int(remaining * CONTEXT_HISTORY_SHARE))
+
+    documents_budget = remaining - history_reserve
+    if documents_limit is not None:
+        documents_budget = min(documents_budget, documents_limit)
+    documents = fit_documents(documents or [], documents_budget, query=message)
+    documents_tokens = sum(
+        estimate_tokens(doc['content']) + estimate_tokens(doc.get('filename', '')) + MESSAGE_OVERHEAD_TOKENS
+        for doc in documents
+    )
+
+    history = fit_history(history, remaining - documents_tokens)
+
+    return {
+        'system_prompt': system_prompt,
+        'summary': summary,
+        'documents': documents,
+        'history': history,
+        'tokens': {
+            'budget': total,
+            'system': system_tokens,
+            'summary': summary_tokens,
+            'documents': documents_tokens,
+            'history': estimate_messages_tokens(history),
+            'message': message_tokens
+        }
+    }
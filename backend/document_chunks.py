@@ -0,0 +1,190 @@
+"""
+Trechos (chunks) de documentos - gerados no upload e usados na busca
+Documentos são divididos em trechos com sobreposição, alinhados em fim de frase,
+com offsets de caractere no processed_content original (tabela chat_document_chunks).
+A busca (bm25_index.py) escolhe trechos em vez do começo dos documentos.
+Mesmo arquivo em backend/ e chat-engine/.
+"""
+
+import os
+import re
+from context_budget import estimate_tokens, CONTEXT_CHARS_PER_TOKEN
+
+CHUNK_TOKENS = int(os.environ.get('CHUNK_TOKENS', 300))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get('CHUNK_OVERLAP_TOKENS', 60))
+
+CHUNKS_TABLE = "saas_chat_generator.chat_document_chunks"
+DOCUMENTS_TABLE = "saas_chat_generator.chat_documents"
+
+# Fim de frase (pontuação seguida de espaço) ou quebra de linha
+SENTENCE_BOUNDARY = re.compile(r'[.!?…]+(?=\s)|\n+')
+
+def _sentence_spans(text, max_tokens):
+    """(início, fim) de cada frase; frases maiores que max_tokens são quebradas em palavras"""
+    spans = []
+    start = 0
+    for match in SENTENCE_BOUNDARY.finditer(text):
+        spans.append((start, match.end()))
+        start = match.end()
+    spans.append((start, len(text)))
+
+    max_chars = max(1, int(max_tokens * CONTEXT_CHARS_PER_TOKEN))
+    result = []
+    for start, end in spans:
+        # Ignorar espaços nas pontas (offsets continuam exatos)
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        while end - start > max_chars:
+            cut = text.rfind(' ', start, start + max_chars)
+            cut = cut if cut > start else start + max_chars
+            result.append((start, cut))
+            start = cut
+            while start < end and text[start].isspace():
+                start += 1
+        if end > start:
+            result.append((start, end))
+    return result
+
+def chunk_text(text, chunk_tokens=None, overlap_tokens=None):
+    """Dividir texto em trechos sobrepostos alinhados em frases
+
+    Retorna lista de {'chunk_index', 'start_offset', 'end_offset', 'content', 'token_count'};
+    content == text[start_offset:end_offset].
+    """
+    chunk_tokens = chunk_tokens or CHUNK_TOKENS
+    overlap_tokens = CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    overlap_tokens = min(overlap_tokens, chunk_tokens // 2)
+    if not text or not text.strip():
+        return []
+
+    spans = _sentence_spans(text, chunk_tokens)
+    costs = [estimate_tokens(text[start:end]) for start, end in spans]
+
+    chunks = []
+    first = 0
+    while first < len(spans):
+        last, used = first, costs[first]
+        while last + 1 < len(spans) and used + costs[last + 1] <= chunk_tokens:
+            last += 1
+            used += costs[last]
+
+        start, end = spans[first][0], spans[last][1]
+        chunks.append({
+            'chunk_index': len(chunks),
+            'start_offset': start,
+            'end_offset': end,
+            'content': text[start:end],
+            'token_count': estimate_tokens(text[start:end])
+        })
+        if last + 1 >= len(spans):
+            break
+
+        # Próximo trecho repete as últimas frases (até overlap_tokens), sempre avançando
+        next_first, overlap = last + 1, 0
+        while next_first - 1 > first and overlap + costs[next_first - 1] <= overlap_tokens:
+            next_first -= 1
+            overlap += costs[next_first]
+        first = next_first
+
+    return chunks
+
+def fetch_chat_chunks(bigquery_client, project_id, chat_id):
+    """Trechos de todos os documentos do chat
+
+    Só documentos com processing_status 'completed' (JOIN com chat_documents): trechos de
+    documentos removidos ou ainda em processamento nunca entram na busca.
+    Documentos enviados antes da tabela de trechos são divididos na hora (sem termos/embedding).
+    Retorna lista de {'document_id', 'filename', 'chunk_index', 'start_offset',
+    'end_offset', 'content', 'token_count', 'tokens', 'embedding', 'fingerprint'}.
+    """
+    from google.cloud import bigquery
+
+    query = f"""
+    SELECT document_id, c.filename, c.chunk_index, c.start_offset, c.end_offset, c.content, c.token_count,
+           c.tokens, c.embedding, c.fingerprint
+    FROM `{project_id}.{CHUNKS_TABLE}` c
+    JOIN `{project_id}.{DOCUMENTS_TABLE}` d USING (document_id)
+    WHERE c.chat_id = @chat_id AND d.chat_id = @chat_id AND d.processing_status = 'completed'
+    ORDER BY document_id, c.chunk_index
+    """
+    legacy_query = f"""
+    SELECT document_id, filename, processed_content
+    FROM `{project_id}.{DOCUMENTS_TABLE}` d
+    WHERE chat_id = @chat_id AND processing_status = 'completed'
+      AND document_id NOT IN (
+        SELECT DISTINCT document_id FROM `{project_id}.{CHUNKS_TABLE}` WHERE chat_id = @chat_id
+      )
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter("chat_id", "STRING", chat_id)]
+    )
+
+    chunks = [dict(row) for row in bigquery_client.query(query, job_config=job_config).result()]
+    for doc in bigquery_client.query(legacy_query, job_config=job_config).result():
+        for chunk in chunk_text(doc['processed_content'] or ''):
+            chunk.update(document_id=doc['document_id'], filename=doc['filename'])
+            chunks.append(chunk)
+    return chunks
+
+def fetch_document_chunks(bigquery_client, project_id, document_id):
+    """Trechos já processados de um documento (reaproveitados por uploads de mesmo conteúdo)"""
+    from google.cloud import bigquery
+
+    query = f"""
+    SELECT chunk_index, start_offset, end_offset, content, token_count, tokens, embedding, fingerprint
+    FROM `{project_id}.{CHUNKS_TABLE}`
+    WHERE document_id = @document_id
+    ORDER BY chunk_index
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter("document_id", "STRING", document_id)]
+    )
+    return [dict(row) for row in bigquery_client.query(query, job_config=job_config).result()]
+
+def select_chunks(ranked, max_tokens, max_chunks=None):
+    """Melhores trechos que cabem em max_tokens, agrupados por documento
+
+    Trechos vizinhos do mesmo documento são unidos pelos offsets (sem repetir a
+    sobreposição). Retorna lista de {'filename', 'content'} no formato de fit_documents.
+    """
+    chosen, used = [], 0
+    for chunk in ranked:
+        if max_chunks and len(chosen) >= max_chunks:
+            break
+        cost = chunk.get('token_count') or estimate_tokens(chunk['content'])
+        if used + cost > max_tokens:
+            continue
+        chosen.append(chunk)
+        used += cost
+
+    # Ordem do documento (relevância do melhor trecho decide a ordem dos documentos)
+    order = []
+    by_document = {}
+    for chunk in chosen:
+        key = chunk.get('document_id') or chunk.get('filename')
+        if key not in by_document:
+            order.append(key)
+            by_document[key] = []
+        by_document[key].append(chunk)
+
+    documents = []
+    for key in order:
+        parts = sorted(by_document[key], key=lambda chunk: chunk['start_offset'])
+        passages = []
+        current, current_end = parts[0]['content'], parts[0]['end_offset']
+        previous_index = parts[0].get('chunk_index')
+        for chunk in parts[1:]:
+            if chunk['start_offset'] <= current_end:
+                current += chunk['content'][current_end - chunk['start_offset']:]
+            elif previous_index is not None and chunk.get('chunk_index') == previous_index + 1:
+                current += ' ' + chunk['content']  # trecho seguinte, separado só por espaço
+            else:
+                passages.append(current)
+                current = chunk['content']
+            current_end = max(current_end, chunk['end_offset'])
+            previous_index = chunk.get('chunk_index')
+        passages.append(current)
+        documents.append({'filename': parts[0]['filename'], 'content': '\n[...]\n'.join(passages)})
+    return documents
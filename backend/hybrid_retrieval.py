@@ -0,0 +1,181 @@
+"""
+Busca híbrida nos documentos do chat
+BM25 e busca vetorial rodam em paralelo, as listas são unidas por reciprocal rank fusion
+(RRF) e os melhores candidatos são reordenados por sinais locais baratos: proximidade
+dos termos da pergunta, números exatos (preços, telefones, endereços) e títulos.
+Latência de cada etapa em retrieval_stats (/metrics).
+Mesmo arquivo em backend/ e chat-engine/.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from bm25_index import chunk_key
+from text_normalizer import normalize_tokens, chunk_tokens
+
+# Candidatos de cada busca antes da fusão
+HYBRID_CANDIDATES = int(os.environ.get('HYBRID_CANDIDATES', 30))
+# Constante do RRF: score = soma de 1 / (RRF_K + posição)
+RRF_K = int(os.environ.get('RRF_K', 60))
+# Candidatos fundidos que passam pela reordenação
+RERANK_TOP = int(os.environ.get('RERANK_TOP', 20))
+HYBRID_WORKERS = int(os.environ.get('HYBRID_WORKERS', 4))
+
+# Peso de cada sinal somado ao score RRF normalizado (0 a 1)
+PROXIMITY_WEIGHT = 0.5
+NUMBER_WEIGHT = 0.6
+HEADING_WEIGHT = 0.3
+
+STAGES = ('bm25', 'vector', 'fusion', 'rerank', 'total')
+
+_executor = ThreadPoolExecutor(max_workers=HYBRID_WORKERS, thread_name_prefix='retrieval')
+
+def _proximity(terms, tokens):
+    """Fração dos termos presentes, ponderada pela menor janela que os contém"""
+    positions = [(position, token) for position, token in enumerate(tokens) if token in terms]
+    found = {token for _, token in positions}
+    if not found:
+        return 0.0
+    if len(found) == 1:
+        return 1 / len(terms)
+
+    # Menor janela com todos os termos encontrados (janela deslizante)
+    best = len(tokens)
+    counts = {}
+    left = 0
+    for right, (position, token) in enumerate(positions):
+        counts[token] = counts.get(token, 0) + 1
+        while len(counts) == len(found):
+            best = min(best, position - positions[left][0] + 1)
+            left_token = positions[left][1]
+            counts[left_token] -= 1
+            if not counts[left_token]:
+                del counts[left_token]
+            left += 1
+    return len(found) / len(terms) * min(1.0, len(found) / best)
+
+def _headings(content):
+    """Linhas com cara de título: markdown (#), caixa alta ou curtas terminando em ':'"""
+    headings = []
+    for line in (content or '').splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        short = len(line.split()) <= 8
+        if line.startswith('#') or (short and (line.isupper() or line.endswith(':'))):
+            headings.append(line)
+    return headings
+
+def rerank_features(query_tokens, chunk):
+    """Sinais locais do trecho para a pergunta (cada um entre 0 e 1)
+
+    query_tokens: pergunta já normalizada; os termos do trecho vêm do upload.
+    """
+    terms = {token for token in query_tokens if not token[0].isdigit()}
+    numbers = {token for token in query_tokens if token[0].isdigit()}
+    tokens = chunk_tokens(chunk)
+    features = {'proximity': 0.0, 'number': 0.0, 'heading': 0.0}
+    if terms:
+        features['proximity'] = _proximity(terms, tokens)
+        heading_terms = {token for heading in _headings(chunk['content']) for token in normalize_tokens(heading)}
+        features['heading'] = len(terms & heading_terms) / len(terms)
+    if numbers:
+        features['number'] = len(numbers & set(tokens)) / len(numbers)
+    return features
+
+def reciprocal_rank_fusion(rankings, k=None):
+    """[(trecho, score)] unindo listas ordenadas de trechos"""
+    k = RRF_K if k is None else k
+    scores, chunks = {}, {}
+    for ranking in rankings:
+        for position, chunk in enumerate(ranking):
+            key = chunk_key(chunk)
+            chunks[key] = chunk
+            scores[key] = scores.get(key, 0.0) + 1 / (k + position + 1)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [(chunks[key], scores[key]) for key in ordered]
+
+def rerank(query, fused):
+    """Reordenar [(trecho, score RRF)] somando os sinais locais ao score normalizado"""
+    if not fused:
+        return []
+    query_tokens = normalize_tokens(query)
+    top_score = fused[0][1]
+    rescored = []
+    for chunk, score in fused:
+        features = rerank_features(query_tokens, chunk)
+        rescored.append((chunk, score / top_score
+                         + PROXIMITY_WEIGHT * features['proximity']
+                         + NUMBER_WEIGHT * features['number']
+                         + HEADING_WEIGHT * features['heading']))
+    rescored.sort(key=lambda item: item[1], reverse=True)
+    return rescored
+
+def _timed(timings, stage, fn, *args):
+    started = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        timings[f'{stage}_ms'] = round((time.perf_counter() - started) * 1000, 3)
+
+def hybrid_search(indexes, query, k=10):
+    """Trechos mais relevantes combinando os índices do chat
+
+    indexes: {'bm25': BM25Index, 'vector': VectorIndex (opcional)}.
+    Retorna (trechos, timings); completa com o começo dos documentos se faltar.
+    """
+    started = time.perf_counter()
+    timings = {}
+
+    searches = {
+        name: _executor.submit(_timed, timings, name, index.search, query, HYBRID_CANDIDATES)
+        for name, index in indexes.items()
+        if name in ('bm25', 'vector') and len(index)
+    }
+    rankings = [[chunk for chunk, _ in future.result()] for future in searches.values()]
+
+    fused = _timed(timings, 'fusion', reciprocal_rank_fusion, rankings)
+    ranked = _timed(timings, 'rerank', rerank, query, fused[:RERANK_TOP]) + fused[RERANK_TOP:]
+    chunks = [chunk for chunk, _ in ranked[:k]]
+
+    if len(chunks) < k and 'bm25' in indexes:
+        seen = {chunk_key(chunk) for chunk in chunks}
+        chunks += [chunk for chunk in indexes['bm25'].leading_chunks(k) if chunk_key(chunk) not in seen][:k - len(chunks)]
+
+    timings['total_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    retrieval_stats.record(timings)
+    return chunks, timings
+
+class RetrievalStats:
+    """Latência por etapa da busca (janela das últimas buscas)"""
+
+    def __init__(self, window=500):
+        self._latencies = {stage: deque(maxlen=window) for stage in STAGES}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def record(self, timings):
+        with self._lock:
+            self._count += 1
+            for stage in STAGES:
+                if f'{stage}_ms' in timings:
+                    self._latencies[stage].append(timings[f'{stage}_ms'])
+
+    def stats(self):
+        with self._lock:
+            stages = {}
+            for stage, samples in self._latencies.items():
+                if not samples:
+                    continue
+                ordered = sorted(samples)
+                stages[stage] = {
+                    'p50_ms': ordered[len(ordered) // 2],
+                    'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                    'max_ms': ordered[-1]
+                }
+            return {'searches': self._count, 'stages': stages}
+
+# Instância global
+retrieval_stats = RetrievalStats()
@@ -0,0 +1,163 @@
+"""
+Fila de processamento de documentos (ingestão assíncrona)
+O upload grava o arquivo no Storage, cria a linha com processing_status='processing' e
+responde 202; threads desta fila fazem extração, trechos e índices e mudam o status para
+completed/failed. Cada job é gravado num diário local (JSONL) antes de entrar na fila e os
+jobs sem 'done' são retomados quando o processo sobe de novo.
+Fila em processo: submit/handler são a interface para trocar por Cloud Tasks/PubSub depois.
+"""
+
+import os
+import json
+import time
+import uuid
+import queue
+import threading
+
+INGESTION_WORKERS = int(os.environ.get('INGESTION_WORKERS', 2))
+INGESTION_JOURNAL_DIR = os.environ.get('INGESTION_JOURNAL_DIR', '/tmp/ingestion')
+# Tentativas por job (erros de Storage/BigQuery) antes de marcar como failed
+INGESTION_MAX_ATTEMPTS = int(os.environ.get('INGESTION_MAX_ATTEMPTS', 3))
+INGESTION_RETRY_SECONDS = float(os.environ.get('INGESTION_RETRY_SECONDS', 5))
+
+class IngestionQueue:
+    """Jobs de documento processados por handler(job) em threads
+
+    on_failure(job, erro) é chamado quando as tentativas acabam.
+    """
+
+    def __init__(self, handler, on_failure=None, workers=None, journal_dir=None):
+        self.handler = handler
+        self.on_failure = on_failure
+        self.workers = workers or INGESTION_WORKERS
+        self.journal_path = os.path.join(journal_dir or INGESTION_JOURNAL_DIR, 'jobs.jsonl')
+
+        self._queue = queue.Queue()
+        self._journal_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._threads = []
+        self._in_progress = 0
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+        self.recovered = 0
+        self.last_seconds = None
+
+    def start(self):
+        """Retomar jobs pendentes do diário e subir as threads"""
+        if self._threads:
+            return
+        for job in self._replay_journal():
+            self._queue.put(job)
+            self.recovered += 1
+        if self.recovered:
+            print(f"📥 {self.recovered} documento(s) pendente(s) retomado(s) do diário")
+
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'ingestion-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, job):
+        """Gravar o job no diário e enfileirar; retorna o job_id"""
+        job = dict(job, job_id=job.get('job_id') or str(uuid.uuid4()), attempts=0)
+        self._append({'event': 'submitted', 'job': job})
+        with self._stats_lock:
+            self.submitted += 1
+        self._queue.put(job)
+        return job['job_id']
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            with self._stats_lock:
+                self._in_progress += 1
+            started = time.perf_counter()
+            try:
+                job['attempts'] += 1
+                self.handler(job)
+                self._finish(job, 'completed')
+            except Exception as e:
+                if job['attempts'] < INGESTION_MAX_ATTEMPTS:
+                    print(f"⚠️ Documento {job.get('document_id')} falhou (tentativa {job['attempts']}), repetindo: {e}")
+                    with self._stats_lock:
+                        self.retries += 1
+                    threading.Timer(INGESTION_RETRY_SECONDS * job['attempts'], self._queue.put, args=(job,)).start()
+                else:
+                    print(f"❌ Documento {job.get('document_id')} falhou: {e}")
+                    if self.on_failure:
+                        try:
+                            self.on_failure(job, str(e))
+                        except Exception as failure_error:
+                            print(f"Erro ao marcar documento como failed: {failure_error}")
+                    self._finish(job, 'failed')
+            finally:
+                with self._stats_lock:
+                    self._in_progress -= 1
+                    self.last_seconds = round(time.perf_counter() - started, 3)
+                self._queue.task_done()
+
+    def _finish(self, job, status):
+        self._append({'event': 'done', 'job_id': job['job_id'], 'status': status})
+        with self._stats_lock:
+            if status == 'completed':
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def _append(self, record):
+        """Uma linha no diário (fsync: o job sobrevive a um restart logo após o 202)"""
+        try:
+            with self._journal_lock:
+                os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+                with open(self.journal_path, 'a', encoding='utf-8') as journal:
+                    journal.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    journal.flush()
+                    os.fsync(journal.fileno())
+        except OSError as e:
+            print(f"⚠️ Diário de ingestão indisponível: {e}")
+
+    def _replay_journal(self):
+        """Jobs submetidos sem 'done'; reescreve o diário só com eles (compactação)"""
+        pending = {}
+        try:
+            with open(self.journal_path, encoding='utf-8') as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # linha cortada por um crash no meio da escrita
+                    if record.get('event') == 'submitted':
+                        pending[record['job']['job_id']] = record['job']
+                    elif record.get('event') == 'done':
+                        pending.pop(record.get('job_id'), None)
+        except FileNotFoundError:
+            return []
+        except OSError as e:
+            print(f"⚠️ Erro ao ler diário de ingestão: {e}")
+            return []
+
+        jobs = [dict(job, attempts=0) for job in pending.values()]
+        with self._journal_lock:
+            temp_path = self.journal_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as journal:
+                for job in jobs:
+                    journal.write(json.dumps({'event': 'submitted', 'job': job}, ensure_ascii=False) + '\n')
+            os.replace(temp_path, self.journal_path)
+        return jobs
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'workers': self.workers,
+                'queued': self._queue.qsize(),
+                'in_progress': self._in_progress,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'retries': self.retries,
+                'recovered': self.recovered,
+                'last_seconds': self.last_seconds
+            }
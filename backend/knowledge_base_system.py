@@ -4,6 +4,7 @@ Sistema de Knowledge Base - Upload de documentos e integração GitHub
 
 import os
 import uuid
+import hashlib
 import requests
 import PyPDF2
 import markdown
@@ -11,9 +12,46 @@ from io import BytesIO
 from flask import Flask, request, jsonify, render_template
 from google.cloud import storage
 from google.cloud import bigquery
+from google.api_core.exceptions import NotFound, PreconditionFailed
 from datetime import datetime, timezone
 import base64
 import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from document_chunks import chunk_text, fetch_chat_chunks, fetch_document_chunks, select_chunks
+from bm25_index import BM25Index
+from hybrid_retrieval import hybrid_search
+from text_normalizer import normalize_tokens, fold
+from chunk_dedup import chunk_fingerprint
+from pdf_extraction import extract_pdf_text
+
+# Busca vetorial local (NumPy) - opcional
+try:
+    from vector_index import VectorIndex, embed_text, encode_embedding
+    VECTOR_SEARCH_AVAILABLE = True
+except ImportError:
+    VECTOR_SEARCH_AVAILABLE = False
+
+# Tamanho aproximado de cada MERGE de trechos (limite de tamanho da requisição do BigQuery)
+CHUNK_INSERT_BYTES = int(os.environ.get('CHUNK_INSERT_BYTES', 2 * 1024 * 1024))
+
+# Uploads simultâneos para o Storage num lote (accept_documents)
+BULK_UPLOAD_WORKERS = int(os.environ.get('BULK_UPLOAD_WORKERS', 8))
+
+# hybrid (BM25 + vetorial com RRF), bm25 (palavras) ou vector (embeddings locais)
+KNOWLEDGE_RETRIEVAL = os.environ.get('KNOWLEDGE_RETRIEVAL', 'hybrid')
+
+# Índices por chat salvos em chats/{chat_id}/index/ no bucket
+INDEX_TYPES = {'bm25': (BM25Index, 'bm25.json.gz', 'application/gzip')}
+if VECTOR_SEARCH_AVAILABLE:
+    INDEX_TYPES['vector'] = (VectorIndex, 'vectors.npz', 'application/octet-stream')
+
+def normalized_text_hash(text):
+    """SHA-256 do texto sem acento, minúsculas e espaços colapsados (mesmo PDF reexportado)"""
+    return hashlib.sha256(' '.join(fold(text).split()).encode('utf-8')).hexdigest()
+
+class DocumentProcessingError(Exception):
+    """Arquivo ilegível (PDF corrompido, encoding inválido) - não adianta repetir"""
 
 class KnowledgeBaseService:
     def __init__(self, project_id='flower-ai-generator'):
@@ -21,8 +59,20 @@ class KnowledgeBaseService:
         self.bucket_name = f'{project_id}-chat-knowledge'
         self.storage_client = storage.Client(project=project_id)
         self.bigquery_client = bigquery.Client(project=project_id)
+        self._change_listeners = []
         self._ensure_bucket_exists()
     
+    def add_change_listener(self, listener):
+        """Registrar callback(chat_id) chamado quando os documentos de um chat mudam"""
+        self._change_listeners.append(listener)
+    
+    def _notify_change(self, chat_id):
+        for listener in self._change_listeners:
+            try:
+                listener(chat_id)
+            except Exception as e:
+                print(f"Erro ao notificar mudança de documentos: {e}")
+    
     def _ensure_bucket_exists(self):
         """Criar bucket se não existir"""
         try:
@@ -34,58 +84,491 @@ class KnowledgeBaseService:
             print(f"Bucket {self.bucket_name} criado")
     
     def upload_document(self, chat_id, file_data, filename, content_type, user_id=None):
-        """Upload de documento para o storage"""
+        """Upload de documento processado na hora (importação do GitHub)
+
+        Uploads pela API usam accept_document + fila de ingestão (ingestion_queue.py).
+        """
+        accepted = self.accept_document(chat_id, file_data, filename, content_type, user_id)
+        if not accepted['success'] or accepted.get('duplicate'):
+            return accepted
         try:
-            # Gerar ID único para o documento
-            doc_id = str(uuid.uuid4())
-            
-            # Path no storage
-            storage_path = f"chats/{chat_id}/documents/{doc_id}-{filename}"
-            
-            # Upload para Cloud Storage
-            bucket = self.storage_client.bucket(self.bucket_name)
-            blob = bucket.blob(storage_path)
-            blob.upload_from_string(file_data, content_type=content_type)
+            return self.process_document(accepted['job'], file_data=file_data)
+        except Exception as e:
+            self.mark_document_failed(accepted['job'], str(e))
+            return {'success': False, 'document_id': accepted['document_id'], 'error': str(e)}
+    
+    def accept_document(self, chat_id, file_data, filename, content_type, user_id=None):
+        """Gravar a linha do documento com status 'processing' e o arquivo no Storage
+        
+        Retorna o job para process_document (extração, trechos e índices). Arquivo
+        idêntico já enviado ao chat devolve o documento existente (duplicate=True).
+        """
+        try:
+            return self.accept_documents(chat_id, [(filename, content_type, lambda: file_data)], user_id)[0]
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
+    def accept_documents(self, chat_id, files, user_id=None):
+        """accept_document para um lote: uma consulta de duplicados, um único INSERT com
+        todas as linhas e depois o Storage em paralelo
+        
+        files: iterável de (filename, content_type, read), read() devolve os bytes e pode
+        ser chamado de novo. O lote é lido duas vezes: para o hash (um arquivo por vez em
+        memória) e para a gravação (no máximo 2 x BULK_UPLOAD_WORKERS). As linhas entram
+        antes dos arquivos para um delete_document concorrente enxergar a referência
+        (ver _release_storage); se o INSERT falhar, nada foi gravado no Storage.
+        Retorna um resultado por arquivo, na ordem.
+        """
+        entries = []
+        for filename, content_type, read in files:
+            try:
+                file_data = read()
+            except Exception as e:
+                entries.append({'filename': filename, 'error': str(e)})
+                continue
+            entries.append({
+                'filename': filename,
+                'content_type': content_type,
+                'read': read,
+                'file_size': len(file_data),
+                'content_hash': hashlib.sha256(file_data).hexdigest()
+            })
+            del file_data
+        
+        existing = self._find_chat_duplicates(
+            chat_id, [entry['content_hash'] for entry in entries if 'content_hash' in entry]
+        )
+        uploaded_at = datetime.now(timezone.utc)
+        results, rows, to_store = [], [], {}
+        for entry in entries:
+            filename = entry['filename']
+            if 'error' in entry:
+                results.append({'success': False, 'filename': filename, 'error': entry['error']})
+                continue
             
-            # Processar conteúdo do documento
-            processed_content = self._process_document(file_data, content_type, filename)
+            content_hash = entry['content_hash']
+            duplicate = existing.get(content_hash)
+            if duplicate:
+                print(f"♻️ {filename} já está no chat {chat_id} ({duplicate['document_id']})")
+                results.append(dict(duplicate, success=True, duplicate=True, filename=filename))
+                continue
             
-            # Salvar metadados no BigQuery
-            document_data = {
+            # Gerar ID único para o documento
+            doc_id = str(uuid.uuid4())
+            storage_path = f"content/{content_hash}"
+            to_store.setdefault(content_hash, entry)
+            row = {
                 'document_id': doc_id,
-            'user_id': user_id,
+                'user_id': user_id,
                 'chat_id': chat_id,
                 'filename': filename,
-                'original_filename': filename,
-                'file_type': content_type,
-                'file_size': len(file_data),
+                'file_type': entry['content_type'],
+                'file_size': entry['file_size'],
                 'storage_path': storage_path,
-                'processed_content': processed_content,
-                'content_summary': self._summarize_content(processed_content),
-                'processing_status': 'completed',
-                'uploaded_at': datetime.now(timezone.utc).isoformat()
+                'content_hash': content_hash,
+                'uploaded_at': uploaded_at
             }
-            
-            # Inserir no BigQuery
-            table_ref = f"{self.project_id}.saas_chat_generator.chat_documents"
-            errors = self.bigquery_client.insert_rows_json(table_ref, [document_data])
-            
-            if not errors:
-                return {
-                    'success': True,
+            rows.append(row)
+            # Mesmo arquivo repetido dentro do lote
+            existing[content_hash] = {'document_id': doc_id, 'storage_path': storage_path,
+                                      'processing_status': 'processing'}
+            results.append({
+                'success': True,
+                'filename': filename,
+                'document_id': doc_id,
+                'storage_path': storage_path,
+                'processing_status': 'processing',
+                'job': {
                     'document_id': doc_id,
-            'user_id': user_id,
+                    'chat_id': chat_id,
+                    'user_id': user_id,
+                    'filename': filename,
+                    'content_type': entry['content_type'],
                     'storage_path': storage_path,
-                    'processed_content': processed_content[:500] + '...' if len(processed_content) > 500 else processed_content
+                    'content_hash': content_hash
                 }
-            else:
-                return {'success': False, 'error': f'Erro no BigQuery: {errors}'}
-                
+            })
+        
+        if not rows:
+            return results
+        self._insert_document_rows(rows)
+        
+        # Um upload por conteúdo novo; linhas cujo arquivo não foi gravado ficam failed
+        errors = {}
+        in_flight = threading.BoundedSemaphore(BULK_UPLOAD_WORKERS * 2)
+        with ThreadPoolExecutor(max_workers=BULK_UPLOAD_WORKERS, thread_name_prefix='storage') as executor:
+            futures = {}
+            for content_hash, entry in to_store.items():
+                in_flight.acquire()
+                future = executor.submit(self._store_entry, content_hash, entry)
+                future.add_done_callback(lambda _: in_flight.release())
+                futures[content_hash] = future
+            for content_hash, future in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    errors[content_hash] = str(e)
+        
+        for index, result in enumerate(results):
+            job = result.get('job')
+            if not job or job['content_hash'] not in errors:
+                continue
+            error = errors[job['content_hash']]
+            print(f"❌ Erro ao gravar {job['filename']} no Storage: {error}")
+            try:
+                self.mark_document_failed(job, error)
+            except Exception as e:
+                print(f"Erro ao marcar documento como failed: {e}")
+            results[index] = {'success': False, 'filename': job['filename'],
+                              'document_id': job['document_id'], 'error': error}
+        return results
+    
+    def _store_entry(self, content_hash, entry):
+        """Ler de novo o arquivo do lote e gravar no Storage (conferindo o hash da 1ª leitura)"""
+        file_data = entry['read']()
+        if hashlib.sha256(file_data).hexdigest() != content_hash:
+            raise ValueError('Arquivo mudou entre as leituras do lote')
+        return self._store_content(content_hash, file_data, entry['content_type'])
+    
+    def _insert_document_rows(self, rows):
+        """Linhas 'processing' num único INSERT por DML
+        
+        DML em vez de insert_rows_json: linhas no streaming buffer não aceitam UPDATE, e o
+        status muda logo em seguida.
+        """
+        query = f"""
+        INSERT INTO `{self.project_id}.saas_chat_generator.chat_documents`
+        (document_id, user_id, chat_id, filename, original_filename, file_type, file_size,
+         storage_path, content_hash, processing_status, uploaded_at)
+        SELECT document_id, user_id, chat_id, filename, filename, file_type, file_size,
+               storage_path, content_hash, 'processing', uploaded_at
+        FROM UNNEST(@documents)
+        """
+        documents = [
+            bigquery.StructQueryParameter(
+                None,
+                bigquery.ScalarQueryParameter("document_id", "STRING", row['document_id']),
+                bigquery.ScalarQueryParameter("user_id", "STRING", row['user_id']),
+                bigquery.ScalarQueryParameter("chat_id", "STRING", row['chat_id']),
+                bigquery.ScalarQueryParameter("filename", "STRING", row['filename']),
+                bigquery.ScalarQueryParameter("file_type", "STRING", row['file_type']),
+                bigquery.ScalarQueryParameter("file_size", "INT64", row['file_size']),
+                bigquery.ScalarQueryParameter("storage_path", "STRING", row['storage_path']),
+                bigquery.ScalarQueryParameter("content_hash", "STRING", row['content_hash']),
+                bigquery.ScalarQueryParameter("uploaded_at", "TIMESTAMP", row['uploaded_at'])
+            )
+            for row in rows
+        ]
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ArrayQueryParameter("documents", "STRUCT", documents)]
+        )
+        self.bigquery_client.query(query, job_config=job_config).result()
+    
+    def process_document(self, job, file_data=None):
+        """Extrair, dividir em trechos, indexar e marcar o documento como completed
+        
+        Erros de Storage/BigQuery sobem (a fila tenta de novo); arquivo ilegível marca
+        o documento como failed. Job repetido (retomado do diário) não duplica trabalho.
+        """
+        doc_id, chat_id = job['document_id'], job['chat_id']
+        filename, content_type = job['filename'], job['content_type']
+        
+        status = self._get_processing_status(doc_id, chat_id)
+        if status != 'processing':
+            print(f"📄 Documento {doc_id} já está {status or 'removido'}, pulando")
+            return {'success': status == 'completed', 'document_id': doc_id, 'processing_status': status}
+        
+        # Mesmos bytes já processados (qualquer chat): reaproveitar o texto extraído
+        source = self._find_processed_document(content_hash=job.get('content_hash'))
+        if source:
+            processed_content = source['processed_content']
+            print(f"♻️ {filename}: texto reaproveitado do documento {source['document_id']}")
+        else:
+            if file_data is None:
+                file_data = self.storage_client.bucket(self.bucket_name).blob(job['storage_path']).download_as_bytes()
+            try:
+                processed_content = self._process_document(file_data, content_type, filename)
+            except DocumentProcessingError as e:
+                self.mark_document_failed(job, str(e))
+                return {'success': False, 'document_id': doc_id, 'processing_status': 'failed', 'error': str(e)}
+        
+        # Mesmo texto (ex.: PDF reexportado): reaproveitar trechos, termos e embeddings
+        text_hash = normalized_text_hash(processed_content)
+        if not source:
+            source = self._find_processed_document(text_hash=text_hash)
+        reused_chunks = fetch_document_chunks(self.bigquery_client, self.project_id, source['document_id']) if source else None
+        
+        chunks = self._store_chunks(doc_id, chat_id, job.get('user_id'), filename, processed_content,
+                                    chunks=reused_chunks or None)
+        
+        updated = self._update_document_status(
+            doc_id, chat_id, 'completed',
+            processed_content=processed_content,
+            content_summary=self._summarize_content(processed_content),
+            text_hash=text_hash
+        )
+        if not updated:
+            # Documento deletado durante o processamento
+            return {'success': False, 'document_id': doc_id, 'error': 'Documento removido durante o processamento'}
+        
+        # Índice só depois do status completed: se o UPDATE falhar (e o job virar failed),
+        # o documento nunca chega ao índice salvo no Storage
+        self._update_index(chat_id, lambda index: index.add_document(doc_id, filename, chunks))
+        if self._get_processing_status(doc_id, chat_id) != 'completed':
+            # Deletado entre o UPDATE e a indexação
+            self._update_index(chat_id, lambda index: index.remove_document(doc_id))
+            return {'success': False, 'document_id': doc_id, 'error': 'Documento removido durante o processamento'}
+        
+        self._notify_change(chat_id)
+        return {
+            'success': True,
+            'document_id': doc_id,
+            'user_id': job.get('user_id'),
+            'storage_path': job['storage_path'],
+            'processing_status': 'completed',
+            'chunks': len(chunks),
+            'reused': bool(source),
+            'processed_content': processed_content[:500] + '...' if len(processed_content) > 500 else processed_content
+        }
+    
+    def mark_document_failed(self, job, error):
+        """Status failed com o motivo (processing_error); tira o documento do índice do chat
+        (tentativa anterior pode ter indexado antes de falhar)"""
+        self._update_index(job['chat_id'], lambda index: index.remove_document(job['document_id']))
+        self._update_document_status(job['document_id'], job['chat_id'], 'failed', error=error[:1000])
+        self._notify_change(job['chat_id'])
+    
+    def _store_content(self, content_hash, file_data, content_type):
+        """Arquivo no Storage endereçado pelo SHA-256: o mesmo conteúdo é gravado uma vez só
+        
+        O objeto é compartilhado entre documentos e chats; só é apagado quando nenhuma
+        linha de chat_documents aponta mais para ele (_release_storage). Chamar depois de
+        gravar a linha que usa o arquivo.
+        """
+        storage_path = f"content/{content_hash}"
+        blob = self.storage_client.bucket(self.bucket_name).blob(storage_path)
+        try:
+            blob.upload_from_string(file_data, content_type=content_type, if_generation_match=0)
+            return storage_path
+        except PreconditionFailed:
+            pass  # já existe
+        
+        # Reaproveitado: tocar os metadados (nova metageneration) faz falhar o delete de um
+        # _release_storage que contou as referências antes da nossa linha
+        blob.metadata = {'last_referenced_at': datetime.now(timezone.utc).isoformat()}
+        try:
+            blob.patch()
+        except NotFound:
+            # Apagado entre as duas chamadas: gravar de novo
+            try:
+                blob.upload_from_string(file_data, content_type=content_type, if_generation_match=0)
+            except PreconditionFailed:
+                pass  # outro upload recriou
+        return storage_path
+    
+    def _release_storage(self, storage_path):
+        """Apagar o arquivo do Storage se nenhum documento (de qualquer chat) usa mais
+        
+        Geração e metageneration são lidas antes da contagem e vão no delete: um upload
+        que passou a usar o arquivo depois (linha gravada antes, ver _store_content) faz o
+        delete falhar em vez de deixar o documento novo sem arquivo.
+        """
+        blob = self.storage_client.bucket(self.bucket_name).get_blob(storage_path)
+        if blob is None:
+            return False
+        if self._count_storage_references(storage_path):
+            return False
+        try:
+            blob.delete(if_generation_match=blob.generation, if_metageneration_match=blob.metageneration)
+        except (PreconditionFailed, NotFound):
+            print(f"♻️ Arquivo {storage_path} voltou a ser usado, mantido")
+            return False
+        return True
+    
+    def _find_chat_duplicates(self, chat_id, content_hashes):
+        """{content_hash: documento do chat com os mesmos bytes (em processamento ou pronto)}"""
+        if not content_hashes:
+            return {}
+        query = f"""
+        SELECT content_hash, document_id, storage_path, processing_status
+        FROM `{self.project_id}.saas_chat_generator.chat_documents`
+        WHERE chat_id = @chat_id AND content_hash IN UNNEST(@content_hashes) AND processing_status != 'failed'
+        ORDER BY uploaded_at DESC
+        """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("chat_id", "STRING", chat_id),
+                bigquery.ArrayQueryParameter("content_hashes", "STRING", sorted(set(content_hashes)))
+            ]
+        )
+        # Ordem decrescente: o mais antigo de cada conteúdo sobrescreve e fica
+        return {
+            row['content_hash']: {'document_id': row['document_id'], 'storage_path': row['storage_path'],
+                                  'processing_status': row['processing_status']}
+            for row in self.bigquery_client.query(query, job_config=job_config).result()
+        }
+    
+    def _find_processed_document(self, content_hash=None, text_hash=None):
+        """Documento já processado (qualquer chat) com os mesmos bytes ou o mesmo texto"""
+        if content_hash:
+            condition, value = "content_hash = @hash", content_hash
+        elif text_hash:
+            condition, value = "text_hash = @hash", text_hash
+        else:
+            return None
+        query = f"""
+        SELECT document_id, processed_content
+        FROM `{self.project_id}.saas_chat_generator.chat_documents`
+        WHERE {condition} AND processing_status = 'completed' AND processed_content IS NOT NULL
+        ORDER BY processed_at
+        LIMIT 1
+        """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ScalarQueryParameter("hash", "STRING", value)]
+        )
+        rows = list(self.bigquery_client.query(query, job_config=job_config).result())
+        return dict(rows[0]) if rows else None
+    
+    def _get_processing_status(self, document_id, chat_id):
+        """processing_status do documento (None se não existe mais)"""
+        query = f"""
+        SELECT processing_status FROM `{self.project_id}.saas_chat_generator.chat_documents`
+        WHERE document_id = @document_id AND chat_id = @chat_id
+        """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("document_id", "STRING", document_id),
+                bigquery.ScalarQueryParameter("chat_id", "STRING", chat_id)
+            ]
+        )
+        rows = list(self.bigquery_client.query(query, job_config=job_config).result())
+        return rows[0]['processing_status'] if rows else None
+    
+    def _update_document_status(self, document_id, chat_id, status, processed_content=None,
+                                content_summary=None, text_hash=None, error=None):
+        """Gravar o resultado do processamento; False se o documento não existe mais"""
+        query = f"""
+        UPDATE `{self.project_id}.saas_chat_generator.chat_documents`
+        SET processing_status = @status,
+            processed_content = @processed_content,
+            content_summary = @content_summary,
+            text_hash = @text_hash,
+            processing_error = @error,
+            processed_at = @processed_at
+        WHERE document_id = @document_id AND chat_id = @chat_id
+        """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("status", "STRING", status),
+                bigquery.ScalarQueryParameter("processed_content", "STRING", processed_content),
+                bigquery.ScalarQueryParameter("content_summary", "STRING", content_summary),
+                bigquery.ScalarQueryParameter("text_hash", "STRING", text_hash),
+                bigquery.ScalarQueryParameter("error", "STRING", error),
+                bigquery.ScalarQueryParameter("processed_at", "TIMESTAMP", datetime.now(timezone.utc)),
+                bigquery.ScalarQueryParameter("document_id", "STRING", document_id),
+                bigquery.ScalarQueryParameter("chat_id", "STRING", chat_id)
+            ]
+        )
+        query_job = self.bigquery_client.query(query, job_config=job_config)
+        query_job.result()
+        return bool(query_job.num_dml_affected_rows)
+    
+    def _store_chunks(self, document_id, chat_id, user_id, filename, processed_content, chunks=None):
+        """Dividir o documento em trechos e salvar em chat_document_chunks
+
+        chunks: trechos já processados de um documento com o mesmo texto (termos,
+        embedding e impressão reaproveitados). Retorna os trechos (indexados mesmo se o
+        insert falhar; nesse caso a busca divide o documento na hora - fetch_chat_chunks).
+        """
+        created_at = datetime.now(timezone.utc).isoformat()
+        if chunks is None:
+            chunks = chunk_text(processed_content)
+        rows = [
+            dict(chunk,
+                 chunk_id=f"{document_id}-{chunk['chunk_index']}",
+                 document_id=document_id,
+                 chat_id=chat_id,
+                 user_id=user_id,
+                 filename=filename,
+                 created_at=created_at)
+            for chunk in chunks
+        ]
+        if not rows:
+            return rows
+        
+        # Termos normalizados, embeddings e impressões calculados uma vez aqui; a busca só processa a pergunta
+        for row in rows:
+            if row.get('tokens') is None:
+                row['tokens'] = ' '.join(normalize_tokens(row['content']))
+            if row.get('fingerprint') is None:
+                row['fingerprint'] = chunk_fingerprint(row)
+            if isinstance(row.get('embedding'), bytes):
+                row['embedding'] = base64.b64encode(row['embedding']).decode('ascii')
+        if VECTOR_SEARCH_AVAILABLE:
+            for row in rows:
+                if not row.get('embedding'):
+                    row['embedding'] = encode_embedding(embed_text(row['content']))
+        
+        try:
+            self._insert_chunk_rows(rows)
         except Exception as e:
-            return {'success': False, 'error': str(e)}
+            print(f"⚠️ Erro ao salvar trechos do documento {document_id}: {e}")
+        return rows
+    
+    def _insert_chunk_rows(self, rows):
+        """Gravar trechos por DML (MERGE em lotes de até CHUNK_INSERT_BYTES)
+        
+        DML em vez de insert_rows_json: linhas no streaming buffer não aceitam DELETE, e
+        delete_document remove os trechos logo após o upload. O MERGE por chunk_id deixa o
+        job repetido pela fila sem duplicar trechos.
+        """
+        query = f"""
+        MERGE `{self.project_id}.saas_chat_generator.chat_document_chunks` t
+        USING UNNEST(@chunks) s
+        ON t.chunk_id = s.chunk_id
+        WHEN NOT MATCHED THEN
+          INSERT (chunk_id, document_id, chat_id, user_id, filename, chunk_index, start_offset, end_offset,
+                  content, token_count, tokens, embedding, fingerprint, created_at)
+          VALUES (s.chunk_id, s.document_id, s.chat_id, s.user_id, s.filename, s.chunk_index, s.start_offset,
+                  s.end_offset, s.content, s.token_count, s.tokens, s.embedding, s.fingerprint, s.created_at)
+        """
+        batch, batch_bytes = [], 0
+        for row in rows:
+            embedding = row.get('embedding')
+            if isinstance(embedding, str):
+                embedding = base64.b64decode(embedding)
+            batch.append(bigquery.StructQueryParameter(
+                None,
+                bigquery.ScalarQueryParameter("chunk_id", "STRING", row['chunk_id']),
+                bigquery.ScalarQueryParameter("document_id", "STRING", row['document_id']),
+                bigquery.ScalarQueryParameter("chat_id", "STRING", row['chat_id']),
+                bigquery.ScalarQueryParameter("user_id", "STRING", row['user_id']),
+                bigquery.ScalarQueryParameter("filename", "STRING", row['filename']),
+                bigquery.ScalarQueryParameter("chunk_index", "INT64", row['chunk_index']),
+                bigquery.ScalarQueryParameter("start_offset", "INT64", row['start_offset']),
+                bigquery.ScalarQueryParameter("end_offset", "INT64", row['end_offset']),
+                bigquery.ScalarQueryParameter("content", "STRING", row['content']),
+                bigquery.ScalarQueryParameter("token_count", "INT64", row['token_count']),
+                bigquery.ScalarQueryParameter("tokens", "STRING", row.get('tokens')),
+                bigquery.ScalarQueryParameter("embedding", "BYTES", embedding),
+                bigquery.ScalarQueryParameter("fingerprint", "STRING", row.get('fingerprint')),
+                bigquery.ScalarQueryParameter("created_at", "TIMESTAMP", row['created_at'])
+            ))
+            batch_bytes += len(row['content'].encode('utf-8')) + len(row.get('tokens') or '') + len(embedding or b'')
+            if batch_bytes >= CHUNK_INSERT_BYTES:
+                self._run_chunk_merge(query, batch)
+                batch, batch_bytes = [], 0
+        if batch:
+            self._run_chunk_merge(query, batch)
+    
+    def _run_chunk_merge(self, query, chunks):
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ArrayQueryParameter("chunks", "STRUCT", chunks)]
+        )
+        self.bigquery_client.query(query, job_config=job_config).result()
     
     def _process_document(self, file_data, content_type, filename):
-        """Processar conteúdo do documento"""
+        """Processar conteúdo do documento (DocumentProcessingError se ilegível)"""
         try:
             if content_type == 'application/pdf':
                 return self._extract_pdf_text(file_data)
@@ -97,19 +580,19 @@ class KnowledgeBaseService:
                 return file_data.decode('utf-8')
             else:
                 return f"Documento {content_type} - processamento não implementado"
+        except DocumentProcessingError:
+            raise
         except Exception as e:
-            return f"Erro ao processar documento: {str(e)}"
+            raise DocumentProcessingError(f"Erro ao processar documento: {str(e)}")
     
     def _extract_pdf_text(self, pdf_data):
-        """Extrair texto de PDF"""
+        """Extrair texto de PDF (faixas de páginas em paralelo, ver pdf_extraction.py)"""
         try:
-            pdf_reader = PyPDF2.PdfReader(BytesIO(pdf_data))
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
+            text, stats = extract_pdf_text(pdf_data)
+            print(f"📄 PDF: {stats['extracted']}/{stats['pages']} páginas em {stats['seconds']}s")
             return text
         except Exception as e:
-            return f"Erro ao extrair texto do PDF: {str(e)}"
+            raise DocumentProcessingError(f"Erro ao extrair texto do PDF: {str(e)}")
     
     def _summarize_content(self, content):
         """Criar resumo do conteúdo"""
@@ -205,6 +688,25 @@ class KnowledgeBaseService:
         
         return [dict(row) for row in results]
     
+    def get_document(self, document_id, chat_id):
+        """Metadados e status de processamento de um documento (sem o conteúdo)"""
+        query = f"""
+        SELECT document_id, chat_id, filename, file_type, file_size, content_summary,
+               processing_status, processing_error, uploaded_at, processed_at
+        FROM `{self.project_id}.saas_chat_generator.chat_documents`
+        WHERE document_id = @document_id AND chat_id = @chat_id
+        """
+        
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("document_id", "STRING", document_id),
+                bigquery.ScalarQueryParameter("chat_id", "STRING", chat_id)
+            ]
+        )
+        
+        rows = list(self.bigquery_client.query(query, job_config=job_config).result())
+        return dict(rows[0]) if rows else None
+    
     def delete_document(self, document_id, chat_id):
         """Deletar documento"""
         try:
@@ -229,11 +731,6 @@ class KnowledgeBaseService:
             
             storage_path = results[0]['storage_path']
             
-            # Deletar do Storage
-            bucket = self.storage_client.bucket(self.bucket_name)
-            blob = bucket.blob(storage_path)
-            blob.delete()
-            
             # Deletar do BigQuery
             delete_query = f"""
             DELETE FROM `{self.project_id}.saas_chat_generator.chat_documents`
@@ -243,38 +740,121 @@ class KnowledgeBaseService:
             delete_job = self.bigquery_client.query(delete_query, job_config=job_config)
             delete_job.result()
             
+            # Daqui em diante o documento já saiu da busca (trechos só são lidos com JOIN em
+            # chat_documents); a limpeza pode falhar sem deixar o índice e o chat-engine para trás
+            try:
+                # Deletar do Storage só se nenhum outro documento (de qualquer chat) usa o arquivo
+                self._release_storage(storage_path)
+                
+                delete_chunks_query = f"""
+                DELETE FROM `{self.project_id}.saas_chat_generator.chat_document_chunks`
+                WHERE document_id = @document_id AND chat_id = @chat_id
+                """
+                self.bigquery_client.query(delete_chunks_query, job_config=job_config).result()
+            except Exception as e:
+                print(f"⚠️ Limpeza incompleta do documento {document_id} (trechos/arquivo): {e}")
+            finally:
+                self._update_index(chat_id, lambda index: index.remove_document(document_id))
+                self._notify_change(chat_id)
             return {'success': True}
             
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
-    def get_chat_knowledge_context(self, chat_id, query_text="", max_docs=3):
-        """Buscar contexto relevante para uma query"""
-        documents = self.get_chat_documents(chat_id)
-        
-        if not documents:
-            return ""
-        
-        # Busca simples por palavras-chave
-        relevant_docs = []
-        query_words = query_text.lower().split()
+    def _count_storage_references(self, storage_path):
+        """Documentos que apontam para o arquivo (contagem de referências derivada das linhas)"""
+        query = f"""
+        SELECT COUNT(*) AS refs FROM `{self.project_id}.saas_chat_generator.chat_documents`
+        WHERE storage_path = @storage_path
+        """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ScalarQueryParameter("storage_path", "STRING", storage_path)]
+        )
+        return list(self.bigquery_client.query(query, job_config=job_config).result())[0]['refs']
+    
+    def get_chat_chunks(self, chat_id):
+        """Trechos dos documentos de um chat (ver document_chunks.fetch_chat_chunks)"""
+        return fetch_chat_chunks(self.bigquery_client, self.project_id, chat_id)
+    
+    def _index_blob(self, chat_id, kind):
+        """Índice do chat (bm25/vector) salvo junto dos documentos no Storage"""
+        filename = INDEX_TYPES[kind][1]
+        return self.storage_client.bucket(self.bucket_name).blob(f"chats/{chat_id}/index/{filename}")
+    
+    def get_chat_index(self, chat_id, kind='bm25'):
+        """Índice do chat (do Storage; refeito a partir dos trechos se não existir)"""
+        index, _ = self._load_index(chat_id, kind)
+        return index
+    
+    def _load_index(self, chat_id, kind):
+        """(índice, generation do blob ou 0 se ainda não salvo)"""
+        index_class = INDEX_TYPES[kind][0]
+        blob = self._index_blob(chat_id, kind)
+        try:
+            payload = blob.download_as_bytes()
+            return index_class.loads(payload), blob.generation
+        except NotFound:
+            pass
+        except Exception as e:
+            print(f"⚠️ Índice {kind} do chat {chat_id} ilegível, refazendo: {e}")
+        return index_class.from_chunks(self.get_chat_chunks(chat_id)), 0
+    
+    def _update_index(self, chat_id, change):
+        """Aplicar change(índice) em todos os índices do chat"""
+        for kind in INDEX_TYPES:
+            self._update_one_index(chat_id, kind, change)
+    
+    def _update_one_index(self, chat_id, kind, change, attempts=3):
+        """Aplicar change(índice) e salvar no Storage
         
-        for doc in documents:
-            content = doc.get('processed_content', '').lower()
-            relevance_score = sum(1 for word in query_words if word in content)
-            
-            if relevance_score > 0 or not query_text:
-                relevant_docs.append((doc, relevance_score))
+        Uploads simultâneos no mesmo chat: o save só vale se o blob não mudou desde
+        a leitura (if_generation_match); senão relê e aplica de novo.
+        """
+        content_type = INDEX_TYPES[kind][2]
+        for attempt in range(attempts):
+            try:
+                index, generation = self._load_index(chat_id, kind)
+                change(index)
+                self._index_blob(chat_id, kind).upload_from_string(
+                    index.dumps(), content_type=content_type, if_generation_match=generation
+                )
+                return index
+            except PreconditionFailed:
+                continue
+            except Exception as e:
+                # Sem índice salvo a busca refaz a partir dos trechos; não falha o upload
+                print(f"⚠️ Erro ao atualizar índice {kind} do chat {chat_id}: {e}")
+                return None
+        print(f"⚠️ Índice {kind} do chat {chat_id} não atualizado (concorrência), removendo para refazer")
+        try:
+            self._index_blob(chat_id, kind).delete()
+        except Exception:
+            pass
+        return None
+    
+    def get_chat_knowledge_context(self, chat_id, query_text="", max_chunks=8, max_tokens=2000):
+        """Buscar trechos relevantes para uma query, limitados a max_tokens (estimados)"""
+        if KNOWLEDGE_RETRIEVAL == 'hybrid':
+            indexes = {kind: self.get_chat_index(chat_id, kind) for kind in INDEX_TYPES}
+            if not len(indexes['bm25']):
+                return ""
+            ranked, _ = hybrid_search(indexes, query_text, max_chunks * 2)
+        else:
+            kind = KNOWLEDGE_RETRIEVAL if KNOWLEDGE_RETRIEVAL in INDEX_TYPES else 'bm25'
+            index = self.get_chat_index(chat_id, kind)
+            if not len(index):
+                return ""
+            ranked = index.ranked_chunks(query_text, max_chunks * 2)
         
-        # Ordenar por relevância
-        relevant_docs.sort(key=lambda x: x[1], reverse=True)
+        # Melhores trechos, unidos por documento
+        documents = select_chunks(ranked, max_tokens, max_chunks)
         
         # Montar contexto
         context = "=== DOCUMENTOS DO CHAT ===\n\n"
         
-        for doc, score in relevant_docs[:max_docs]:
+        for doc in documents:
             context += f"📄 {doc['filename']}:\n"
-            context += f"{doc['processed_content'][:1000]}...\n\n"
+            context += f"{doc['content']}\n\n"
         
         return context
 
@@ -0,0 +1,332 @@
+"""
+Cliente Claude compartilhado - pool de conexões keep-alive + métricas de tempo
+Mesmo arquivo em backend/ e chat-engine/ (cada serviço é um container separado)
+"""
+
+import os
+import json
+import asyncio
+import time
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.connection import HTTPConnection, HTTPSConnection
+
+# Cliente assíncrono (modo ASGI do chat-engine) - opcional
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+ANTHROPIC_BASE_URL = os.environ.get('ANTHROPIC_BASE_URL', 'https://api.anthropic.com')
+ANTHROPIC_VERSION = '2023-06-01'
+DEFAULT_MODEL = os.environ.get('CLAUDE_DEFAULT_MODEL', 'claude-3-haiku-20240307')
+DEFAULT_POOL_SIZE = int(os.environ.get('CLAUDE_POOL_SIZE', 10))
+DEFAULT_ASYNC_POOL_SIZE = int(os.environ.get('CLAUDE_ASYNC_POOL_SIZE', 100))
+
+# Tempo de connect (TCP+TLS) da conexão aberta pela thread atual
+_connect_timing = threading.local()
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _connect_timing.ms = (time.perf_counter() - start) * 1000
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _connect_timing.ms = (time.perf_counter() - start) * 1000
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter com pool limitado (bloqueante) e conexões que medem o connect"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool
+        }
+
+class SSEParser:
+    """Parser incremental de linhas Server-Sent Events da Messages API"""
+
+    def __init__(self):
+        self.event_type = None
+
+    def feed(self, line):
+        """Processa uma linha; retorna o evento (dict) quando houver um `data:` completo"""
+        if not line:
+            self.event_type = None
+            return None
+        if line.startswith('event:'):
+            self.event_type = line[6:].strip()
+        elif line.startswith('data:'):
+            try:
+                payload = json.loads(line[5:].strip())
+            except ValueError:
+                return None
+            payload.setdefault('type', self.event_type)
+            return payload
+        return None
+
+class ClaudeClient:
+    """Cliente HTTP único para a Messages API do Claude
+
+    - Sessão requests com keep-alive e pool de tamanho fixo (CLAUDE_POOL_SIZE)
+    - Headers e modelo padrão definidos em um só lugar
+    - Cada resposta recebe `response.timing` = {connect_ms, ttfb_ms, total_ms}
+      (connect_ms = 0 quando a conexão do pool foi reaproveitada)
+    """
+
+    def __init__(self, api_key_provider, pool_size=None, base_url=None, default_model=None):
+        self.api_key_provider = api_key_provider
+        self.pool_size = pool_size or DEFAULT_POOL_SIZE
+        self.base_url = (base_url or ANTHROPIC_BASE_URL).rstrip('/')
+        self.default_model = default_model or DEFAULT_MODEL
+
+        self.session = requests.Session()
+        adapter = PooledHTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            pool_block=True
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def headers(self):
+        """Headers padrão da API Anthropic"""
+        return {
+            "Content-Type": "application/json",
+            "x-api-key": self.api_key_provider() or "",
+            "anthropic-version": ANTHROPIC_VERSION
+        }
+
+    def resolve_model(self, model=None):
+        """Modelo a usar (payload > padrão do cliente)"""
+        return model or self.default_model
+
+    def post(self, path, payload, timeout=30, stream=False):
+        """POST genérico na API com medição de tempo"""
+        _connect_timing.ms = 0.0
+        start = time.perf_counter()
+
+        response = self.session.post(
+            f"{self.base_url}{path}",
+            headers=self.headers(),
+            json=payload,
+            timeout=timeout,
+            stream=stream
+        )
+
+        ttfb_ms = response.elapsed.total_seconds() * 1000
+        response.timing = {
+            'connect_ms': round(_connect_timing.ms, 1),
+            'ttfb_ms': round(ttfb_ms, 1),
+            'total_ms': None if stream else round((time.perf_counter() - start) * 1000, 1)
+        }
+        response.timing_started = start
+
+        if not stream:
+            self._log_timing(path, response)
+        return response
+
+    def create_message(self, payload, timeout=30, stream=False):
+        """POST /v1/messages - retorna requests.Response com `.timing`"""
+        payload = dict(payload)
+        payload['model'] = self.resolve_model(payload.get('model'))
+        if stream:
+            payload['stream'] = True
+        return self.post('/v1/messages', payload, timeout=timeout, stream=stream)
+
+    def get(self, path, timeout=30, stream=False):
+        """GET genérico; aceita caminho ou URL completa (ex.: results_url de um lote)"""
+        url = path if path.startswith('http') else f"{self.base_url}{path}"
+        return self.session.get(url, headers=self.headers(), timeout=timeout, stream=stream)
+
+    def create_batch(self, requests_list, timeout=60):
+        """POST /v1/messages/batches - lote de [{'custom_id', 'params'}]
+
+        Processamento assíncrono (até 24h) com metade do preço; acompanhar com get_batch().
+        """
+        batch = [
+            {
+                'custom_id': item['custom_id'],
+                'params': dict(item['params'], model=self.resolve_model(item['params'].get('model')))
+            }
+            for item in requests_list
+        ]
+        return self.post('/v1/messages/batches', {'requests': batch}, timeout=timeout)
+
+    def get_batch(self, batch_id, timeout=30):
+        """GET /v1/messages/batches/{id} - processing_status, request_counts, results_url"""
+        return self.get(f"/v1/messages/batches/{batch_id}", timeout=timeout)
+
+    def iter_batch_results(self, batch, timeout=300):
+        """Resultados (JSONL) de um lote encerrado como dicts {'custom_id', 'result'}"""
+        url = batch.get('results_url') or f"/v1/messages/batches/{batch['id']}/results"
+        response = self.get(url, timeout=timeout, stream=True)
+        response.raise_for_status()
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    yield json.loads(line)
+        finally:
+            response.close()
+
+    def iter_events(self, response):
+        """Ler eventos SSE de uma resposta com stream=True como dicts
+
+        Ao terminar, fecha a resposta e preenche `response.timing['total_ms']`.
+        """
+        parser = SSEParser()
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                event = parser.feed(line)
+                if event is not None:
+                    yield event
+        finally:
+            response.close()
+            response.timing['total_ms'] = round((time.perf_counter() - response.timing_started) * 1000, 1)
+            self._log_timing('/v1/messages (stream)', response)
+
+    def _log_timing(self, path, response):
+        timing = response.timing
+        logging.info(
+            f"Claude {path} status={response.status_code} "
+            f"connect={timing['connect_ms']}ms ttfb={timing['ttfb_ms']}ms total={timing['total_ms']}ms"
+        )
+
+class AsyncClaudeClient:
+    """Versão asyncio do ClaudeClient (httpx.AsyncClient com pool compartilhado)
+
+    Mesma interface: `create_message`, `open_stream` + `aiter_events`, e
+    `response.timing` = {connect_ms, ttfb_ms, total_ms}. O AsyncClient é criado
+    na primeira chamada, dentro do event loop que vai usá-lo.
+    """
+
+    def __init__(self, api_key_provider, pool_size=None, base_url=None, default_model=None):
+        if httpx is None:
+            raise RuntimeError("httpx não instalado - modo assíncrono indisponível")
+        self.api_key_provider = api_key_provider
+        self.pool_size = pool_size or DEFAULT_ASYNC_POOL_SIZE
+        self.base_url = (base_url or ANTHROPIC_BASE_URL).rstrip('/')
+        self.default_model = default_model or DEFAULT_MODEL
+        self._client = None
+        self._loop = None
+
+    def _get_client(self):
+        # O pool do httpx pertence ao event loop que o criou
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._loop = loop
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size
+                )
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def headers(self, api_key):
+        return {
+            "Content-Type": "application/json",
+            "x-api-key": api_key or "",
+            "anthropic-version": ANTHROPIC_VERSION
+        }
+
+    def resolve_model(self, model=None):
+        return model or self.default_model
+
+    async def post(self, path, payload, api_key, timeout=30, stream=False):
+        """POST genérico; `api_key` é resolvida pelo chamador (fora do event loop)"""
+        client = self._get_client()
+        connect = {}
+
+        async def trace(event_name, info):
+            # Eventos do httpcore: só aparecem quando uma conexão nova é aberta
+            if event_name == 'connection.connect_tcp.started':
+                connect['start'] = time.perf_counter()
+            elif event_name in ('connection.connect_tcp.complete', 'connection.start_tls.complete'):
+                connect['end'] = time.perf_counter()
+
+        request = client.build_request(
+            'POST',
+            f"{self.base_url}{path}",
+            headers=self.headers(api_key),
+            json=payload,
+            timeout=timeout,
+            extensions={'trace': trace}
+        )
+
+        start = time.perf_counter()
+        response = await client.send(request, stream=True)
+        ttfb_ms = (time.perf_counter() - start) * 1000
+
+        connect_ms = 0.0
+        if 'start' in connect and 'end' in connect:
+            connect_ms = (connect['end'] - connect['start']) * 1000
+
+        if not stream:
+            try:
+                await response.aread()
+            finally:
+                await response.aclose()
+
+        response.timing = {
+            'connect_ms': round(connect_ms, 1),
+            'ttfb_ms': round(ttfb_ms, 1),
+            'total_ms': None if stream else round((time.perf_counter() - start) * 1000, 1)
+        }
+        response.timing_started = start
+
+        if not stream:
+            self._log_timing(path, response)
+        return response
+
+    async def create_message(self, payload, api_key, timeout=30):
+        """POST /v1/messages - retorna httpx.Response já lida, com `.timing`"""
+        payload = dict(payload)
+        payload['model'] = self.resolve_model(payload.get('model'))
+        return await self.post('/v1/messages', payload, api_key, timeout=timeout)
+
+    async def open_stream(self, payload, api_key, timeout=30):
+        """POST /v1/messages com stream: true - ler com `aiter_events`"""
+        payload = dict(payload)
+        payload['model'] = self.resolve_model(payload.get('model'))
+        payload['stream'] = True
+        return await self.post('/v1/messages', payload, api_key, timeout=timeout, stream=True)
+
+    async def aiter_events(self, response):
+        """Eventos SSE de uma resposta aberta com `open_stream` (fecha ao terminar)"""
+        parser = SSEParser()
+        try:
+            async for line in response.aiter_lines():
+                event = parser.feed(line)
+                if event is not None:
+                    yield event
+        finally:
+            await response.aclose()
+            response.timing['total_ms'] = round((time.perf_counter() - response.timing_started) * 1000, 1)
+            self._log_timing('/v1/messages (stream)', response)
+
+    def _log_timing(self, path, response):
+        timing = response.timing
+        logging.info(
+            f"Claude async {path} status={response.status_code} "
+            f"connect={timing['connect_ms']}ms ttfb={timing['ttfb_ms']}ms total={timing['total_ms']}ms"
+        )
@@ -0,0 +1,315 @@
+"""
+Escalonador justo das chamadas ao Claude - limites por cliente (tenant) e prioridades
+Cada usuário (dono dos chats) tem um teto de chamadas simultâneas derivado do plano
+(Config.PLANS) e um peso no enfileiramento justo ponderado: um pico de um cliente
+enterprise não ocupa todos os slots nem deixa as clínicas pequenas esperando.
+Respostas ao vivo (WhatsApp/web) passam na frente de trabalho em background
+(geração de prompts, resumos). Limites valem por processo/instância.
+Mesmo arquivo em backend/ e chat-engine/.
+"""
+
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager, asynccontextmanager
+from config import Config
+
+# Chamadas simultâneas ao Claude por instância (todas as contas somadas)
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 16))
+# Fração máxima dos slots para trabalho em background (o resto fica livre para ao vivo)
+LLM_BACKGROUND_SHARE = float(os.environ.get('LLM_BACKGROUND_SHARE', 0.25))
+# Espera máxima na fila antes de desistir (segundos)
+LLM_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT', 20))
+LLM_BACKGROUND_QUEUE_TIMEOUT = float(os.environ.get('LLM_BACKGROUND_QUEUE_TIMEOUT', 120))
+
+# Classes de prioridade, da mais alta para a mais baixa
+PRIORITY_CLASSES = ('live', 'background')
+
+# Plano sem limites definidos usa estes valores
+DEFAULT_PLAN_LIMITS = {'max_concurrent_llm': 1, 'llm_weight': 1}
+
+# Slot em uso pela thread/tarefa atual (slot/slot_async): o hedging pede slot extra nele
+_current_slot = contextvars.ContextVar('llm_slot', default=None)
+
+class QueueTimeoutError(Exception):
+    """A chamada esperou demais na fila do escalonador"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Fila do Claude cheia, tente em {retry_after}s")
+        self.retry_after = retry_after
+
+class _Waiter:
+    """Uma chamada esperando slot (thread bloqueada ou future do asyncio)"""
+
+    __slots__ = ('tenant', 'priority', 'enqueued', 'granted', 'event', 'loop', 'future')
+
+    def __init__(self, tenant, priority, loop=None):
+        self.tenant = tenant
+        self.priority = priority
+        self.enqueued = time.perf_counter()
+        self.granted = False
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+class FairScheduler:
+    """Fila justa ponderada por tenant (start-time fair queuing) com prioridade estrita por classe
+
+    Um tenant com peso 4 recebe até 4x mais slots que um de peso 1 quando os dois
+    têm chamadas na fila; ninguém passa do próprio teto de concorrência.
+    """
+
+    def __init__(self, plans=None, max_concurrency=None, background_share=None, window=200):
+        self.plans = plans or {}
+        self.max_concurrency = max(1, max_concurrency or LLM_MAX_CONCURRENCY)
+        share = LLM_BACKGROUND_SHARE if background_share is None else background_share
+        self.max_background = max(1, int(self.max_concurrency * share))
+
+        self._lock = threading.Lock()
+        # classe -> tenant -> deque de waiters (OrderedDict: ordem de chegada dos tenants)
+        self._queues = {priority: OrderedDict() for priority in PRIORITY_CLASSES}
+        # Estado por tenant só enquanto ele tem chamada na fila ou em andamento (_prune)
+        self._tenant_limits = {}
+        self._in_flight = Counter()
+        self._running = Counter()  # por classe
+        # Tag virtual de cada tenant e relógio virtual global
+        self._tags = {}
+        self._clock = 0.0
+
+        # Espera na fila por classe (somando os tenants)
+        self._waits = {priority: deque(maxlen=window) for priority in PRIORITY_CLASSES}
+        self._granted = Counter()
+        self._timeouts = Counter()
+
+    def limits_for(self, plan):
+        limits = dict(DEFAULT_PLAN_LIMITS)
+        limits.update({
+            key: value for key, value in (self.plans.get(plan) or {}).items()
+            if key in DEFAULT_PLAN_LIMITS
+        })
+        limits['max_concurrent_llm'] = max(1, min(int(limits['max_concurrent_llm']), self.max_concurrency))
+        limits['llm_weight'] = max(0.1, float(limits['llm_weight']))
+        return limits
+
+    def _total_running(self):
+        return sum(self._running.values())
+
+    def _pick(self):
+        """Próximo waiter a liberar (chamado com o lock)"""
+        if self._total_running() >= self.max_concurrency:
+            return None
+
+        for priority in PRIORITY_CLASSES:
+            if priority == 'background' and self._running['background'] >= self.max_background:
+                continue
+
+            best_tenant, best_tag = None, None
+            for tenant, waiters in self._queues[priority].items():
+                if not waiters:
+                    continue
+                if self._in_flight[tenant] >= self._tenant_limits[tenant]['max_concurrent_llm']:
+                    continue
+                start = max(self._tags.get(tenant, 0.0), self._clock)
+                if best_tag is None or start < best_tag:
+                    best_tenant, best_tag = tenant, start
+
+            if best_tenant is not None:
+                waiters = self._queues[priority][best_tenant]
+                waiter = waiters.popleft()
+                if not waiters:
+                    del self._queues[priority][best_tenant]
+                self._clock = best_tag
+                self._tags[best_tenant] = best_tag + 1.0 / self._tenant_limits[best_tenant]['llm_weight']
+                return waiter
+        return None
+
+    def _dispatch(self):
+        """Liberar todos os waiters que cabem agora (chamado com o lock)"""
+        while True:
+            waiter = self._pick()
+            if waiter is None:
+                return
+            waiter.granted = True
+            self._in_flight[waiter.tenant] += 1
+            self._running[waiter.priority] += 1
+            self._record_wait(waiter)
+            waiter.wake()
+
+    def _record_wait(self, waiter):
+        wait_ms = (time.perf_counter() - waiter.enqueued) * 1000
+        self._waits[waiter.priority].append(wait_ms)
+        self._granted[waiter.priority] += 1
+
+    def _prune(self, tenant):
+        """Esquecer o tenant sem nada na fila nem em andamento (chamado com o lock)
+
+        A tag virtual vai junto: ao voltar, o tenant recomeça no relógio atual, como
+        qualquer tenant que ficou ocioso no start-time fair queuing.
+        """
+        if self._in_flight[tenant] > 0:
+            return
+        if any(tenant in self._queues[priority] for priority in PRIORITY_CLASSES):
+            return
+        self._in_flight.pop(tenant, None)
+        self._tenant_limits.pop(tenant, None)
+        self._tags.pop(tenant, None)
+
+    def _enqueue(self, tenant, plan, priority, loop=None):
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Prioridade inválida: {priority}")
+        tenant = tenant or 'anonymous'
+        waiter = _Waiter(tenant, priority, loop)
+        with self._lock:
+            self._tenant_limits[tenant] = self.limits_for(plan)
+            self._queues[priority].setdefault(tenant, deque()).append(waiter)
+            self._dispatch()
+        return waiter
+
+    def _abandon(self, waiter):
+        """Tirar da fila um waiter que desistiu; False se ele já tinha recebido o slot"""
+        with self._lock:
+            if waiter.granted:
+                return False
+            waiters = self._queues[waiter.priority].get(waiter.tenant)
+            if waiters is not None and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._queues[waiter.priority][waiter.tenant]
+            self._timeouts[waiter.priority] += 1
+            self._prune(waiter.tenant)
+            return True
+
+    def _timeout_for(self, priority, timeout):
+        if timeout is not None:
+            return timeout
+        return LLM_BACKGROUND_QUEUE_TIMEOUT if priority == 'background' else LLM_QUEUE_TIMEOUT
+
+    def acquire(self, tenant, plan=None, priority='live', timeout=None):
+        """Bloquear até haver slot; retorna o ticket para release()"""
+        waiter = self._enqueue(tenant, plan, priority)
+        if not waiter.event.wait(self._timeout_for(priority, timeout)) and self._abandon(waiter):
+            raise QueueTimeoutError(self.retry_after())
+        return waiter
+
+    async def acquire_async(self, tenant, plan=None, priority='live', timeout=None):
+        """Versão asyncio de acquire() (não bloqueia o event loop)"""
+        waiter = self._enqueue(tenant, plan, priority, loop=asyncio.get_running_loop())
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self._timeout_for(priority, timeout))
+        except asyncio.TimeoutError:
+            if self._abandon(waiter):
+                raise QueueTimeoutError(self.retry_after())
+        except asyncio.CancelledError:
+            # Cliente desconectou: devolver o slot se ele já tinha sido liberado
+            if not self._abandon(waiter):
+                self.release(waiter)
+            raise
+        return waiter
+
+    def release(self, waiter):
+        with self._lock:
+            self._in_flight[waiter.tenant] -= 1
+            self._running[waiter.priority] -= 1
+            self._prune(waiter.tenant)
+            self._dispatch()
+
+    def try_acquire_extra(self):
+        """Slot a mais para o tenant/classe do slot atual, sem entrar na fila (hedging)
+
+        None se não há slot atual, o tenant está no teto, a instância está cheia ou já há
+        chamadas esperando: a requisição duplicada nunca passa na frente de ninguém.
+        """
+        current = _current_slot.get()
+        if current is None:
+            return None
+        with self._lock:
+            if self._total_running() >= self.max_concurrency:
+                return None
+            if any(self._queues[priority] for priority in PRIORITY_CLASSES):
+                return None
+            if current.priority == 'background' and self._running['background'] >= self.max_background:
+                return None
+            limits = self._tenant_limits.get(current.tenant)
+            if limits is None or self._in_flight[current.tenant] >= limits['max_concurrent_llm']:
+                return None
+            waiter = _Waiter(current.tenant, current.priority)
+            waiter.granted = True
+            self._in_flight[waiter.tenant] += 1
+            self._running[waiter.priority] += 1
+            return waiter
+
+    @contextmanager
+    def slot(self, tenant, plan=None, priority='live', timeout=None):
+        """with llm_scheduler.slot(user_id, plan): response = claude_client.create_message(...)"""
+        waiter = self.acquire(tenant, plan, priority, timeout)
+        token = _current_slot.set(waiter)
+        try:
+            yield waiter
+        finally:
+            _current_slot.reset(token)
+            self.release(waiter)
+
+    @asynccontextmanager
+    async def slot_async(self, tenant, plan=None, priority='live', timeout=None):
+        waiter = await self.acquire_async(tenant, plan, priority, timeout)
+        token = _current_slot.set(waiter)
+        try:
+            yield waiter
+        finally:
+            _current_slot.reset(token)
+            self.release(waiter)
+
+    def retry_after(self):
+        """Segundos sugeridos para tentar de novo quando a fila estoura"""
+        return max(1, int(LLM_QUEUE_TIMEOUT / 2))
+
+    def queued(self):
+        with self._lock:
+            return {
+                priority: sum(len(waiters) for waiters in queues.values())
+                for priority, queues in self._queues.items()
+            }
+
+    def stats(self):
+        """Fila, slots em uso e tempo de espera por classe (agregado: /metrics é público e
+        não expõe ids de clientes)"""
+        with self._lock:
+            classes = {}
+            for priority in PRIORITY_CLASSES:
+                ordered = sorted(self._waits[priority])
+                classes[priority] = {
+                    'running': self._running[priority],
+                    'queued': sum(len(waiters) for waiters in self._queues[priority].values()),
+                    'granted': self._granted[priority],
+                    'timeouts': self._timeouts[priority],
+                    'avg_wait_ms': round(sum(ordered) / len(ordered), 1) if ordered else None,
+                    'p95_wait_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1) if ordered else None,
+                    'max_wait_ms': round(ordered[-1], 1) if ordered else None
+                }
+            at_limit = sum(
+                1 for tenant, count in self._in_flight.items()
+                if count >= self._tenant_limits[tenant]['max_concurrent_llm']
+            )
+            return {
+                'max_concurrency': self.max_concurrency,
+                'max_background': self.max_background,
+                'classes': classes,
+                'active_tenants': len(self._tenant_limits),
+                'tenants_at_limit': at_limit
+            }
+
+# Instância global
+llm_scheduler = FairScheduler(Config.PLANS)
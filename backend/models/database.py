@@ -199,12 +199,13 @@ class MessageModel(Database):
         return self._insert_rows('messages', [message_data])
     
     def get_conversation_history(self, chat_id: str, conversation_id: str, 
-                               limit: int = 50) -> List[Dict]:
-        """Buscar histórico da conversa"""
+                               limit: int = 50, after: datetime = None) -> List[Dict]:
+        """Buscar histórico da conversa (opcionalmente só mensagens depois de `after`)"""
+        after_filter = "AND timestamp > @after" if after else ""
         query = f"""
         SELECT role, content, timestamp
         FROM `{self._get_table_ref('messages')}`
-        WHERE chat_id = @chat_id AND conversation_id = @conversation_id
+        WHERE chat_id = @chat_id AND conversation_id = @conversation_id {after_filter}
         ORDER BY timestamp DESC
         LIMIT {limit}
         """
@@ -213,11 +214,72 @@ class MessageModel(Database):
             bigquery.ScalarQueryParameter("chat_id", "STRING", chat_id),
             bigquery.ScalarQueryParameter("conversation_id", "STRING", conversation_id)
         ]
+        if after:
+            parameters.append(bigquery.ScalarQueryParameter("after", "TIMESTAMP", after))
         
         results = self._execute_query(query, parameters)
         return list(reversed(results))  # Reverter para ordem cronológica
+    
+    def get_messages_between(self, chat_id: str, conversation_id: str, after: Optional[datetime],
+                             until: datetime, limit: int = 50) -> List[Dict]:
+        """Mensagens depois de `after` até `until` inclusive, das mais antigas (paginação do resumo)"""
+        after_filter = "AND timestamp > @after" if after else ""
+        query = f"""
+        SELECT role, content, timestamp
+        FROM `{self._get_table_ref('messages')}`
+        WHERE chat_id = @chat_id AND conversation_id = @conversation_id
+          AND timestamp <= @until {after_filter}
+        ORDER BY timestamp ASC
+        LIMIT {limit}
+        """
+        
+        parameters = [
+            bigquery.ScalarQueryParameter("chat_id", "STRING", chat_id),
+            bigquery.ScalarQueryParameter("conversation_id", "STRING", conversation_id),
+            bigquery.ScalarQueryParameter("until", "TIMESTAMP", until)
+        ]
+        if after:
+            parameters.append(bigquery.ScalarQueryParameter("after", "TIMESTAMP", after))
+        
+        return self._execute_query(query, parameters)
+
+class ConversationSummaryModel(Database):
+    """Resumo incremental das conversas (append-only: vale a linha mais recente)"""
+    
+    def get_latest_summary(self, chat_id: str, conversation_id: str) -> Optional[Dict]:
+        """Último resumo salvo da conversa"""
+        query = f"""
+        SELECT summary, summarized_until, messages_summarized, updated_at
+        FROM `{self._get_table_ref('conversation_summaries')}`
+        WHERE chat_id = @chat_id AND conversation_id = @conversation_id
+        ORDER BY updated_at DESC
+        LIMIT 1
+        """
+        
+        parameters = [
+            bigquery.ScalarQueryParameter("chat_id", "STRING", chat_id),
+            bigquery.ScalarQueryParameter("conversation_id", "STRING", conversation_id)
+        ]
+        
+        results = self._execute_query(query, parameters)
+        return results[0] if results else None
+    
+    def save_summary(self, chat_id: str, conversation_id: str, summary: str,
+                     summarized_until: datetime, messages_summarized: int) -> bool:
+        """Salvar nova versão do resumo (nova linha; UPDATE não funciona no streaming buffer)"""
+        summary_data = {
+            'chat_id': chat_id,
+            'conversation_id': conversation_id,
+            'summary': summary,
+            'summarized_until': summarized_until.isoformat(),
+            'messages_summarized': messages_summarized,
+            'updated_at': datetime.now(timezone.utc).isoformat()
+        }
+        
+        return self._insert_rows('conversation_summaries', [summary_data])
 
 # Instâncias globais
 user_model = UserModel()
 chat_model = ChatModel()
 message_model = MessageModel()
+summary_model = ConversationSummaryModel()
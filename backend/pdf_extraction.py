@@ -0,0 +1,166 @@
+"""
+Extração de texto de PDF em paralelo (pool de processos)
+O PDF é dividido em faixas de páginas extraídas em processos separados (não segura o GIL
+do servidor); páginas que passam de PDF_PAGE_TIMEOUT são puladas e PDFs maiores que
+PDF_MAX_PAGES são cortados. O texto é juntado uma vez no final.
+Mesmo arquivo em backend/ e chat-engine/.
+"""
+
+import os
+import time
+import signal
+import tempfile
+import threading
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, CancelledError, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+PDF_WORKERS = int(os.environ.get('PDF_WORKERS', max(1, min(4, os.cpu_count() or 1))))
+# Mínimo de páginas por tarefa (cada tarefa reabre o PDF); acima disso ~2 tarefas por processo
+PDF_PAGES_PER_TASK = int(os.environ.get('PDF_PAGES_PER_TASK', 32))
+# Segundos por página antes de pular (páginas patológicas)
+PDF_PAGE_TIMEOUT = float(os.environ.get('PDF_PAGE_TIMEOUT', 10))
+PDF_MAX_PAGES = int(os.environ.get('PDF_MAX_PAGES', 1000))
+# Pool quebrado (processo morto por falta de memória etc.) mais vezes que isso: extração serial
+PDF_POOL_RETRIES = int(os.environ.get('PDF_POOL_RETRIES', 1))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+class PageTimeout(BaseException):
+    """BaseException: o PyPDF2 não engole com seus `except Exception` internos"""
+
+def _on_alarm(signum, frame):
+    raise PageTimeout()
+
+def _extract_range(path, start, end, page_timeout):
+    """(start, textos, páginas puladas) das páginas start..end-1 - roda no processo do pool"""
+    import PyPDF2
+
+    signal.signal(signal.SIGALRM, _on_alarm)
+    reader = PyPDF2.PdfReader(path)
+    texts, skipped = [], []
+    for number in range(start, end):
+        signal.setitimer(signal.ITIMER_REAL, page_timeout)
+        try:
+            texts.append(reader.pages[number].extract_text() or '')
+        except (PageTimeout, Exception):
+            # Timeout ou página corrompida: segue sem ela
+            skipped.append(number + 1)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    return start, texts, skipped
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: o servidor tem threads, fork poderia herdar locks travados
+            _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+def _reset_pool(pool, terminate=False):
+    """Descartar o pool (se ainda for o atual); o próximo _get_pool cria outro
+
+    terminate: matar os processos - future.cancel() não interrompe tarefa em execução, e
+    um processo preso numa página ocuparia o slot do pool para sempre. As outras tarefas
+    em andamento recebem BrokenProcessPool e são reenviadas ao pool novo.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not pool:
+            return
+        _pool = None
+    if terminate:
+        if hasattr(pool, 'terminate_workers'):
+            pool.terminate_workers()
+            return
+        for process in list((getattr(pool, '_processes', None) or {}).values()):
+            process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def page_count(pdf_data):
+    import PyPDF2
+    return len(PyPDF2.PdfReader(BytesIO(pdf_data)).pages)
+
+def extract_pdf_text(pdf_data, max_pages=None, pages_per_task=None, page_timeout=None):
+    """Texto do PDF e estatísticas {'pages', 'extracted', 'skipped', 'truncated', 'seconds'}"""
+    max_pages = max_pages or PDF_MAX_PAGES
+    pages_per_task = pages_per_task or PDF_PAGES_PER_TASK
+    page_timeout = page_timeout or PDF_PAGE_TIMEOUT
+    started = time.perf_counter()
+
+    total = page_count(pdf_data)
+    pages = min(total, max_pages)
+    pages_per_task = max(pages_per_task, -(-pages // (PDF_WORKERS * 2)))
+    ranges = [(start, min(start + pages_per_task, pages)) for start in range(0, pages, pages_per_task)]
+
+    # Arquivo temporário: os processos leem o PDF do disco em vez de receber os bytes por tarefa
+    with tempfile.NamedTemporaryFile(suffix='.pdf') as tmp:
+        tmp.write(pdf_data)
+        tmp.flush()
+        results = []
+        pending = ranges
+        breaks = 0
+        while pending:
+            if breaks > PDF_POOL_RETRIES:
+                print("⚠️ Pool de PDF quebrou, extraindo no processo atual")
+                results.extend(_extract_serial(tmp.name, start, end) for start, end in pending)
+                break
+
+            pool = _get_pool()
+            try:
+                futures = [pool.submit(_extract_range, tmp.name, start, end, page_timeout) for start, end in pending]
+            except (BrokenProcessPool, RuntimeError):
+                # Quebrado ou descartado por outra extração entre _get_pool e submit
+                _reset_pool(pool)
+                breaks += 1
+                continue
+
+            retry, terminated = [], False
+            for future, (start, end) in zip(futures, pending):
+                # Limite por faixa: todas as páginas no timeout + folga para abrir o PDF
+                try:
+                    results.append(future.result(timeout=page_timeout * (end - start) + 30))
+                except FuturesTimeout:
+                    print(f"⚠️ PDF: páginas {start + 1}-{end} passaram do tempo, reiniciando o pool")
+                    results.append((start, [], list(range(start + 1, end + 1))))
+                    _reset_pool(pool, terminate=True)
+                    terminated = True
+                except (BrokenProcessPool, CancelledError):
+                    retry.append((start, end))
+            # Quebra causada pelo nosso próprio timeout não conta para o fallback serial
+            if retry and not terminated:
+                breaks += 1
+                _reset_pool(pool)
+            pending = retry
+
+    results.sort(key=lambda result: result[0])
+    texts = [text for _, range_texts, _ in results for text in range_texts]
+    skipped = [page for _, _, range_skipped in results for page in range_skipped]
+
+    stats = {
+        'pages': total,
+        'extracted': len(texts),
+        'skipped': skipped,
+        'truncated': total > pages,
+        'seconds': round(time.perf_counter() - started, 3)
+    }
+    if skipped or stats['truncated']:
+        print(f"⚠️ PDF: {len(skipped)} página(s) pulada(s) {skipped[:10]}, "
+              f"{total - pages} além do limite de {max_pages}")
+    return "\n".join(texts) + ("\n" if texts else ""), stats
+
+def _extract_serial(path, start, end):
+    """Fallback sem pool (sem timeout por página)"""
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(path)
+    texts, skipped = [], []
+    for number in range(start, end):
+        try:
+            texts.append(reader.pages[number].extract_text() or '')
+        except Exception:
+            skipped.append(number + 1)
+    return start, texts, skipped
@@ -0,0 +1,91 @@
+"""Upload em lote: tipos aceitos, limites por arquivo/lote e proteção contra zip bomb"""
+
+import io
+import zipfile
+import pytest
+from werkzeug.datastructures import FileStorage
+import bulk_upload
+from bulk_upload import iter_upload_entries, MAX_FILE_BYTES
+
+def upload(filename, data, content_type='application/octet-stream'):
+    return FileStorage(stream=io.BytesIO(data), filename=filename, content_type=content_type)
+
+def zip_upload(filename, entries):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in entries.items():
+            archive.writestr(name, data)
+    return upload(filename, buffer.getvalue(), 'application/zip')
+
+def collect(files):
+    skipped = []
+    entries = [(name, content_type, read()) for name, content_type, read in iter_upload_entries(files, skipped)]
+    return entries, skipped
+
+def test_loose_files_and_zip_entries():
+    entries, skipped = collect([
+        upload('precos.txt', b'Consulta R$ 350', 'text/plain'),
+        upload('manual.PDF', b'%PDF-1.4'),
+        zip_upload('docs.zip', {
+            'clinica/endereco.md': b'# Rua Cardoso de Almeida',
+            'clinica/': b'',
+            '__MACOSX/._endereco.md': b'x',
+            '.DS_Store': b'x',
+            'foto.png': b'\x89PNG',
+        }),
+        upload('planilha.xlsx', b'PK'),
+    ])
+
+    assert entries == [
+        ('precos.txt', 'text/plain', b'Consulta R$ 350'),
+        ('manual.PDF', 'application/pdf', b'%PDF-1.4'),
+        ('endereco.md', 'text/markdown', b'# Rua Cardoso de Almeida'),
+    ]
+    assert {item['filename'] for item in skipped} == {'foto.png', 'planilha.xlsx'}
+
+def test_max_files_per_batch(monkeypatch):
+    monkeypatch.setattr(bulk_upload, 'BULK_MAX_FILES', 3)
+    entries, skipped = collect(
+        [upload(f"doc{i}.txt", b'texto', 'text/plain') for i in range(2)] +
+        [zip_upload('lote.zip', {f"z{i}.txt": b'texto' for i in range(3)})]
+    )
+    assert [name for name, _, _ in entries] == ['doc0.txt', 'doc1.txt', 'z0.txt']
+    assert [item['filename'] for item in skipped] == ['z1.txt', 'z2.txt']
+    assert all('Limite de 3 arquivos' in item['error'] for item in skipped)
+
+def test_file_larger_than_max_is_skipped():
+    entries, skipped = collect([
+        upload('grande.txt', b'a' * (MAX_FILE_BYTES + 1), 'text/plain'),
+        upload('pequeno.txt', b'ok', 'text/plain'),
+    ])
+    assert [name for name, _, _ in entries] == ['pequeno.txt']
+    assert skipped == [{'filename': 'grande.txt', 'error': 'Arquivo muito grande (máximo 10MB)'}]
+
+def test_batch_bytes_limit_counts_uncompressed_size(monkeypatch):
+    monkeypatch.setattr(bulk_upload, 'BULK_MAX_BYTES', 250_000)
+    # Zip bomb em miniatura: poucos bytes compactados, 100KB descompactados cada
+    entries, skipped = collect([zip_upload('bomba.zip', {f"b{i}.txt": b'0' * 100_000 for i in range(4)})])
+    assert [name for name, _, _ in entries] == ['b0.txt', 'b1.txt']
+    assert [item['error'] for item in skipped] == ['Limite de tamanho do lote atingido'] * 2
+
+def test_zip_entry_lying_about_its_size_fails_on_read(monkeypatch):
+    archive_file = zip_upload('mentiroso.zip', {'grande.txt': b'0' * 2048})
+    monkeypatch.setattr(bulk_upload, 'MAX_FILE_BYTES', 1024)
+    skipped = []
+    entries = list(iter_upload_entries([archive_file], skipped))
+    # Tamanho declarado passa do limite: recusado antes de ler
+    assert entries == []
+    assert skipped[0]['filename'] == 'grande.txt'
+
+    # Cabeçalho adulterado (declara menos do que tem): read() falha com ValueError, não estoura a memória
+    archive = zipfile.ZipFile(archive_file.stream)
+    info = archive.infolist()[0]
+    info.file_size = 10
+    read = bulk_upload._zip_reader(archive, info)
+    with pytest.raises(ValueError):
+        read()
+
+def test_invalid_zip_is_skipped():
+    entries, skipped = collect([upload('quebrado.zip', b'isto nao e um zip', 'application/zip')])
+    assert entries == []
+    assert skipped == [{'filename': 'quebrado.zip', 'error': 'ZIP inválido'}]
@@ -0,0 +1,136 @@
+"""
+Controle de admissão do chat-engine - rejeita cedo em vez de falhar devagar
+Sob sobrecarga, mensagens além da capacidade recebem 503 + Retry-After na hora
+(em vez de esperar o timeout de 30s do Claude ou de 60s do gunicorn); as admitidas
+mantêm a latência controlada. A carga atual fica em GET /api/load para a ponte
+do WhatsApp reduzir o ritmo.
+"""
+
+import os
+import math
+import threading
+
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', '1') == '1'
+# Mensagens em processamento simultâneo por instância (preparo + fila + Claude)
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', 64))
+# Tempo estimado de fila acima do qual novas mensagens são rejeitadas (segundos)
+ADMISSION_MAX_QUEUE_SECONDS = float(os.environ.get('ADMISSION_MAX_QUEUE_SECONDS', 10))
+# Duração típica de uma chamada ao Claude enquanto não há amostras (ms)
+ADMISSION_DEFAULT_SERVICE_MS = float(os.environ.get('ADMISSION_DEFAULT_SERVICE_MS', 3000))
+ADMISSION_MAX_RETRY_AFTER = int(os.environ.get('ADMISSION_MAX_RETRY_AFTER', 60))
+
+class AdmissionRejected(Exception):
+    """Instância sobrecarregada: a mensagem não foi aceita"""
+
+    def __init__(self, retry_after, load):
+        super().__init__(f"Serviço sobrecarregado, tente em {retry_after}s")
+        self.retry_after = retry_after
+        self.load = load
+
+class _Ticket:
+    """Vaga de uma mensagem admitida; release() pode ser chamado mais de uma vez"""
+
+    def __init__(self, controller):
+        self._controller = controller
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._controller._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class AdmissionController:
+    """Admite mensagens pelo número em processamento e pelo tempo estimado de fila
+
+    Tempo de fila = mensagens além dos slots do escalonador do Claude dividido
+    pelos slots, vezes a latência mediana recente do Claude.
+    """
+
+    def __init__(self, scheduler, latency, max_in_flight=None, max_queue_seconds=None):
+        self.scheduler = scheduler
+        self.latency = latency
+        self.max_in_flight = max_in_flight or ADMISSION_MAX_IN_FLIGHT
+        self.max_queue_seconds = ADMISSION_MAX_QUEUE_SECONDS if max_queue_seconds is None else max_queue_seconds
+
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+
+    def service_seconds(self):
+        p50 = self.latency.percentile(50)
+        return (p50 if p50 is not None else ADMISSION_DEFAULT_SERVICE_MS) / 1000
+
+    def estimated_wait(self, in_flight=None):
+        """Segundos que uma mensagem nova esperaria por um slot do Claude"""
+        in_flight = self._in_flight if in_flight is None else in_flight
+        slots = self.scheduler.max_concurrency
+        backlog = max(in_flight + 1 - slots, self.scheduler.queued()['live'])
+        if backlog <= 0:
+            return 0.0
+        return backlog / slots * self.service_seconds()
+
+    def _retry_after(self, wait):
+        return max(1, min(ADMISSION_MAX_RETRY_AFTER, int(math.ceil(wait or self.service_seconds()))))
+
+    def admit(self):
+        """Reservar vaga ou levantar AdmissionRejected (usar com `with`)"""
+        if not ADMISSION_ENABLED:
+            with self._lock:
+                self._in_flight += 1
+                self.admitted += 1
+            return _Ticket(self)
+
+        with self._lock:
+            wait = self.estimated_wait(self._in_flight)
+            if self._in_flight >= self.max_in_flight or wait > self.max_queue_seconds:
+                self.rejected += 1
+                rejected = True
+            else:
+                self._in_flight += 1
+                self.admitted += 1
+                rejected = False
+
+        if rejected:
+            load = self.load()
+            print(f"🚦 Mensagem rejeitada: {load['in_flight']} em processamento, "
+                  f"fila estimada {wait:.1f}s")
+            raise AdmissionRejected(self._retry_after(wait), load)
+        return _Ticket(self)
+
+    def _release(self):
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+
+    def load(self):
+        """Carga atual (para clientes reduzirem o ritmo)"""
+        with self._lock:
+            in_flight = self._in_flight
+        wait = self.estimated_wait(in_flight)
+        accepting = not ADMISSION_ENABLED or (
+            in_flight < self.max_in_flight and wait <= self.max_queue_seconds
+        )
+        return {
+            'accepting': accepting,
+            'in_flight': in_flight,
+            'max_in_flight': self.max_in_flight,
+            'utilization': round(in_flight / self.max_in_flight, 3),
+            'queued': self.scheduler.queued()['live'],
+            'estimated_wait_s': round(wait, 2),
+            'max_queue_seconds': self.max_queue_seconds,
+            'retry_after': 0 if accepting else self._retry_after(wait)
+        }
+
+    def stats(self):
+        body = self.load()
+        body.update({'enabled': ADMISSION_ENABLED, 'admitted': self.admitted, 'rejected': self.rejected})
+        return body
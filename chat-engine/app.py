@@ -3,11 +3,35 @@ Chat Engine MÍNIMO + Knowledge Base
 """
 
 import os
-from flask import Flask, request, jsonify
+import json
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-import logging
-import requests
+import time
+import hashlib
+import hmac
+import threading
 from datetime import datetime
+from llm_client import ClaudeClient
+from llm_resilience import ResilientClaudeClient, CircuitOpenError
+from response_cache import response_cache
+from single_flight import SingleFlight, flight_key
+from knowledge_cache import KnowledgeCache
+from context_budget import assemble_context, fit_documents
+from document_chunks import fetch_chat_chunks, select_chunks
+from bm25_index import BM25Index
+from hybrid_retrieval import hybrid_search, retrieval_stats
+from conversation_memory import ConversationMemory, to_api_messages
+from intent_router import IntentClassifier, choose_route, routing_stats
+from fast_answers import FastAnswerEngine
+from llm_scheduler import llm_scheduler, QueueTimeoutError
+from admission_control import AdmissionController, AdmissionRejected
+
+# Busca vetorial local (NumPy) - opcional
+try:
+    from vector_index import VectorIndex
+    VECTOR_SEARCH_AVAILABLE = True
+except ImportError:
+    VECTOR_SEARCH_AVAILABLE = False
 
 app = Flask(__name__)
 CORS(app, origins=["*"])
@@ -16,6 +40,10 @@ CORS(app, origins=["*"])
 API_KEY_CACHE = None
 BQ_CLIENT_CACHE = None
 
+# Locks para inicialização concorrente (threads do gunicorn ou executor do ASGI)
+API_KEY_LOCK = threading.Lock()
+BQ_CLIENT_LOCK = threading.Lock()
+
 def get_claude_api_key():
     """Função SIMPLES para pegar API key"""
     global API_KEY_CACHE
@@ -23,20 +51,40 @@ def get_claude_api_key():
     if API_KEY_CACHE:
         return API_KEY_CACHE
     
-    try:
-        from google.cloud import secretmanager
-        client = secretmanager.SecretManagerServiceClient()
-        name = "projects/flower-ai-generator/secrets/claude-api-key/versions/latest"
-        response = client.access_secret_version(request={"name": name})
-        api_key = response.payload.data.decode("UTF-8").strip()
+    with API_KEY_LOCK:
+        # Outra thread pode ter carregado enquanto esperávamos o lock
+        if API_KEY_CACHE:
+            return API_KEY_CACHE
         
-        if api_key and len(api_key) > 50:
-            API_KEY_CACHE = api_key
-            return api_key
-        return None
-    except Exception as e:
-        print(f"Erro API key: {e}")
-        return None
+        try:
+            from google.cloud import secretmanager
+            client = secretmanager.SecretManagerServiceClient()
+            name = "projects/flower-ai-generator/secrets/claude-api-key/versions/latest"
+            response = client.access_secret_version(request={"name": name})
+            api_key = response.payload.data.decode("UTF-8").strip()
+            
+            if api_key and len(api_key) > 50:
+                API_KEY_CACHE = api_key
+                return api_key
+            return None
+        except Exception as e:
+            print(f"Erro API key: {e}")
+            return None
+
+# Cliente Claude com pool de conexões (compartilhado por todas as rotas),
+# com retry/backoff, circuit breaker e hedging opcional
+claude_client = ResilientClaudeClient(ClaudeClient(api_key_provider=get_claude_api_key), scheduler=llm_scheduler)
+claude_flights = SingleFlight()
+
+# Rejeita mensagens cedo (503 + Retry-After) quando a instância está sobrecarregada
+admission_control = AdmissionController(llm_scheduler, claude_client.latency)
+
+# Trechos candidatos por mensagem e teto de tokens de documentos no contexto
+KNOWLEDGE_MAX_CHUNKS = int(os.environ.get('KNOWLEDGE_MAX_CHUNKS', 8))
+KNOWLEDGE_CONTEXT_TOKENS = int(os.environ.get('KNOWLEDGE_CONTEXT_TOKENS', 2000))
+
+# hybrid (BM25 + vetorial com RRF), bm25 (palavras) ou vector (embeddings locais, salvos no upload)
+KNOWLEDGE_RETRIEVAL = os.environ.get('KNOWLEDGE_RETRIEVAL', 'hybrid')
 
 def get_bigquery_client():
     """Cliente BigQuery simples"""
@@ -45,58 +93,296 @@ def get_bigquery_client():
     if BQ_CLIENT_CACHE:
         return BQ_CLIENT_CACHE
     
+    with BQ_CLIENT_LOCK:
+        if BQ_CLIENT_CACHE:
+            return BQ_CLIENT_CACHE
+        
+        try:
+            from google.cloud import bigquery
+            client = bigquery.Client(project="flower-ai-generator")
+            
+            # Teste simples
+            query = "SELECT 1 as test"
+            list(client.query(query).result())
+            
+            BQ_CLIENT_CACHE = client
+            return client
+        except Exception as e:
+            print(f"BigQuery error: {e}")
+            return None
+
+def get_knowledge_documents(chat_id, user_message):
+    """Trechos dos documentos mais relevantes para a mensagem, agrupados por documento
+
+    Retorna lista de {'filename', 'content'}; o corte final fica por conta do
+    orçamento de contexto (context_budget).
+    """
     try:
-        from google.cloud import bigquery
-        client = bigquery.Client(project="flower-ai-generator")
+        # Índices do chat em memória (sem BigQuery enquanto os documentos não mudam)
+        _, indexes = knowledge_cache.get(chat_id)
         
-        # Teste simples
-        query = "SELECT 1 as test"
-        list(client.query(query).result())
+        # Busca nos trechos (não só no começo dos documentos)
+        if KNOWLEDGE_RETRIEVAL == 'hybrid':
+            ranked, _ = hybrid_search(indexes, user_message, KNOWLEDGE_MAX_CHUNKS * 2)
+        else:
+            index = indexes.get(KNOWLEDGE_RETRIEVAL) or indexes['bm25']
+            ranked = index.ranked_chunks(user_message, KNOWLEDGE_MAX_CHUNKS * 2)
+        return select_chunks(ranked, KNOWLEDGE_CONTEXT_TOKENS, KNOWLEDGE_MAX_CHUNKS)
         
-        BQ_CLIENT_CACHE = client
-        return client
     except Exception as e:
-        print(f"BigQuery error: {e}")
+        print(f"Knowledge error: {e}")
+        return []
+
+def load_chat_indexes(chat_id):
+    """Índices do chat ({'bm25', 'vector'}) a partir dos trechos no BigQuery"""
+    client = get_bigquery_client()
+    if not client:
+        raise RuntimeError("BigQuery indisponível")
+    
+    chunks = fetch_chat_chunks(client, "flower-ai-generator", chat_id)
+    indexes = {'bm25': BM25Index.from_chunks(chunks)}
+    if VECTOR_SEARCH_AVAILABLE:
+        indexes['vector'] = VectorIndex.from_chunks(chunks)
+    return indexes
+
+def format_knowledge_context(documents):
+    """Texto do bloco de documentos enviado ao Claude"""
+    if not documents:
+        return ""
+    
+    context = "=== DOCUMENTOS ===\n"
+    for doc in documents:
+        context += f"📄 {doc['filename']}:\n"
+        context += f"{doc['content']}\n\n"
+    return context
+
+def get_knowledge_context(chat_id, user_message, max_tokens=None):
+    """Buscar documentos relevantes, limitados a max_tokens (estimados)"""
+    documents = get_knowledge_documents(chat_id, user_message)
+    documents = fit_documents(documents, max_tokens or KNOWLEDGE_CONTEXT_TOKENS, query=user_message)
+    return format_knowledge_context(documents)
+
+# Modelos de dados (chats/mensagens) - opcional, como no backend
+try:
+    from models.database import user_model, chat_model, message_model, summary_model
+    MESSAGE_STORE_ENABLED = True
+except Exception as e:
+    MESSAGE_STORE_ENABLED = False
+    print(f"⚠️ Modelos de chat/mensagens não disponíveis: {e}")
+
+DEFAULT_SYSTEM_PROMPT = "Você é um assistente útil que responde em português."
+CHAT_CONFIG_TTL = int(os.environ.get('CHAT_CONFIG_TTL', 60))
+MAX_HISTORY_MESSAGES = int(os.environ.get('MAX_HISTORY_MESSAGES', 20))
+# Segredo compartilhado com o backend/jobs para rotas internas (header X-Internal-Token)
+INTERNAL_API_TOKEN = os.environ.get('INTERNAL_API_TOKEN', '')
+
+# Resumo incremental + últimas mensagens na íntegra (conversas longas)
+conversation_memory = (
+    ConversationMemory(message_model, summary_model, claude_client, history_limit=MAX_HISTORY_MESSAGES,
+                       scheduler=llm_scheduler, tenant_of=lambda chat_id: get_chat_tenant(chat_id))
+    if MESSAGE_STORE_ENABLED else None
+)
+
+# Cache curto da configuração do chat: chat_id -> (expira_em, config)
+CHAT_CONFIG_CACHE = {}
+CHAT_CONFIG_LOCK = threading.Lock()
+
+def get_chat_config(chat_id):
+    """Configuração do chat (system_prompt, modelo, max_tokens) com cache curto"""
+    now = time.monotonic()
+    with CHAT_CONFIG_LOCK:
+        cached = CHAT_CONFIG_CACHE.get(chat_id)
+        if cached and cached[0] > now:
+            return cached[1]
+    
+    config = {}
+    if MESSAGE_STORE_ENABLED:
+        try:
+            config = chat_model.get_chat_by_id(chat_id) or {}
+            # Plano do dono do chat: limites no escalonador do Claude
+            if config.get('user_id'):
+                owner = user_model.get_user_by_id(config['user_id']) or {}
+                config['plan'] = owner.get('plan')
+        except Exception as e:
+            print(f"Chat config error: {e}")
+            return {}
+    
+    with CHAT_CONFIG_LOCK:
+        CHAT_CONFIG_CACHE[chat_id] = (now + CHAT_CONFIG_TTL, config)
+    return config
+
+def get_chat_tenant(chat_id):
+    """(tenant, plano) de um chat para o escalonador: o dono do chat, ou o próprio chat"""
+    config = get_chat_config(chat_id)
+    return config.get('user_id') or chat_id, config.get('plan')
+
+# Perfil do agente especializado: chat_id -> (expira_em, perfil)
+AGENT_PROFILE_CACHE = {}
+AGENT_PROFILE_LOCK = threading.Lock()
+DEFAULT_INTENT_CLASSIFIER = IntentClassifier.for_agent()
+NO_FAST_ANSWERS = FastAnswerEngine()
+
+def parse_json_field(value, default):
+    """Campos JSON do BigQuery (STRING) -> objeto Python"""
+    if not value:
+        return default
+    if not isinstance(value, str):
+        return value
+    try:
+        return json.loads(value)
+    except ValueError:
+        return default
+
+def get_agent_profile(chat_id):
+    """Configuração do agente (agent_configurations) + classificador e respostas rápidas, com cache curto
+
+    Retorna {'agent_type', 'configuration', 'conversation_types', 'tracking_keywords',
+    'classifier', 'fast_answers'}; chats sem agente usam o classificador genérico.
+    """
+    now = time.monotonic()
+    with AGENT_PROFILE_LOCK:
+        cached = AGENT_PROFILE_CACHE.get(chat_id)
+        if cached and cached[0] > now:
+            return cached[1]
+    
+    profile = {
+        'agent_type': None,
+        'configuration': {},
+        'conversation_types': [],
+        'tracking_keywords': [],
+        'classifier': DEFAULT_INTENT_CLASSIFIER,
+        'fast_answers': NO_FAST_ANSWERS
+    }
+    
+    try:
+        client = get_bigquery_client()
+        if client:
+            from google.cloud import bigquery
+            
+            query = """
+            SELECT agent_type, configuration, conversation_types, tracking_keywords
+            FROM `flower-ai-generator.saas_chat_generator.agent_configurations`
+            WHERE chat_id = @chat_id AND status = 'active'
+            ORDER BY updated_at DESC
+            LIMIT 1
+            """
+            
+            job_config = bigquery.QueryJobConfig(
+                query_parameters=[bigquery.ScalarQueryParameter("chat_id", "STRING", chat_id)]
+            )
+            
+            rows = list(client.query(query, job_config=job_config).result())
+            if rows:
+                row = rows[0]
+                profile['agent_type'] = row['agent_type']
+                profile['configuration'] = parse_json_field(row['configuration'], {})
+                profile['conversation_types'] = parse_json_field(row['conversation_types'], [])
+                profile['tracking_keywords'] = parse_json_field(row['tracking_keywords'], [])
+                profile['classifier'] = IntentClassifier.for_agent(
+                    profile['conversation_types'], profile['tracking_keywords']
+                )
+                profile['fast_answers'] = FastAnswerEngine(profile['configuration'])
+    except Exception as e:
+        print(f"Agent config error: {e}")
+    
+    with AGENT_PROFILE_LOCK:
+        AGENT_PROFILE_CACHE[chat_id] = (now + CHAT_CONFIG_TTL, profile)
+    return profile
+
+def get_prompt_version(chat_config):
+    """Versão do system_prompt do chat (hash do conteúdo)"""
+    prompt = chat_config.get('system_prompt') or DEFAULT_SYSTEM_PROMPT
+    return hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:16]
+
+def get_document_set_version(chat_id):
+    """Versão dos documentos do chat (do cache de conhecimento)
+
+    Retorna None se não for possível consultar (o cache de respostas é ignorado).
+    """
+    try:
+        return knowledge_cache.version(chat_id)
+    except Exception as e:
+        print(f"Document version error: {e}")
         return None
 
-def get_knowledge_context(chat_id, user_message):
-    """Buscar documentos relevantes"""
+def fetch_document_set_version(chat_id):
+    """Versão dos documentos do chat no BigQuery (quantidade, processados, último upload); None se falhar
+
+    Processados entram na versão: o upload é processado em segundo plano no backend,
+    e a versão muda de novo quando o documento fica pronto.
+    """
     try:
         client = get_bigquery_client()
         if not client:
-            return ""
+            return None
         
         from google.cloud import bigquery
         
-        # Buscar documentos do chat
         query = """
-        SELECT filename, processed_content
+        SELECT COUNT(*) AS doc_count, COUNTIF(processing_status = 'completed') AS completed_count,
+               MAX(uploaded_at) AS last_upload
         FROM `flower-ai-generator.saas_chat_generator.chat_documents`
         WHERE chat_id = @chat_id
-        ORDER BY uploaded_at DESC
-        LIMIT 3
         """
         
         job_config = bigquery.QueryJobConfig(
             query_parameters=[bigquery.ScalarQueryParameter("chat_id", "STRING", chat_id)]
         )
         
-        results = list(client.query(query, job_config=job_config).result())
-        
-        if not results:
-            return ""
-        
-        context = "=== DOCUMENTOS ===\n"
-        for doc in results:
-            context += f"📄 {doc['filename']}:\n"
-            content = doc['processed_content'][:800] if doc['processed_content'] else ""
-            context += f"{content}\n\n"
-        
-        return context
-        
+        row = list(client.query(query, job_config=job_config).result())[0]
+        last_upload = row['last_upload'].isoformat() if row['last_upload'] else ''
+        return f"{row['doc_count']}:{row['completed_count']}:{last_upload}"
     except Exception as e:
-        print(f"Knowledge error: {e}")
-        return ""
+        print(f"Document version error: {e}")
+        return None
+
+# Índices + versão dos documentos por chat (LRU), invalidado pelo backend
+knowledge_cache = KnowledgeCache(load_chat_indexes, fetch_document_set_version)
+
+def invalidate_chat_caches(chat_id):
+    """Descartar config, agente, versão/índice de documentos e respostas cacheadas de um chat"""
+    with CHAT_CONFIG_LOCK:
+        CHAT_CONFIG_CACHE.pop(chat_id, None)
+    with AGENT_PROFILE_LOCK:
+        AGENT_PROFILE_CACHE.pop(chat_id, None)
+    knowledge_cache.invalidate(chat_id)
+    return response_cache.invalidate_chat(chat_id)
+
+def get_conversation_memory(chat_id, conversation_id):
+    """Resumo da conversa + mensagens ainda não resumidas, ou None sem conversa"""
+    if not conversation_id or not MESSAGE_STORE_ENABLED:
+        return None
+    
+    try:
+        return conversation_memory.load(chat_id, conversation_id)
+    except Exception as e:
+        print(f"History error: {e}")
+        return None
+
+def save_conversation_turn(chat_id, conversation_id, user_message, reply, source='web',
+                           source_phone=None, tokens_used=0, response_time_ms=0, memory=None):
+    """Salvar pergunta/resposta em background (não bloqueia a resposta ao usuário)
+
+    Com `memory` (retorno de get_conversation_memory), o resumo da conversa é
+    atualizado na mesma thread quando as mensagens antigas acumulam.
+    """
+    if not conversation_id or not MESSAGE_STORE_ENABLED:
+        return
+    
+    def save():
+        try:
+            message_model.save_message(chat_id, conversation_id, 'user', user_message,
+                                       source=source, source_phone=source_phone)
+            message_model.save_message(chat_id, conversation_id, 'assistant', reply,
+                                       source=source, source_phone=source_phone,
+                                       tokens_used=tokens_used, response_time_ms=response_time_ms)
+        except Exception as e:
+            print(f"Erro ao salvar mensagens: {e}")
+            return
+        
+        conversation_memory.after_turn(chat_id, conversation_id, memory)
+    
+    threading.Thread(target=save, daemon=True).start()
 
 @app.route('/')
 def index():
@@ -124,31 +410,20 @@ def test_claude():
         return {"error": "No API key"}, 500
     
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "x-api-key": api_key,
-            "anthropic-version": "2023-06-01"
-        }
-        
         data = {
-            "model": "claude-3-haiku-20240307",
             "max_tokens": 50,
             "messages": [{"role": "user", "content": "Say hello in Portuguese"}]
         }
         
-        response = requests.post(
-            "https://api.anthropic.com/v1/messages",
-            headers=headers,
-            json=data,
-            timeout=15
-        )
+        response = claude_client.create_message(data, timeout=15)
         
         if response.status_code == 200:
             result = response.json()
             return {
                 "success": True,
                 "message": result['content'][0]['text'],
-                "tokens": result.get('usage', {}).get('output_tokens', 0)
+                "tokens": result.get('usage', {}).get('output_tokens', 0),
+                "timing": response.timing
             }
         else:
             return {
@@ -201,6 +476,7 @@ def chat_page(chat_id):
         const chatId = '{chat_id}';
         const messagesDiv = document.getElementById('messages');
         const messageInput = document.getElementById('messageInput');
+        const conversationId = 'web_' + Date.now().toString(36) + Math.random().toString(36).slice(2, 8);
         
         function addMessage(role, content, hasKnowledge = false) {{
             const msg = document.createElement('div');
@@ -209,6 +485,23 @@ def chat_page(chat_id):
             msg.innerHTML = `<div class="content">${{content}}${{knowledgeBadge}}</div>`;
             messagesDiv.appendChild(msg);
             messagesDiv.scrollTop = messagesDiv.scrollHeight;
+            return msg;
+        }}
+        
+        function parseSSE(buffer, onEvent) {{
+            // Processa eventos completos (separados por linha em branco) e devolve o resto
+            const parts = buffer.split('\\n\\n');
+            const rest = parts.pop();
+            for (const part of parts) {{
+                let event = 'message';
+                let data = '';
+                for (const line of part.split('\\n')) {{
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) data += line.slice(5).trim();
+                }}
+                if (data) onEvent(event, JSON.parse(data));
+            }}
+            return rest;
         }}
         
         async function sendMessage() {{
@@ -218,28 +511,47 @@ def chat_page(chat_id):
             addMessage('user', message);
             messageInput.value = '';
             
-            addMessage('assistant', '🤔 Analisando documentos...');
+            const msg = addMessage('assistant', '🤔 Analisando documentos...');
+            const contentDiv = msg.querySelector('.content');
+            let text = '';
             
             try {{
-                const response = await fetch(`/api/send/${{chatId}}`, {{
+                const response = await fetch(`/api/send/${{chatId}}/stream`, {{
                     method: 'POST',
                     headers: {{ 'Content-Type': 'application/json' }},
-                    body: JSON.stringify({{ message }})
+                    body: JSON.stringify({{ message, conversation_id: conversationId }})
                 }});
                 
-                const data = await response.json();
+                if (!response.ok || !response.body) {{
+                    const data = await response.json();
+                    contentDiv.textContent = `❌ Erro: ${{data.error}}`;
+                    return;
+                }}
                 
-                // Remove "pensando"
-                messagesDiv.removeChild(messagesDiv.lastChild);
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
                 
-                if (data.success) {{
-                    addMessage('assistant', data.message, data.used_knowledge || false);
-                }} else {{
-                    addMessage('assistant', `❌ Erro: ${{data.error}}`);
+                while (true) {{
+                    const {{ done, value }} = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, {{ stream: true }});
+                    buffer = parseSSE(buffer, (event, data) => {{
+                        if (event === 'delta') {{
+                            text += data.text;
+                            contentDiv.textContent = text;
+                        }} else if (event === 'done') {{
+                            if (data.used_knowledge) {{
+                                contentDiv.insertAdjacentHTML('beforeend', '<span class="knowledge-badge">📚 Docs</span>');
+                            }}
+                        }} else if (event === 'error') {{
+                            contentDiv.textContent = `❌ Erro: ${{data.error}}`;
+                        }}
+                    }});
+                    messagesDiv.scrollTop = messagesDiv.scrollHeight;
                 }}
             }} catch (error) {{
-                messagesDiv.removeChild(messagesDiv.lastChild);
-                addMessage('assistant', '❌ Erro de conexão');
+                contentDiv.textContent = text || '❌ Erro de conexão';
             }}
         }}
         
@@ -251,6 +563,248 @@ def chat_page(chat_id):
 </html>
     '''
 
+def build_system_blocks(chat_system_prompt, knowledge_context, conversation_summary=None):
+    """System prompt nativo em blocos com breakpoints de prompt caching
+
+    Ordem do prefixo estável: system_prompt do chat, documentos e por último o
+    resumo da conversa (muda a cada poucas trocas).
+    Cada bloco recebe cache_control para que o Claude reaproveite o prefixo
+    entre mensagens (blocos abaixo do mínimo de tokens simplesmente não são cacheados).
+    """
+    blocks = [{
+        "type": "text",
+        "text": chat_system_prompt or DEFAULT_SYSTEM_PROMPT,
+        "cache_control": {"type": "ephemeral"}
+    }]
+    
+    if knowledge_context:
+        blocks.append({
+            "type": "text",
+            "text": (
+                f"USE ESTAS INFORMAÇÕES DOS DOCUMENTOS:\n{knowledge_context}"
+                "\nResponda baseado nos documentos quando relevante."
+            ),
+            "cache_control": {"type": "ephemeral"}
+        })
+    
+    if conversation_summary:
+        blocks.append({
+            "type": "text",
+            "text": f"RESUMO DA CONVERSA ATÉ AQUI (mensagens anteriores):\n{conversation_summary}",
+            "cache_control": {"type": "ephemeral"}
+        })
+    
+    return blocks
+
+def build_claude_payload(chat_id, message, history=None, max_tokens=None, summary=None, model=None):
+    """Montar payload do Claude com contexto da Knowledge Base
+
+    System prompt, documentos e histórico são encaixados no orçamento de tokens
+    do modelo usado (context_budget.assemble_context).
+    Retorna (payload, usou_documentos, tokens estimados por seção).
+    """
+    chat_config = get_chat_config(chat_id)
+    max_tokens = max_tokens or chat_config.get('max_tokens') or 500
+    
+    # BUSCAR KNOWLEDGE BASE
+    context = assemble_context(
+        chat_config.get('system_prompt') or DEFAULT_SYSTEM_PROMPT,
+        get_knowledge_documents(chat_id, message),
+        history,
+        message,
+        model=claude_client.resolve_model(model),
+        max_tokens=max_tokens,
+        documents_limit=KNOWLEDGE_CONTEXT_TOKENS,
+        summary=summary
+    )
+    knowledge_context = format_knowledge_context(context['documents'])
+    
+    claude_data = {
+        "max_tokens": max_tokens,
+        "system": build_system_blocks(context['system_prompt'], knowledge_context, context['summary']),
+        "messages": context['history'] + [{"role": "user", "content": message}]
+    }
+    if model:
+        claude_data["model"] = model
+    
+    return claude_data, bool(knowledge_context), context['tokens']
+
+def summarize_usage(usage):
+    """Tokens de entrada/saída e de prompt caching de uma resposta"""
+    usage = usage or {}
+    return {
+        "input_tokens": usage.get('input_tokens', 0),
+        "output_tokens": usage.get('output_tokens', 0),
+        "cache_creation_input_tokens": usage.get('cache_creation_input_tokens') or 0,
+        "cache_read_input_tokens": usage.get('cache_read_input_tokens') or 0
+    }
+
+def prepare_message(chat_id, message, data):
+    """Tudo que vem antes da chamada ao Claude (roteamento, histórico, cache, payload)
+
+    Sem histórico de conversa, se a pergunta tem resposta determinística na
+    configuração do agente ou já foi respondida (mesmo chat, prompt e documentos),
+    `ctx['cached']` vem preenchido e o Claude não é chamado.
+    """
+    conversation_id = data.get('conversation_id')
+    
+    ctx = {
+        "chat_id": chat_id,
+        "message": message,
+        "conversation_id": conversation_id,
+        "source": data.get('source', 'web'),
+        "source_phone": data.get('phone_number'),
+        "cache_key": None,
+        "cached": None,
+        "memory": None,
+        "started": time.perf_counter()
+    }
+    ctx['tenant'], ctx['plan'] = get_chat_tenant(chat_id)
+    
+    # Roteamento local: saudações/perguntas simples no modelo rápido, o resto no modelo do chat
+    chat_config = get_chat_config(chat_id)
+    profile = get_agent_profile(chat_id)
+    route = choose_route(
+        profile['classifier'], message,
+        chat_model=chat_config.get('claude_model'),
+        chat_max_tokens=chat_config.get('max_tokens'),
+        default_model=claude_client.resolve_model()
+    )
+    ctx['route'] = route
+    
+    memory = get_conversation_memory(chat_id, conversation_id)
+    history = to_api_messages(memory['recent']) if memory else []
+    summary = memory['summary'] if memory else None
+    ctx['memory'] = memory
+    
+    # Resposta rápida: pergunta factual respondida direto da configuração do agente.
+    # Como o cache, só fora de contexto multi-turn ("e o endereço?" depende da conversa)
+    if route['route'] != 'complex' and not history and not summary:
+        answer = profile['fast_answers'].match(message)
+        if answer:
+            ctx['cached'] = {
+                "reply": answer['reply'],
+                "used_knowledge": False,
+                "fast_path": {"intent": answer['intent'], "confidence": answer['confidence']}
+            }
+            return ctx
+    
+    # Cache de respostas só vale para perguntas fora de contexto multi-turn
+    if not history and not summary:
+        documents_version = get_document_set_version(chat_id)
+        if documents_version is not None:
+            prompt_version = get_prompt_version(chat_config)
+            ctx['cache_key'] = response_cache.make_key(chat_id, message, prompt_version, documents_version)
+            ctx['cached'] = response_cache.get(ctx['cache_key'])
+            if ctx['cached']:
+                return ctx
+    
+    claude_data, has_knowledge, context_tokens = build_claude_payload(
+        chat_id, message, history, max_tokens=route['max_tokens'], summary=summary, model=route['model']
+    )
+    ctx['claude_data'] = claude_data
+    ctx['has_knowledge'] = has_knowledge
+    ctx['context_tokens'] = context_tokens
+    return ctx
+
+def complete_message(ctx, reply, usage, timing, stop_reason=None):
+    """Tudo que vem depois da resposta do Claude; retorna o corpo da resposta"""
+    usage = summarize_usage(usage)
+    response_time_ms = int((time.perf_counter() - ctx['started']) * 1000)
+    
+    save_conversation_turn(
+        ctx['chat_id'], ctx['conversation_id'], ctx['message'], reply,
+        source=ctx['source'], source_phone=ctx['source_phone'],
+        tokens_used=usage['input_tokens'] + usage['output_tokens'],
+        response_time_ms=response_time_ms,
+        memory=ctx['memory']
+    )
+    
+    route = ctx['route']
+    routing_stats.record(route['route'], response_time_ms)
+    print(f"🧭 Chat {ctx['chat_id']}: rota={route['route']} ({route['label']} {route['confidence']:.2f}) "
+          f"modelo={route['model']} max_tokens={route['max_tokens']} {response_time_ms}ms")
+    
+    # Só respostas completas entram no cache
+    if ctx['cache_key'] and reply and stop_reason in (None, 'end_turn'):
+        response_cache.set(ctx['cache_key'], {
+            "reply": reply,
+            "used_knowledge": ctx['has_knowledge'],
+            "response_time_ms": response_time_ms
+        })
+    
+    return {
+        "success": True,
+        "message": reply,
+        "chat_id": ctx['chat_id'],
+        "conversation_id": ctx['conversation_id'],
+        "used_knowledge": ctx['has_knowledge'],
+        "cached": False,
+        "usage": usage,
+        "context_tokens": ctx['context_tokens'],
+        "route": {"route": route['route'], "model": route['model'], "confidence": route['confidence']},
+        "timing": timing
+    }
+
+def cached_message(ctx):
+    """Corpo da resposta sem chamada ao Claude (cache de respostas ou resposta rápida)"""
+    cached = ctx['cached']
+    fast_path = cached.get('fast_path')
+    response_time_ms = int((time.perf_counter() - ctx['started']) * 1000)
+    
+    save_conversation_turn(
+        ctx['chat_id'], ctx['conversation_id'], ctx['message'], cached['reply'],
+        source=ctx['source'], source_phone=ctx['source_phone'],
+        response_time_ms=response_time_ms
+    )
+    
+    body = {
+        "success": True,
+        "message": cached['reply'],
+        "chat_id": ctx['chat_id'],
+        "conversation_id": ctx['conversation_id'],
+        "used_knowledge": cached['used_knowledge'],
+        "cached": fast_path is None,
+        "usage": summarize_usage({}),
+        "timing": {"total_ms": response_time_ms}
+    }
+    
+    if fast_path:
+        elapsed_ms = (time.perf_counter() - ctx['started']) * 1000
+        routing_stats.record('fast_path', round(elapsed_ms, 3))
+        print(f"🧭 Chat {ctx['chat_id']}: rota=fast_path ({fast_path['intent']} "
+              f"{fast_path['confidence']:.2f}) {elapsed_ms:.2f}ms")
+        body["fast_path"] = fast_path
+    
+    return body
+
+def call_claude(claude_data, tenant=None, plan=None):
+    """Chamada bloqueante ao Claude (na vez do tenant); retorna (status, json ou None, timing)"""
+    with llm_scheduler.slot(tenant, plan, 'live'):
+        response = claude_client.create_message(claude_data, timeout=30)
+    result = response.json() if response.status_code == 200 else None
+    return response.status_code, result, response.timing
+
+def sse_event(event, data):
+    """Formatar evento Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def cached_stream_events(ctx):
+    """Eventos SSE de uma resposta vinda do cache (um único delta + done)"""
+    body = cached_message(ctx)
+    yield sse_event("delta", {"text": body.pop("message")})
+    body.pop("success")
+    body["stop_reason"] = "end_turn"
+    yield sse_event("done", body)
+
+def overloaded_response(error):
+    """503 com Retry-After e a carga atual (a ponte do WhatsApp reduz o ritmo)"""
+    return (
+        {"success": False, "error": str(error), "retry_after": error.retry_after, "load": error.load},
+        503,
+        {'Retry-After': str(error.retry_after)}
+    )
+
 @app.route('/api/send/<chat_id>', methods=['POST'])
 def send_message(chat_id):
     """API para enviar mensagem COM Knowledge Base"""
@@ -261,61 +815,177 @@ def send_message(chat_id):
         if not message:
             return {"success": False, "error": "Mensagem vazia"}, 400
         
-        api_key = get_claude_api_key()
-        if not api_key:
-            return {"success": False, "error": "API key indisponível"}, 500
-        
-        # BUSCAR KNOWLEDGE BASE
-        knowledge_context = get_knowledge_context(chat_id, message)
-        has_knowledge = bool(knowledge_context)
-        
-        # Montar prompt com contexto
-        system_prompt = "Você é um assistente útil que responde em português."
-        
-        if has_knowledge:
-            system_prompt += f"\n\nUSE ESTAS INFORMAÇÕES DOS DOCUMENTOS:\n{knowledge_context}"
-            system_prompt += "\nResponda baseado nos documentos quando relevante."
-        
-        headers = {
-            "Content-Type": "application/json",
-            "x-api-key": api_key,
-            "anthropic-version": "2023-06-01"
-        }
-        
-        claude_data = {
-            "model": "claude-3-haiku-20240307",
-            "max_tokens": 500,
-            "messages": [
-                {"role": "user", "content": f"Sistema: {system_prompt}"},
-                {"role": "assistant", "content": "Entendido!"},
-                {"role": "user", "content": message}
-            ]
-        }
-        
-        response = requests.post(
-            "https://api.anthropic.com/v1/messages",
-            headers=headers,
-            json=claude_data,
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return {
-                "success": True,
-                "message": result['content'][0]['text'],
-                "chat_id": chat_id,
-                "used_knowledge": has_knowledge
-            }
-        else:
-            return {
-                "success": False,
-                "error": f"Claude error {response.status_code}"
-            }, 500
+        with admission_control.admit():
+            api_key = get_claude_api_key()
+            if not api_key:
+                return {"success": False, "error": "API key indisponível"}, 500
             
+            ctx = prepare_message(chat_id, message, data)
+            if ctx['cached']:
+                return cached_message(ctx)
+            
+            # Requisições idênticas simultâneas compartilham uma única chamada ao Claude
+            (status_code, result, timing), shared = claude_flights.do(
+                flight_key(ctx['claude_data']),
+                lambda: call_claude(ctx['claude_data'], ctx['tenant'], ctx['plan'])
+            )
+            
+            if status_code == 200:
+                body = complete_message(ctx, result['content'][0]['text'], result.get('usage'),
+                                        timing, result.get('stop_reason'))
+                body['coalesced'] = shared
+                return body
+            else:
+                return {
+                    "success": False,
+                    "error": f"Claude error {status_code}"
+                }, 500
+            
+    except AdmissionRejected as e:
+        return overloaded_response(e)
+    except (CircuitOpenError, QueueTimeoutError) as e:
+        return {"success": False, "error": str(e)}, 503, {'Retry-After': str(e.retry_after)}
     except Exception as e:
         return {"success": False, "error": str(e)}, 500
 
+@app.route('/api/send/<chat_id>/stream', methods=['POST'])
+def send_message_stream(chat_id):
+    """API de mensagem em modo streaming (Server-Sent Events)
+
+    Eventos emitidos:
+    - delta: {"text": "..."} para cada trecho gerado pelo Claude
+    - done: {"chat_id", "conversation_id", "used_knowledge", "usage", "timing",
+      "stop_reason"} ao final (usage inclui tokens lidos/gravados no prompt cache)
+    - error: {"error": "..."} se algo falhar no meio do caminho
+      (com "retry_after" quando o circuit breaker do Claude está aberto ou a fila estourou)
+    """
+    data = request.get_json() or {}
+    message = data.get('message', '').strip()
+    
+    if not message:
+        return {"success": False, "error": "Mensagem vazia"}, 400
+    
+    # Sobrecarga é recusada antes de abrir o stream (status 503 ainda é possível)
+    try:
+        admission = admission_control.admit()
+    except AdmissionRejected as e:
+        return overloaded_response(e)
+    
+    api_key = get_claude_api_key()
+    if not api_key:
+        admission.release()
+        return {"success": False, "error": "API key indisponível"}, 500
+    
+    def generate():
+        try:
+            ctx = prepare_message(chat_id, message, data)
+            if ctx['cached']:
+                yield from cached_stream_events(ctx)
+                return
+            
+            # O slot fica ocupado até o fim do streaming
+            ticket = llm_scheduler.acquire(ctx['tenant'], ctx['plan'], 'live')
+            try:
+                response = claude_client.create_message(ctx['claude_data'], timeout=30, stream=True)
+            except Exception:
+                llm_scheduler.release(ticket)
+                raise
+            
+            if response.status_code != 200:
+                response.close()
+                llm_scheduler.release(ticket)
+                yield sse_event("error", {"error": f"Claude error {response.status_code}"})
+                return
+            
+            usage = {}
+            stop_reason = None
+            reply = ""
+            events = claude_client.iter_events(response)
+            try:
+                for event in events:
+                    event_type = event.get('type')
+                    if event_type == 'message_start':
+                        usage.update(event.get('message', {}).get('usage', {}))
+                    elif event_type == 'content_block_delta':
+                        delta = event.get('delta', {})
+                        if delta.get('type') == 'text_delta' and delta.get('text'):
+                            reply += delta['text']
+                            yield sse_event("delta", {"text": delta['text']})
+                    elif event_type == 'message_delta':
+                        usage.update(event.get('usage', {}))
+                        stop_reason = event.get('delta', {}).get('stop_reason', stop_reason)
+                    elif event_type == 'error':
+                        error = event.get('error', {})
+                        yield sse_event("error", {"error": error.get('message', 'Claude stream error')})
+                        return
+            finally:
+                events.close()
+                llm_scheduler.release(ticket)
+            
+            body = complete_message(ctx, reply, usage, response.timing, stop_reason)
+            body.pop("message")
+            body.pop("success")
+            body["stop_reason"] = stop_reason
+            yield sse_event("done", body)
+            
+        except (CircuitOpenError, QueueTimeoutError) as e:
+            yield sse_event("error", {"error": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+        finally:
+            admission.release()
+    
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+    # Cliente que desconecta antes do primeiro evento também libera a vaga
+    response.call_on_close(admission.release)
+    return response
+
+@app.route('/api/load')
+def load():
+    """Carga atual da instância: clientes (ponte do WhatsApp) reduzem o ritmo quando accepting=false"""
+    body = admission_control.load()
+    headers = {'Retry-After': str(body['retry_after'])} if not body['accepting'] else {}
+    return body, 200, headers
+
+@app.route('/api/cache/invalidate/<chat_id>', methods=['POST'])
+def invalidate_cache(chat_id):
+    """Invalidar caches do chat (chamado pelo backend ao mudar prompt/documentos)
+    
+    Exige o header X-Internal-Token = INTERNAL_API_TOKEN; sem token configurado a rota fica fechada.
+    """
+    if not INTERNAL_API_TOKEN:
+        return {"success": False, "error": "INTERNAL_API_TOKEN não configurado"}, 503
+    token = request.headers.get('X-Internal-Token', '')
+    if not hmac.compare_digest(token.encode(), INTERNAL_API_TOKEN.encode()):
+        return {"success": False, "error": "Não autorizado"}, 401
+    removed = invalidate_chat_caches(chat_id)
+    return {"success": True, "chat_id": chat_id, "removed_responses": removed}
+
+@app.route('/metrics')
+def metrics():
+    """Métricas internas do chat-engine"""
+    return {
+        "response_cache": response_cache.stats(),
+        "single_flight": claude_flights.stats(),
+        "knowledge_index": dict(
+            knowledge_cache.stats(),
+            retrieval=KNOWLEDGE_RETRIEVAL,
+            vector_search=VECTOR_SEARCH_AVAILABLE
+        ),
+        "retrieval": retrieval_stats.stats(),
+        "claude": claude_client.stats(),
+        "conversation_memory": conversation_memory.stats() if conversation_memory else None,
+        "routing": routing_stats.stats(),
+        "scheduler": llm_scheduler.stats(),
+        "admission": admission_control.stats()
+    }
 
 @app.route('/api/generate-master-prompt/<chat_id>', methods=['POST'])
 def generate_master_prompt(chat_id):
@@ -339,7 +1009,8 @@ def generate_master_prompt(chat_id):
             }), 400
         
         # Gerar prompt master com IA
-        master_prompt = create_master_prompt_with_ai(chat_config, documents_context)
+        tenant, plan = get_chat_tenant(chat_id)
+        master_prompt = create_master_prompt_with_ai(chat_config, documents_context, tenant, plan)
         
         return jsonify({
             'success': True,
@@ -354,14 +1025,10 @@ def generate_master_prompt(chat_id):
             'fallback_prompt': generate_fallback_prompt(chat_config)
         }), 500
 
-def create_master_prompt_with_ai(chat_config, documents_context):
-    """Cria prompt master usando Claude - MESMA ESTRUTURA DO /api/send"""
-    api_key = get_claude_api_key()
-    
-    if not api_key:
-        print("API key não disponível")
-        return generate_fallback_prompt(chat_config)
-    
+def build_master_prompt_payload(chat_config, documents_context):
+    """Montar payload do Claude para geração do prompt master"""
+    business_context = (chat_config.get('business_context') or '').strip()
+    business_line = f"\n- Contexto do negócio: {business_context}" if business_context else ""
     analysis_prompt = f"""Você é um especialista em criação de prompts para assistentes virtuais.
 
 MISSÃO: Criar um PROMPT DE SISTEMA MASTER para um assistente virtual.
@@ -369,7 +1036,7 @@ MISSÃO: Criar um PROMPT DE SISTEMA MASTER para um assistente virtual.
 CONFIGURAÇÃO DO CHAT:
 - Nome: {chat_config['chat_name']}
 - Tipo: {chat_config['chat_type']}
-- Personalidade: {chat_config['personality']}
+- Personalidade: {chat_config['personality']}{business_line}
 
 DOCUMENTOS DO NEGÓCIO:
 {documents_context}
@@ -384,29 +1051,33 @@ INSTRUÇÕES PARA O PROMPT MASTER:
 
 Retorne APENAS o prompt de sistema, sem explicações adicionais."""
 
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": api_key,
-        "anthropic-version": "2023-06-01"
-    }
-    
     claude_data = {
-        "model": "claude-3-haiku-20240307",
         "max_tokens": 1000,
+        "system": [{
+            "type": "text",
+            "text": analysis_prompt,
+            "cache_control": {"type": "ephemeral"}
+        }],
         "messages": [
-            {"role": "user", "content": f"Sistema: {analysis_prompt}"},
-            {"role": "assistant", "content": "Entendido! Vou criar o prompt master."},
             {"role": "user", "content": "Crie o prompt master agora."}
         ]
     }
+    
+    return claude_data
+
+def create_master_prompt_with_ai(chat_config, documents_context, tenant=None, plan=None):
+    """Cria prompt master usando Claude - MESMA ESTRUTURA DO /api/send (prioridade background)"""
+    api_key = get_claude_api_key()
+    
+    if not api_key:
+        print("API key não disponível")
+        return generate_fallback_prompt(chat_config)
+    
+    claude_data = build_master_prompt_payload(chat_config, documents_context)
 
     try:
-        response = requests.post(
-            "https://api.anthropic.com/v1/messages",
-            headers=headers,
-            json=claude_data,
-            timeout=30
-        )
+        with llm_scheduler.slot(tenant, plan, 'background'):
+            response = claude_client.create_message(claude_data, timeout=30)
         
         if response.status_code == 200:
             result = response.json()
@@ -0,0 +1,301 @@
+"""
+Chat Engine - modo ASGI (asyncio)
+Rotas quentes (envio de mensagem, prompt master, knowledge) com cliente HTTP assíncrono;
+BigQuery/Secret Manager continuam síncronos e rodam em um executor limitado.
+Todas as outras rotas são servidas pelo app Flask original montado como WSGI.
+
+Uso: uvicorn asgi_app:app --host 0.0.0.0 --port $PORT
+"""
+
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from starlette.applications import Starlette
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.background import BackgroundTask
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route, Mount
+
+import app as engine
+from llm_client import AsyncClaudeClient
+from llm_resilience import AsyncResilientClaudeClient, CircuitOpenError
+from single_flight import AsyncSingleFlight, flight_key
+from llm_scheduler import llm_scheduler, QueueTimeoutError
+from admission_control import AdmissionRejected
+
+# Executor limitado para chamadas bloqueantes (BigQuery, Secret Manager)
+BLOCKING_EXECUTOR_WORKERS = int(os.environ.get('BLOCKING_EXECUTOR_WORKERS', 16))
+blocking_executor = ThreadPoolExecutor(
+    max_workers=BLOCKING_EXECUTOR_WORKERS,
+    thread_name_prefix='chat-engine-blocking'
+)
+
+# Mesmo circuit breaker e latências do cliente síncrono: o estado do upstream é um só
+async_claude_client = AsyncResilientClaudeClient(
+    AsyncClaudeClient(api_key_provider=engine.get_claude_api_key),
+    breaker=engine.claude_client.breaker,
+    latency=engine.claude_client.latency,
+    scheduler=llm_scheduler
+)
+claude_flights = AsyncSingleFlight()
+
+async def run_blocking(func, *args):
+    """Executar função síncrona no executor limitado"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, func, *args)
+
+async def call_claude(claude_data, api_key, tenant=None, plan=None):
+    """Chamada assíncrona ao Claude (na vez do tenant); retorna (status, json ou None, timing)"""
+    async with llm_scheduler.slot_async(tenant, plan, 'live'):
+        response = await async_claude_client.create_message(claude_data, api_key, timeout=30)
+    result = response.json() if response.status_code == 200 else None
+    return response.status_code, result, response.timing
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except Exception:
+        return {}
+
+def overloaded_response(error):
+    body, status_code, headers = engine.overloaded_response(error)
+    return JSONResponse(body, status_code=status_code, headers=headers)
+
+async def send_message(request):
+    """API para enviar mensagem COM Knowledge Base (assíncrona)"""
+    chat_id = request.path_params['chat_id']
+    try:
+        data = await read_json(request)
+        message = data.get('message', '').strip()
+
+        if not message:
+            return JSONResponse({"success": False, "error": "Mensagem vazia"}, status_code=400)
+
+        with engine.admission_control.admit():
+            api_key = await run_blocking(engine.get_claude_api_key)
+            if not api_key:
+                return JSONResponse({"success": False, "error": "API key indisponível"}, status_code=500)
+
+            ctx = await run_blocking(engine.prepare_message, chat_id, message, data)
+            if ctx['cached']:
+                return JSONResponse(engine.cached_message(ctx))
+
+            # Requisições idênticas simultâneas compartilham uma única chamada ao Claude
+            (status_code, result, timing), shared = await claude_flights.do(
+                flight_key(ctx['claude_data']),
+                lambda: call_claude(ctx['claude_data'], api_key, ctx['tenant'], ctx['plan'])
+            )
+
+            if status_code == 200:
+                body = engine.complete_message(
+                    ctx, result['content'][0]['text'], result.get('usage'),
+                    timing, result.get('stop_reason')
+                )
+                body['coalesced'] = shared
+                return JSONResponse(body)
+            else:
+                return JSONResponse({
+                    "success": False,
+                    "error": f"Claude error {status_code}"
+                }, status_code=500)
+
+    except AdmissionRejected as e:
+        return overloaded_response(e)
+    except (CircuitOpenError, QueueTimeoutError) as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=503,
+                            headers={'Retry-After': str(e.retry_after)})
+    except Exception as e:
+        return JSONResponse({"success": False, "error": str(e)}, status_code=500)
+
+async def send_message_stream(request):
+    """API de mensagem em streaming (SSE) - mesmos eventos do modo Flask"""
+    chat_id = request.path_params['chat_id']
+    data = await read_json(request)
+    message = data.get('message', '').strip()
+
+    if not message:
+        return JSONResponse({"success": False, "error": "Mensagem vazia"}, status_code=400)
+
+    # Sobrecarga é recusada antes de abrir o stream (status 503 ainda é possível)
+    try:
+        admission = engine.admission_control.admit()
+    except AdmissionRejected as e:
+        return overloaded_response(e)
+
+    api_key = await run_blocking(engine.get_claude_api_key)
+    if not api_key:
+        admission.release()
+        return JSONResponse({"success": False, "error": "API key indisponível"}, status_code=500)
+
+    async def generate():
+        try:
+            ctx = await run_blocking(engine.prepare_message, chat_id, message, data)
+            if ctx['cached']:
+                for event in engine.cached_stream_events(ctx):
+                    yield event
+                return
+
+            # O slot fica ocupado até o fim do streaming
+            ticket = await llm_scheduler.acquire_async(ctx['tenant'], ctx['plan'], 'live')
+            try:
+                response = await async_claude_client.open_stream(ctx['claude_data'], api_key, timeout=30)
+            except BaseException:
+                llm_scheduler.release(ticket)
+                raise
+
+            if response.status_code != 200:
+                await response.aclose()
+                llm_scheduler.release(ticket)
+                yield engine.sse_event("error", {"error": f"Claude error {response.status_code}"})
+                return
+
+            usage = {}
+            stop_reason = None
+            reply = ""
+            events = async_claude_client.aiter_events(response)
+            try:
+                async for event in events:
+                    event_type = event.get('type')
+                    if event_type == 'message_start':
+                        usage.update(event.get('message', {}).get('usage', {}))
+                    elif event_type == 'content_block_delta':
+                        delta = event.get('delta', {})
+                        if delta.get('type') == 'text_delta' and delta.get('text'):
+                            reply += delta['text']
+                            yield engine.sse_event("delta", {"text": delta['text']})
+                    elif event_type == 'message_delta':
+                        usage.update(event.get('usage', {}))
+                        stop_reason = event.get('delta', {}).get('stop_reason', stop_reason)
+                    elif event_type == 'error':
+                        error = event.get('error', {})
+                        yield engine.sse_event("error", {"error": error.get('message', 'Claude stream error')})
+                        return
+            finally:
+                await events.aclose()
+                llm_scheduler.release(ticket)
+
+            body = engine.complete_message(ctx, reply, usage, response.timing, stop_reason)
+            body.pop("message")
+            body.pop("success")
+            body["stop_reason"] = stop_reason
+            yield engine.sse_event("done", body)
+
+        except (CircuitOpenError, QueueTimeoutError) as e:
+            yield engine.sse_event("error", {"error": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            yield engine.sse_event("error", {"error": str(e)})
+        finally:
+            admission.release()
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        background=BackgroundTask(admission.release)
+    )
+
+async def create_master_prompt_with_ai(chat_config, documents_context, tenant=None, plan=None):
+    """Versão assíncrona de engine.create_master_prompt_with_ai"""
+    api_key = await run_blocking(engine.get_claude_api_key)
+
+    if not api_key:
+        print("API key não disponível")
+        return engine.generate_fallback_prompt(chat_config)
+
+    claude_data = engine.build_master_prompt_payload(chat_config, documents_context)
+
+    try:
+        async with llm_scheduler.slot_async(tenant, plan, 'background'):
+            response = await async_claude_client.create_message(claude_data, api_key, timeout=30)
+
+        if response.status_code == 200:
+            result = response.json()
+            generated_prompt = result['content'][0]['text'].strip()
+            print(f"✅ Prompt master gerado com sucesso ({len(generated_prompt)} chars)")
+            return generated_prompt
+        else:
+            print(f"❌ Claude API error: {response.status_code}")
+            return engine.generate_fallback_prompt(chat_config)
+
+    except Exception as e:
+        print(f"❌ Erro ao chamar Claude API: {e}")
+        return engine.generate_fallback_prompt(chat_config)
+
+async def generate_master_prompt(request):
+    """Endpoint dedicado para gerar prompt master baseado nos documentos do chat"""
+    chat_id = request.path_params['chat_id']
+    data = await read_json(request)
+    chat_config = {
+        'chat_name': data.get('chat_name', ''),
+        'chat_type': data.get('chat_type', 'support'),
+        'personality': data.get('personality', 'professional'),
+        'business_context': data.get('business_context', '')
+    }
+
+    try:
+        documents_context = await run_blocking(engine.get_knowledge_context, chat_id, "análise completa")
+
+        if not documents_context:
+            return JSONResponse({
+                'error': 'Nenhum documento encontrado para este chat',
+                'fallback_prompt': engine.generate_fallback_prompt(chat_config)
+            }, status_code=400)
+
+        tenant, plan = await run_blocking(engine.get_chat_tenant, chat_id)
+        master_prompt = await create_master_prompt_with_ai(chat_config, documents_context, tenant, plan)
+
+        return JSONResponse({
+            'success': True,
+            'master_prompt': master_prompt,
+            'chat_config': chat_config
+        })
+
+    except Exception as e:
+        print(f"Erro ao gerar prompt master: {e}")
+        return JSONResponse({
+            'error': str(e),
+            'fallback_prompt': engine.generate_fallback_prompt(chat_config)
+        }, status_code=500)
+
+async def debug_knowledge(request):
+    """Debug: verificar se knowledge context funciona"""
+    chat_id = request.path_params['chat_id']
+    context = await run_blocking(engine.get_knowledge_context, chat_id, "teste debug")
+    return JSONResponse({
+        'chat_id': chat_id,
+        'has_context': bool(context),
+        'context_length': len(context) if context else 0,
+        'context_preview': context[:200] if context else "VAZIO"
+    })
+
+async def load(request):
+    """Carga atual da instância (mesmo corpo do modo Flask)"""
+    body, status_code, headers = engine.load()
+    return JSONResponse(body, status_code=status_code, headers=headers)
+
+async def metrics(request):
+    """Métricas do modo ASGI (inclui as do app Flask)"""
+    body = engine.metrics()
+    body['single_flight'] = claude_flights.stats()
+    body['claude_async'] = async_claude_client.stats()
+    return JSONResponse(body)
+
+async def shutdown():
+    await async_claude_client.aclose()
+    blocking_executor.shutdown(wait=False)
+
+app = Starlette(
+    routes=[
+        Route('/api/send/{chat_id}', send_message, methods=['POST']),
+        Route('/api/send/{chat_id}/stream', send_message_stream, methods=['POST']),
+        Route('/api/generate-master-prompt/{chat_id}', generate_master_prompt, methods=['POST']),
+        Route('/debug/knowledge/{chat_id}', debug_knowledge),
+        Route('/metrics', metrics),
+        Route('/api/load', load),
+        # Demais rotas (/, /health, /test, /chat/<id>) continuam no Flask
+        Mount('/', app=WSGIMiddleware(engine.app))
+    ],
+    on_shutdown=[shutdown]
+)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Regeneração em lote dos prompts master - Message Batches API
+Job offline para quando um template muda e vários chats precisam de prompt novo:
+coleta os chats afetados, envia todas as gerações em um único lote (metade do preço,
+sem disputar rate limit com as conversas ao vivo), espera o lote encerrar e grava
+os prompts com um único UPDATE no BigQuery.
+
+Chats com agente especializado (agent_configurations ativa) ficam de fora: o prompt deles
+vem do advanced_prompt_generator (serviços, preços, convênios, médicos) e é regenerado
+pelo backend em POST /api/chats/<chat_id>/regenerate-agent-prompt.
+
+Uso:
+    python bulk_prompt_regeneration.py --chat-type support
+    python bulk_prompt_regeneration.py --chat-id <id> --chat-id <id> --dry-run
+    python bulk_prompt_regeneration.py --batch-id msgbatch_... (retomar um lote já enviado)
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8999 python bulk_prompt_regeneration.py ... (servidor fake)
+"""
+
+import os
+import sys
+import time
+import argparse
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+import app as engine
+
+CHATS_TABLE = "flower-ai-generator.saas_chat_generator.chats"
+AGENT_CONFIGURATIONS_TABLE = "flower-ai-generator.saas_chat_generator.agent_configurations"
+BULK_POLL_INTERVAL = float(os.environ.get('BULK_POLL_INTERVAL', 30))
+# Leituras de documentos em paralelo (BigQuery) ao montar o lote
+BULK_CONTEXT_WORKERS = int(os.environ.get('BULK_CONTEXT_WORKERS', 8))
+CHAT_ENGINE_URL = os.environ.get('CHAT_ENGINE_URL', '')
+
+def find_chats(chat_type=None, chat_ids=None):
+    """Chats ativos afetados (por tipo e/ou lista de ids)"""
+    from google.cloud import bigquery
+
+    client = engine.get_bigquery_client()
+    if not client:
+        raise RuntimeError("BigQuery indisponível")
+
+    conditions = ["c.status = 'active'"]
+    parameters = []
+    if chat_type:
+        conditions.append("c.chat_type = @chat_type")
+        parameters.append(bigquery.ScalarQueryParameter("chat_type", "STRING", chat_type))
+    if chat_ids:
+        conditions.append("c.chat_id IN UNNEST(@chat_ids)")
+        parameters.append(bigquery.ArrayQueryParameter("chat_ids", "STRING", chat_ids))
+
+    query = f"""
+    SELECT c.chat_id, c.chat_name, c.chat_description, c.chat_type, c.personality,
+           EXISTS(
+               SELECT 1 FROM `{AGENT_CONFIGURATIONS_TABLE}` a
+               WHERE a.chat_id = c.chat_id AND a.status = 'active'
+           ) AS has_agent
+    FROM `{CHATS_TABLE}` c
+    WHERE {' AND '.join(conditions)}
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=parameters)
+    return [dict(row) for row in client.query(query, job_config=job_config).result()]
+
+def build_batch_requests(chats):
+    """Uma requisição por chat (custom_id = chat_id).
+
+    Ficam de fora, com o motivo em skipped (chat_id -> motivo): chats com agente
+    especializado (prompt do advanced_prompt_generator), chats sem descrição do negócio
+    (o prompt master genérico sairia sem contexto) e chats sem documentos.
+    """
+    def build(chat):
+        if chat.get('has_agent'):
+            return 'agente especializado'
+        business_context = (chat.get('chat_description') or '').strip()
+        if not business_context:
+            return 'sem descrição do negócio'
+        documents_context = engine.get_knowledge_context(chat['chat_id'], "análise completa")
+        if not documents_context:
+            return 'sem documentos'
+        chat_config = {
+            'chat_name': chat.get('chat_name') or '',
+            'chat_type': chat.get('chat_type') or 'support',
+            'personality': chat.get('personality') or 'professional',
+            'business_context': business_context
+        }
+        return {
+            'custom_id': chat['chat_id'],
+            'params': engine.build_master_prompt_payload(chat_config, documents_context)
+        }
+
+    with ThreadPoolExecutor(max_workers=BULK_CONTEXT_WORKERS) as executor:
+        built = list(executor.map(build, chats))
+
+    batch_requests = [item for item in built if isinstance(item, dict)]
+    skipped = {chat['chat_id']: item for chat, item in zip(chats, built) if not isinstance(item, dict)}
+    return batch_requests, skipped
+
+def submit_batch(batch_requests):
+    response = engine.claude_client.create_batch(batch_requests)
+    if response.status_code != 200:
+        raise RuntimeError(f"Erro ao criar lote: {response.status_code} {response.text[:300]}")
+    batch = response.json()
+    print(f"📦 Lote {batch['id']} enviado ({len(batch_requests)} chats)")
+    return batch
+
+def wait_for_batch(batch_id, poll_interval=BULK_POLL_INTERVAL):
+    """Consultar o lote até processing_status == 'ended'"""
+    while True:
+        response = engine.claude_client.get_batch(batch_id)
+        if response.status_code != 200:
+            print(f"⚠️ Erro ao consultar lote: {response.status_code}")
+        else:
+            batch = response.json()
+            counts = batch.get('request_counts', {})
+            print(f"⏳ Lote {batch_id}: {batch['processing_status']} {counts}")
+            if batch['processing_status'] == 'ended':
+                return batch
+        time.sleep(poll_interval)
+
+def collect_prompts(batch):
+    """chat_id -> prompt gerado (só resultados 'succeeded'); e lista de falhas"""
+    prompts, failed = {}, []
+    for item in engine.claude_client.iter_batch_results(batch):
+        result = item.get('result') or {}
+        if result.get('type') == 'succeeded':
+            text = result['message']['content'][0]['text'].strip()
+            if text:
+                prompts[item['custom_id']] = text
+                continue
+        failed.append(item.get('custom_id'))
+    return prompts, failed
+
+def bulk_update_prompts(prompts):
+    """Gravar todos os prompts com um único UPDATE ... FROM UNNEST"""
+    from google.cloud import bigquery
+
+    client = engine.get_bigquery_client()
+    if not client:
+        raise RuntimeError("BigQuery indisponível")
+
+    updates = [
+        bigquery.StructQueryParameter(
+            None,
+            bigquery.ScalarQueryParameter("chat_id", "STRING", chat_id),
+            bigquery.ScalarQueryParameter("system_prompt", "STRING", prompt)
+        )
+        for chat_id, prompt in prompts.items()
+    ]
+    query = f"""
+    UPDATE `{CHATS_TABLE}` c
+    SET system_prompt = u.system_prompt, updated_at = CURRENT_TIMESTAMP()
+    FROM UNNEST(@updates) u
+    WHERE c.chat_id = u.chat_id
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ArrayQueryParameter("updates", "STRUCT", updates)
+    ])
+    job = client.query(query, job_config=job_config)
+    job.result()
+    return job.num_dml_affected_rows
+
+def invalidate_caches(chat_ids, chat_engine_url=None):
+    """Avisar o chat-engine (best-effort) para não servir respostas do prompt antigo"""
+    for chat_id in chat_ids:
+        engine.invalidate_chat_caches(chat_id)
+        if not chat_engine_url:
+            continue
+        try:
+            requests.post(f"{chat_engine_url}/api/cache/invalidate/{chat_id}", timeout=5,
+                          headers={'X-Internal-Token': engine.INTERNAL_API_TOKEN})
+        except requests.RequestException as e:
+            print(f"⚠️ Falha ao invalidar cache do chat-engine ({chat_id}): {e}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Regenerar prompts master em lote (Message Batches API)')
+    parser.add_argument('--chat-type', help='regenerar todos os chats ativos deste tipo')
+    parser.add_argument('--chat-id', action='append', dest='chat_ids', help='chat específico (repetível)')
+    parser.add_argument('--batch-id', help='retomar um lote já enviado (pula coleta e envio)')
+    parser.add_argument('--poll-interval', type=float, default=BULK_POLL_INTERVAL)
+    parser.add_argument('--chat-engine-url', default=CHAT_ENGINE_URL, help='chat-engine para invalidar cache')
+    parser.add_argument('--dry-run', action='store_true', help='gerar sem gravar no BigQuery')
+    args = parser.parse_args(argv)
+
+    if not (args.chat_type or args.chat_ids or args.batch_id):
+        parser.error('informe --chat-type, --chat-id ou --batch-id')
+
+    started = time.time()
+    if args.batch_id:
+        batch_id = args.batch_id
+    else:
+        chats = find_chats(args.chat_type, args.chat_ids)
+        print(f"🔎 {len(chats)} chats encontrados")
+        batch_requests, skipped = build_batch_requests(chats)
+        for reason in sorted(set(skipped.values())):
+            chat_ids = [chat_id for chat_id, chat_reason in skipped.items() if chat_reason == reason]
+            print(f"⚠️ {len(chat_ids)} chats fora do lote - {reason} (mantêm o prompt atual): {', '.join(chat_ids)}")
+        agent_chats = [chat_id for chat_id, reason in skipped.items() if reason == 'agente especializado']
+        if agent_chats:
+            print("ℹ️ Chats com agente: regenerar via POST /api/chats/<chat_id>/regenerate-agent-prompt no backend")
+        if not batch_requests:
+            print("Nada para regenerar")
+            return 0
+        batch_id = submit_batch(batch_requests)['id']
+
+    batch = wait_for_batch(batch_id, args.poll_interval)
+    prompts, failed = collect_prompts(batch)
+    print(f"✅ {len(prompts)} prompts gerados, {len(failed)} falhas")
+    if failed:
+        print(f"❌ Falharam (mantêm o prompt atual): {', '.join(str(chat_id) for chat_id in failed)}")
+
+    if args.dry_run:
+        for chat_id, prompt in prompts.items():
+            print(f"--- {chat_id} ({len(prompt)} chars)\n{prompt[:300]}")
+        return 0
+
+    if prompts:
+        affected = bulk_update_prompts(prompts)
+        print(f"💾 {affected} chats atualizados em um único UPDATE")
+        invalidate_caches(list(prompts), args.chat_engine_url)
+
+    print(f"🏁 Concluído em {time.time() - started:.0f}s")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,3 +7,12 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key')
     BIGQUERY_DATASET = 'saas_chat_generator'
     STORAGE_BUCKET = f'{PROJECT_ID}-saas-chats'
+
+    # Planos do SaaS (mesmos do backend/config.py)
+    # max_concurrent_llm / llm_weight: teto e peso do cliente na fila do Claude (llm_scheduler.py)
+    PLANS = {
+        'free': {'name': 'Gratuito', 'max_concurrent_llm': 1, 'llm_weight': 1},
+        'basic': {'name': 'Básico', 'max_concurrent_llm': 2, 'llm_weight': 2},
+        'premium': {'name': 'Premium', 'max_concurrent_llm': 4, 'llm_weight': 4},
+        'enterprise': {'name': 'Enterprise', 'max_concurrent_llm': 8, 'llm_weight': 8}
+    }
@@ -0,0 +1,239 @@
+"""
+Memória de conversa - últimas mensagens na íntegra + resumo incremental das antigas
+O resumo é atualizado em background depois das respostas e salvo em
+conversation_summaries; o tamanho do prompt por turno fica estável
+independente do tamanho da conversa.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+SUMMARY_ENABLED = os.environ.get('SUMMARY_ENABLED', '1') == '1'
+# Mensagens mais recentes sempre enviadas na íntegra (mínimo 2: a última troca)
+SUMMARY_KEEP_MESSAGES = max(2, int(os.environ.get('SUMMARY_KEEP_MESSAGES', 6)))
+# Quantas mensagens não resumidas acumulam além das mantidas antes de resumir
+SUMMARY_BATCH_MESSAGES = max(1, int(os.environ.get('SUMMARY_BATCH_MESSAGES', 6)))
+SUMMARY_MAX_TOKENS = int(os.environ.get('SUMMARY_MAX_TOKENS', 400))
+SUMMARY_CACHE_ENTRIES = int(os.environ.get('SUMMARY_CACHE_ENTRIES', 2000))
+
+SUMMARY_INSTRUCTIONS = (
+    "Você mantém o resumo de uma conversa entre um usuário e um assistente. "
+    "Atualize o resumo atual incorporando as novas mensagens. Preserve fatos, "
+    "nomes, datas, horários, valores, decisões, pendências e preferências do usuário; "
+    "descarte cumprimentos e repetições. Escreva em português, em tópicos curtos, "
+    "sem comentar o processo. Responda apenas com o resumo atualizado."
+)
+
+ROLE_LABELS = {'user': 'Usuário', 'assistant': 'Assistente'}
+
+def to_api_messages(rows):
+    """Mensagens salvas no formato da Messages API (alternando user/assistant)"""
+    messages = []
+    for msg in rows:
+        role = msg.get('role')
+        content = msg.get('content')
+        if role not in ('user', 'assistant') or not content:
+            continue
+        if not messages and role != 'user':
+            continue  # a API exige que a conversa comece pelo usuário
+        if messages and messages[-1]['role'] == role:
+            messages[-1]['content'] += f"\n{content}"
+        else:
+            messages.append({"role": role, "content": content})
+
+    # A nova mensagem do usuário entra depois: o histórico deve terminar no assistente
+    if messages and messages[-1]['role'] == 'user':
+        messages.pop()
+    return messages
+
+class ConversationMemory:
+    """Carrega resumo + mensagens recentes e resume as antigas em background"""
+
+    def __init__(self, message_model, summary_model, claude_client, history_limit=20,
+                 scheduler=None, tenant_of=None):
+        self.message_model = message_model
+        self.summary_model = summary_model
+        self.claude_client = claude_client
+        # Escalonador do Claude: resumos entram como trabalho em background do dono do chat
+        self.scheduler = scheduler
+        self.tenant_of = tenant_of
+        self.history_limit = max(history_limit, SUMMARY_KEEP_MESSAGES + SUMMARY_BATCH_MESSAGES + 2)
+
+        # Último resumo conhecido por conversa; um resumo antigo continua correto
+        # (só traz mais mensagens na íntegra), então não precisa de TTL
+        self._summaries = OrderedDict()
+        self._in_progress = set()
+        self._lock = threading.Lock()
+
+        self.updates = 0
+        self.failures = 0
+        self.messages_summarized = 0
+
+    def _cached_summary(self, key):
+        with self._lock:
+            if key in self._summaries:
+                self._summaries.move_to_end(key)
+                return True, self._summaries[key]
+        return False, None
+
+    def _remember_summary(self, key, summary):
+        with self._lock:
+            self._summaries[key] = summary
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > SUMMARY_CACHE_ENTRIES:
+                self._summaries.popitem(last=False)
+
+    def load(self, chat_id, conversation_id):
+        """Resumo atual e mensagens ainda não resumidas (ordem cronológica)
+
+        Retorna {'summary': texto ou None, 'summarized_until', 'messages_summarized', 'recent': [linhas]}.
+        """
+        key = (chat_id, conversation_id)
+        summary = None
+        if SUMMARY_ENABLED:
+            found, summary = self._cached_summary(key)
+            if not found:
+                try:
+                    summary = self.summary_model.get_latest_summary(chat_id, conversation_id)
+                except Exception as e:
+                    print(f"Summary load error: {e}")
+                    summary = None
+                else:
+                    self._remember_summary(key, summary)
+
+        after = summary['summarized_until'] if summary else None
+        recent = self.message_model.get_conversation_history(
+            chat_id, conversation_id, limit=self.history_limit, after=after
+        )
+
+        return {
+            'summary': summary['summary'] if summary else None,
+            'summarized_until': after,
+            'messages_summarized': summary['messages_summarized'] if summary else 0,
+            'recent': recent
+        }
+
+    def after_turn(self, chat_id, conversation_id, memory):
+        """Chamado depois de salvar a troca; resume as mensagens antigas se acumularam
+
+        `memory` é o retorno de load() antes da troca (a troca nova conta como 2 mensagens).
+        Roda na thread de background que salva as mensagens.
+        """
+        if not SUMMARY_ENABLED or memory is None:
+            return
+
+        recent = [row for row in memory['recent'] if row.get('timestamp')]
+        unsummarized = len(recent) + 2
+        if unsummarized <= SUMMARY_KEEP_MESSAGES + SUMMARY_BATCH_MESSAGES:
+            return
+
+        cut = unsummarized - SUMMARY_KEEP_MESSAGES
+        # Não separar pergunta e resposta: o trecho mantido deve começar pelo usuário
+        while cut < len(recent) and recent[cut].get('role') != 'user':
+            cut += 1
+        to_fold = recent[:cut]
+        key = (chat_id, conversation_id)
+        with self._lock:
+            if key in self._in_progress:
+                return
+            self._in_progress.add(key)
+
+        try:
+            if len(memory['recent']) >= self.history_limit:
+                # O LIMIT de load() cortou: há mensagens não resumidas antes de `recent`
+                # (resumos que falharam seguidamente) e o resumo não pode pular por cima delas
+                self._fold_backlog(chat_id, conversation_id, memory, to_fold[-1]['timestamp'])
+            else:
+                self._update_summary(chat_id, conversation_id, memory, to_fold)
+        finally:
+            with self._lock:
+                self._in_progress.discard(key)
+
+    def _fold_backlog(self, chat_id, conversation_id, memory, until):
+        """Resumir todas as mensagens entre o resumo atual e `until`, das mais antigas para
+        as mais novas, em lotes de history_limit (cada lote salvo antes do próximo)"""
+        while memory is not None:
+            rows = self.message_model.get_messages_between(
+                chat_id, conversation_id, memory['summarized_until'], until, limit=self.history_limit
+            )
+            rows = [row for row in rows if row.get('timestamp')]
+            if not rows:
+                return
+            memory = self._update_summary(chat_id, conversation_id, memory, rows)
+            if len(rows) < self.history_limit:
+                return
+
+    def _update_summary(self, chat_id, conversation_id, memory, rows):
+        """Resumo anterior + rows; retorna o novo estado (como load()) ou None se falhar"""
+        started = time.perf_counter()
+        try:
+            if self.scheduler:
+                tenant, plan = self.tenant_of(chat_id) if self.tenant_of else (chat_id, None)
+                with self.scheduler.slot(tenant, plan, 'background'):
+                    summary = self.summarize(memory['summary'], rows)
+            else:
+                summary = self.summarize(memory['summary'], rows)
+            if not summary:
+                self.failures += 1
+                return None
+
+            state = {
+                'summary': summary,
+                'summarized_until': rows[-1]['timestamp'],
+                'messages_summarized': (memory['messages_summarized'] or 0) + len(rows)
+            }
+            self.summary_model.save_summary(chat_id, conversation_id, summary,
+                                            state['summarized_until'], state['messages_summarized'])
+            self._remember_summary((chat_id, conversation_id), state)
+
+            self.updates += 1
+            self.messages_summarized += len(rows)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            print(f"📝 Resumo da conversa {conversation_id} atualizado "
+                  f"(+{len(rows)} mensagens, {elapsed_ms:.0f}ms)")
+            return state
+        except Exception as e:
+            self.failures += 1
+            print(f"Erro ao atualizar resumo: {e}")
+            return None
+
+    def summarize(self, previous_summary, rows):
+        """Novo resumo = resumo anterior + mensagens (chamada ao Claude); None se falhar"""
+        transcript = "\n".join(
+            f"{ROLE_LABELS.get(row.get('role'), row.get('role'))}: {row.get('content', '')}"
+            for row in rows if row.get('content')
+        )
+
+        payload = {
+            "max_tokens": SUMMARY_MAX_TOKENS,
+            "system": SUMMARY_INSTRUCTIONS,
+            "messages": [{
+                "role": "user",
+                "content": (
+                    f"RESUMO ATUAL:\n{previous_summary or '(vazio)'}\n\n"
+                    f"NOVAS MENSAGENS:\n{transcript}\n\n"
+                    "Escreva o resumo atualizado."
+                )
+            }]
+        }
+
+        response = self.claude_client.create_message(payload, timeout=30)
+        if response.status_code != 200:
+            print(f"❌ Claude API error no resumo: {response.status_code}")
+            return None
+        return response.json()['content'][0]['text'].strip()
+
+    def stats(self):
+        with self._lock:
+            cached = len(self._summaries)
+        return {
+            'enabled': SUMMARY_ENABLED,
+            'keep_messages': SUMMARY_KEEP_MESSAGES,
+            'batch_messages': SUMMARY_BATCH_MESSAGES,
+            'updates': self.updates,
+            'failures': self.failures,
+            'messages_summarized': self.messages_summarized,
+            'cached_summaries': cached
+        }
@@ -0,0 +1,191 @@
+"""
+Respostas rápidas determinísticas a partir da configuração do agente
+Perguntas factuais de alta confiança (valores, endereço, pagamento, convênios,
+horários, agendamento, contato) são respondidas direto dos campos estruturados
+de agent_configurations, sem chamar o Claude. Na dúvida, segue para o LLM: mensagem
+com trecho parecido com sintoma/pedido complexo nunca recebe resposta pronta.
+"""
+
+import os
+from collections import defaultdict
+from intent_router import features, cosine, complex_match, ROUTER_COMPLEX_MATCH
+from response_cache import normalize_question
+
+FAST_PATH_ENABLED = os.environ.get('FAST_PATH_ENABLED', '1') == '1'
+FAST_PATH_MIN_CONFIDENCE = float(os.environ.get('FAST_PATH_MIN_CONFIDENCE', 0.6))
+# Diferença mínima para a segunda intenção mais provável (pergunta ambígua vai para o LLM)
+FAST_PATH_MIN_MARGIN = float(os.environ.get('FAST_PATH_MIN_MARGIN', 0.1))
+FAST_PATH_MAX_WORDS = int(os.environ.get('FAST_PATH_MAX_WORDS', 12))
+
+# intenção -> (campo da configuração, exemplos)
+FACT_INTENTS = {
+    'price': ('services', [
+        "quanto custa", "qual o valor", "qual o preço", "quais os valores", "valor da consulta",
+        "preço da consulta", "quanto é a consulta", "quanto fica o exame", "tabela de preços",
+    ]),
+    'address': ('address', [
+        "onde fica", "qual o endereço", "onde vocês ficam", "endereço da clínica",
+        "qual a localização", "onde é o consultório", "como chego aí",
+    ]),
+    'payment': ('payment_methods', [
+        "formas de pagamento", "quais as formas de pagamento", "aceita cartão", "aceita pix",
+        "posso parcelar", "como posso pagar", "aceitam cartão de crédito", "parcela no cartão",
+    ]),
+    'health_plans': ('health_plans', [
+        "aceita convênio", "quais convênios", "quais convênios vocês aceitam", "atende por convênio",
+        "aceita plano de saúde", "trabalha com convênio",
+    ]),
+    'working_hours': ('working_hours', [
+        "qual o horário", "horário de atendimento", "que horas abre", "até que horas funciona",
+        "qual o horário de funcionamento", "abre no sábado", "funciona sábado",
+    ]),
+    'scheduling': ('scheduling_url', [
+        "como agendar", "link para agendar", "como faço para agendar", "como marco uma consulta",
+        "agendamento online", "onde agendo", "tem link de agendamento",
+    ]),
+    'contact': ('emergency_contact', [
+        "qual o telefone", "telefone para contato", "qual o whatsapp", "número de contato",
+        "telefone da clínica",
+    ]),
+}
+
+DEFAULT_TEMPLATES = {
+    'price': "Valores:\n{value}",
+    'price_single': "{service}: {value}.",
+    'address': "📍 Endereço: {value}",
+    'payment': "Formas de pagamento: {value}.",
+    'health_plans': "Convênios aceitos: {value}.",
+    'health_plans_match': "Sim, atendemos {plan}. Convênios aceitos: {value}.",
+    'working_hours': "Horário de atendimento: {value}.",
+    'scheduling': "Você pode agendar pelo link: {value}",
+    'contact': "Contato: {value}",
+}
+
+PAYMENT_LABELS = {
+    'pix': 'PIX',
+    'cartao_credito': 'cartão de crédito',
+    'cartao_debito': 'cartão de débito',
+    'dinheiro': 'dinheiro',
+    'transferencia': 'transferência',
+    'parcelamento': 'parcelamento',
+}
+
+def _join(items):
+    items = [item for item in items if item]
+    if len(items) <= 1:
+        return ''.join(items)
+    return ', '.join(items[:-1]) + ' e ' + items[-1]
+
+def _split_list(value):
+    if isinstance(value, list):
+        return [str(item).strip() for item in value if str(item).strip()]
+    return [item.strip() for item in str(value or '').replace(';', ',').split(',') if item.strip()]
+
+class FastAnswerEngine:
+    """Respostas pré-montadas por chat; match() custa microssegundos"""
+
+    def __init__(self, configuration=None):
+        configuration = configuration or {}
+        self.configuration = configuration
+        self.templates = dict(DEFAULT_TEMPLATES)
+        # Templates por chat: configuration['answer_templates'] = {'address': '...{value}...'}
+        self.templates.update(configuration.get('answer_templates') or {})
+
+        self.answers = {}
+        self.services = []
+        self.plans = []
+        examples = []
+
+        for intent, (field, seeds) in FACT_INTENTS.items():
+            value = configuration.get(field)
+            if not value:
+                continue
+            answer = self._build_answer(intent, value)
+            if not answer:
+                continue
+            self.answers[intent] = answer
+            examples.extend((intent, features(seed)) for seed in seeds)
+
+        # Exemplos específicos do chat (nomes de serviços e convênios)
+        for service in self.services:
+            examples.append(('price', features(f"valor {service['nome']}")))
+        for plan in self.plans:
+            for pattern in ("aceita {}", "atende {}", "vocês aceitam {}"):
+                examples.append(('health_plans', features(pattern.format(plan))))
+
+        self.examples = examples
+
+    def _render(self, key, **values):
+        fields = defaultdict(str, {k: v for k, v in self.configuration.items() if isinstance(v, str)})
+        fields.update(values)
+        try:
+            return self.templates.get(key, DEFAULT_TEMPLATES.get(key, '{value}')).format_map(fields)
+        except (ValueError, IndexError, AttributeError) as e:
+            print(f"Template de resposta rápida inválido ({key}): {e}")
+            return DEFAULT_TEMPLATES.get(key, '{value}').format_map(fields)
+
+    def _build_answer(self, intent, value):
+        if intent == 'price':
+            self.services = [
+                service for service in value
+                if isinstance(service, dict) and service.get('nome') and service.get('valor')
+            ]
+            lines = [f"• {service['nome']}: {service['valor']}" for service in self.services]
+            return self._render('price', value='\n'.join(lines)) if lines else None
+        if intent == 'payment':
+            methods = [PAYMENT_LABELS.get(method, method.replace('_', ' ')) for method in _split_list(value)]
+            return self._render('payment', value=_join(methods))
+        if intent == 'health_plans':
+            self.plans = _split_list(value)
+            return self._render('health_plans', value=', '.join(self.plans))
+        return self._render(intent, value=str(value).strip())
+
+    def _best_service(self, words):
+        """Serviço citado na pergunta (maior sobreposição de palavras), ou None"""
+        best, best_overlap = None, 0
+        for service in self.services:
+            service_words = set(normalize_question(service['nome']).split())
+            overlap = len(words & service_words)
+            # Exige que o nome seja citado por completo (ex.: "consulta online")
+            if overlap == len(service_words) and overlap > best_overlap:
+                best, best_overlap = service, overlap
+        return best
+
+    def match(self, message):
+        """Resposta determinística {'intent', 'reply', 'confidence'} ou None"""
+        if not FAST_PATH_ENABLED or not self.examples:
+            return None
+        if len(message.split()) > FAST_PATH_MAX_WORDS:
+            return None
+        # "estou com dor no peito, qual o telefone?": o sintoma pesa mais que a pergunta
+        if complex_match(message) >= ROUTER_COMPLEX_MATCH:
+            return None
+
+        vector = features(message)
+        scores = {}
+        for intent, example in self.examples:
+            score = cosine(vector, example)
+            if score > scores.get(intent, 0.0):
+                scores[intent] = score
+        if not scores:
+            return None
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        intent, confidence = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        if confidence < FAST_PATH_MIN_CONFIDENCE or confidence - runner_up < FAST_PATH_MIN_MARGIN:
+            return None
+
+        reply = self.answers[intent]
+        words = set(normalize_question(message).split())
+        if intent == 'price':
+            service = self._best_service(words)
+            if service:
+                reply = self._render('price_single', service=service['nome'], value=service['valor'])
+        elif intent == 'health_plans':
+            for plan in self.plans:
+                if set(normalize_question(plan).split()[:1]) & words:
+                    reply = self._render('health_plans_match', plan=plan, value=', '.join(self.plans))
+                    break
+
+        return {'intent': intent, 'reply': reply, 'confidence': round(confidence, 3)}
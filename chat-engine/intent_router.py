@@ -0,0 +1,219 @@
+"""
+Roteamento de mensagens por intenção - classificador local (sem chamar o Claude)
+Saudações e perguntas simples vão para o modelo rápido com max_tokens pequeno;
+pedidos complexos vão para o modelo configurado no chat.
+O classificador é treinado por chat com os conversation_types e tracking_keywords
+do agente (agent_configurations) mais exemplos fixos em português.
+"""
+
+import os
+import re
+import math
+import threading
+from collections import Counter, deque
+from response_cache import normalize_question
+
+ROUTER_ENABLED = os.environ.get('ROUTER_ENABLED', '1') == '1'
+CLAUDE_FAST_MODEL = os.environ.get('CLAUDE_FAST_MODEL', 'claude-3-haiku-20240307')
+# Abaixo desta similaridade a mensagem vai para o modelo do chat (na dúvida, o melhor modelo)
+ROUTER_MIN_CONFIDENCE = float(os.environ.get('ROUTER_MIN_CONFIDENCE', 0.3))
+# Mensagens longas nunca são tratadas como simples
+ROUTER_MAX_SIMPLE_WORDS = int(os.environ.get('ROUTER_MAX_SIMPLE_WORDS', 25))
+# Trecho da mensagem com esta similaridade a um exemplo complexo/sintoma força o modelo do chat
+ROUTER_COMPLEX_MATCH = float(os.environ.get('ROUTER_COMPLEX_MATCH', 0.6))
+ROUTE_MAX_TOKENS = {
+    'greeting': int(os.environ.get('ROUTER_GREETING_MAX_TOKENS', 150)),
+    'simple': int(os.environ.get('ROUTER_SIMPLE_MAX_TOKENS', 400)),
+}
+
+GREETING_SEEDS = [
+    "oi", "olá", "ola tudo bem", "bom dia", "boa tarde", "boa noite", "e aí", "opa",
+    "tudo bem?", "oi, tudo bem?", "obrigado", "obrigada", "muito obrigado", "valeu",
+    "tchau", "até mais", "até logo", "ok", "ok obrigado", "beleza", "perfeito", "certo",
+]
+
+SIMPLE_SEEDS = [
+    "qual o valor", "quanto custa", "qual o preço", "quais os valores", "onde fica",
+    "qual o endereço", "qual o horário de atendimento", "que horas abre", "até que horas",
+    "aceita convênio", "quais convênios aceitam", "aceita cartão", "aceita pix",
+    "formas de pagamento", "qual o telefone", "tem site", "qual o link para agendar",
+    "vocês atendem online", "atende sábado", "tem estacionamento",
+]
+
+COMPLEX_SEEDS = [
+    "estou com dor", "sintoma", "estou passando mal", "é urgente", "emergência",
+    "preciso remarcar minha consulta", "quero reagendar", "quero agendar uma consulta",
+    "quero cancelar", "resultado do meu exame",
+    "me explique", "analise", "compare", "por que isso aconteceu", "não entendi",
+    "tenho uma reclamação", "preciso de ajuda com um problema", "me ajude a planejar",
+    "qual estratégia você recomenda", "o que devo fazer",
+]
+
+# Sintomas e urgências: nunca respondidos pelo modelo rápido nem por resposta pronta
+SYMPTOM_SEEDS = [
+    "dor no peito", "falta de ar", "febre", "sangramento", "desmaio", "desmaiei", "tontura",
+    "palpitação", "pressão alta", "infarto", "convulsão", "vomitando", "alergia", "machuquei",
+    "acidente", "samu", "pronto socorro", "urgência",
+]
+
+# Tipos de conversa que são basicamente consulta de informação
+INFORMATIONAL_TYPE = re.compile(r'informac|duvida|orientac|convenio|preco|valor|horario|metrica')
+
+def features(text):
+    """Vetor esparso normalizado: palavras + trigramas de caracteres"""
+    vector = Counter()
+    for word in normalize_question(text).split():
+        vector['w:' + word] += 1.0
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            vector['c:' + padded[i:i + 3]] += 0.5
+
+    norm = math.sqrt(sum(value * value for value in vector.values()))
+    if norm:
+        for key in vector:
+            vector[key] /= norm
+    return vector
+
+def cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(key, 0.0) for key, value in a.items())
+
+def _group_by_words(texts):
+    """{número de palavras: [vetores]} (janelas de mesmo tamanho em complex_match)"""
+    groups = {}
+    for text in texts:
+        size = len(normalize_question(text).split())
+        if size:
+            groups.setdefault(size, []).append(features(text))
+    return groups
+
+URGENT_EXAMPLES = _group_by_words(COMPLEX_SEEDS + SYMPTOM_SEEDS)
+
+def complex_match(text):
+    """Maior similaridade entre um trecho da mensagem e um exemplo complexo ou de sintoma
+
+    Cada exemplo é comparado com as janelas de palavras do seu tamanho: em "estou com dor
+    no peito, qual o telefone?" o sintoma pesa inteiro, sem ser diluído pela pergunta.
+    """
+    words = normalize_question(text).split()
+    best = 0.0
+    for size, examples in URGENT_EXAMPLES.items():
+        for start in range(max(1, len(words) - size + 1)):
+            window = features(' '.join(words[start:start + size]))
+            for example in examples:
+                best = max(best, cosine(window, example))
+    return best
+
+def build_examples(conversation_types=None, tracking_keywords=None):
+    """Exemplos por rótulo (greeting/simple/complex) a partir do template do agente"""
+    examples = {
+        'greeting': list(GREETING_SEEDS),
+        'simple': list(SIMPLE_SEEDS),
+        'complex': list(COMPLEX_SEEDS) + list(SYMPTOM_SEEDS),
+    }
+
+    for conversation_type in conversation_types or []:
+        label = 'simple' if INFORMATIONAL_TYPE.search(normalize_question(conversation_type)) else 'complex'
+        examples[label].append(conversation_type)
+
+    # Palavra-chave parecida com algo complexo (ex.: "dor", "urgente") fica em complex
+    complex_vectors = [features(text) for text in examples['complex']]
+    for keyword in tracking_keywords or []:
+        vector = features(keyword)
+        similarity = max((cosine(vector, other) for other in complex_vectors), default=0.0)
+        examples['complex' if similarity >= 0.45 else 'simple'].append(keyword)
+
+    return examples
+
+class IntentClassifier:
+    """Vizinho mais próximo por rótulo (similaridade do cosseno)"""
+
+    def __init__(self, examples):
+        self.examples = [
+            (label, features(text))
+            for label, texts in examples.items()
+            for text in texts
+        ]
+
+    @classmethod
+    def for_agent(cls, conversation_types=None, tracking_keywords=None):
+        return cls(build_examples(conversation_types, tracking_keywords))
+
+    def classify(self, text):
+        """(rótulo, similaridade) do exemplo mais parecido"""
+        vector = features(text)
+        best_label, best_score = 'complex', 0.0
+        for label, example in self.examples:
+            score = cosine(vector, example)
+            if score > best_score:
+                best_label, best_score = label, score
+        return best_label, best_score
+
+def choose_route(classifier, message, chat_model=None, chat_max_tokens=None, default_model=None):
+    """Decidir rota, modelo e max_tokens de uma mensagem
+
+    Retorna {'route', 'label', 'confidence', 'complex_match', 'model', 'max_tokens'}.
+    Um trecho parecido com exemplo complexo ou sintoma (complex_match) decide sozinho:
+    a parte urgente da mensagem vence a pergunta simples que vem junto.
+    """
+    chat_model = chat_model or default_model or CLAUDE_FAST_MODEL
+    chat_max_tokens = chat_max_tokens or 500
+
+    label, confidence = classifier.classify(message) if ROUTER_ENABLED else ('complex', 0.0)
+    route = label
+    urgent = complex_match(message) if route != 'complex' else 0.0
+    if route != 'complex' and (
+        confidence < ROUTER_MIN_CONFIDENCE or len(message.split()) > ROUTER_MAX_SIMPLE_WORDS
+        or urgent >= ROUTER_COMPLEX_MATCH
+    ):
+        route = 'complex'
+
+    if route == 'complex':
+        model, max_tokens = chat_model, chat_max_tokens
+    else:
+        model, max_tokens = CLAUDE_FAST_MODEL, min(ROUTE_MAX_TOKENS[route], chat_max_tokens)
+
+    return {
+        'route': route,
+        'label': label,
+        'confidence': round(confidence, 3),
+        'complex_match': round(urgent, 3),
+        'model': model,
+        'max_tokens': max_tokens
+    }
+
+class RoutingStats:
+    """Contagem e latência por rota (para calibrar o roteamento)"""
+
+    def __init__(self, window=500):
+        self._window = window
+        self._counts = Counter()
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, latency_ms):
+        with self._lock:
+            self._counts[route] += 1
+            self._latencies.setdefault(route, deque(maxlen=self._window)).append(latency_ms)
+
+    def stats(self):
+        with self._lock:
+            routes = {}
+            for route, samples in self._latencies.items():
+                ordered = sorted(samples)
+                routes[route] = {
+                    'count': self._counts[route],
+                    'avg_ms': round(sum(ordered) / len(ordered), 1),
+                    'p50_ms': ordered[len(ordered) // 2],
+                    'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+                }
+        return {
+            'enabled': ROUTER_ENABLED,
+            'fast_model': CLAUDE_FAST_MODEL,
+            'min_confidence': ROUTER_MIN_CONFIDENCE,
+            'routes': routes
+        }
+
+# Instância global
+routing_stats = RoutingStats()
@@ -0,0 +1,137 @@
+"""
+Cache de conhecimento por chat no chat-engine - índices de busca + versão dos documentos
+Em regime a mensagem não consulta o BigQuery para documentos: o backend avisa quando os
+documentos mudam (POST /api/cache/invalidate/<chat_id>) e a versão é reconferida em
+segundo plano a cada KNOWLEDGE_REVALIDATE_SECONDS (cobre instâncias que não receberam
+o aviso), servindo o índice atual enquanto isso.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from single_flight import SingleFlight
+
+KNOWLEDGE_INDEX_CACHE_ENTRIES = int(os.environ.get('KNOWLEDGE_INDEX_CACHE_ENTRIES', 200))
+KNOWLEDGE_REVALIDATE_SECONDS = float(os.environ.get('KNOWLEDGE_REVALIDATE_SECONDS', 900))
+
+class _Entry:
+    def __init__(self, version, indexes):
+        self.version = version
+        self.indexes = indexes
+        self.checked_at = time.monotonic()
+
+class KnowledgeCache:
+    """LRU chat_id -> (versão dos documentos, índices)
+
+    loader(chat_id) monta os índices; versioner(chat_id) consulta a versão (None = erro).
+    """
+
+    def __init__(self, loader, versioner, max_entries=None, revalidate_seconds=None):
+        self.loader = loader
+        self.versioner = versioner
+        self.max_entries = max_entries or KNOWLEDGE_INDEX_CACHE_ENTRIES
+        self.revalidate_seconds = KNOWLEDGE_REVALIDATE_SECONDS if revalidate_seconds is None else revalidate_seconds
+
+        self._entries = OrderedDict()
+        self._generations = {}      # chat_id -> contador de invalidações
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.revalidations = 0
+        self.invalidations = 0
+
+    def get(self, chat_id):
+        """(versão, índices) do chat; carrega na primeira vez"""
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is not None:
+                self._entries.move_to_end(chat_id)
+                self.hits += 1
+                stale = time.monotonic() - entry.checked_at > self.revalidate_seconds
+            else:
+                self.misses += 1
+        if entry is None:
+            entry, _ = self._flights.do(chat_id, lambda: self._load(chat_id))
+        elif stale:
+            self._refresh_in_background(chat_id)
+        return entry.version, entry.indexes
+
+    def version(self, chat_id):
+        return self.get(chat_id)[0]
+
+    def _load(self, chat_id):
+        with self._lock:
+            generation = self._generations.get(chat_id, 0)
+        version = self.versioner(chat_id)
+        entry = _Entry(version, self.loader(chat_id))
+        self.loads += 1
+        if version is not None:
+            self._store(chat_id, entry, generation)
+        return entry
+
+    def _store(self, chat_id, entry, generation):
+        with self._lock:
+            # Invalidado durante a carga: não guardar dados possivelmente antigos
+            if self._generations.get(chat_id, 0) != generation:
+                return
+            self._entries[chat_id] = entry
+            self._entries.move_to_end(chat_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _refresh_in_background(self, chat_id, force=False):
+        with self._lock:
+            if chat_id in self._refreshing:
+                return
+            self._refreshing.add(chat_id)
+        threading.Thread(target=self._refresh, args=(chat_id, force), daemon=True).start()
+
+    def _refresh(self, chat_id, force):
+        """Reconferir a versão; remontar os índices só se mudou"""
+        try:
+            with self._lock:
+                generation = self._generations.get(chat_id, 0)
+                entry = self._entries.get(chat_id)
+            version = self.versioner(chat_id)
+            if version is None:
+                return
+            self.revalidations += 1
+            if not force and entry is not None and entry.version == version:
+                entry.checked_at = time.monotonic()
+                return
+            self.loads += 1
+            self._store(chat_id, _Entry(version, self.loader(chat_id)), generation)
+            print(f"📚 Conhecimento do chat {chat_id} recarregado (versão {version})")
+        except Exception as e:
+            print(f"Knowledge cache refresh error: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(chat_id)
+
+    def invalidate(self, chat_id, reload=True):
+        """Descartar o chat (documentos mudaram); reload=True já remonta em segundo plano"""
+        with self._lock:
+            self._generations[chat_id] = self._generations.get(chat_id, 0) + 1
+            removed = self._entries.pop(chat_id, None) is not None
+            self.invalidations += 1
+        if removed and reload:
+            self._refresh_in_background(chat_id, force=True)
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cached_chats': len(self._entries),
+                'max_entries': self.max_entries,
+                'revalidate_seconds': self.revalidate_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'loads': self.loads,
+                'revalidations': self.revalidations,
+                'invalidations': self.invalidations
+            }
@@ -0,0 +1,475 @@
+"""
+Resiliência das chamadas ao Claude - retry com backoff, circuit breaker e hedging
+Envolve ClaudeClient/AsyncClaudeClient mantendo a mesma interface.
+Mesmo arquivo em backend/ e chat-engine/.
+
+Para testar localmente: python utils/fake_anthropic_server.py --error-rate 0.3
+e ANTHROPIC_BASE_URL=http://127.0.0.1:8999
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed
+import requests
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+CLAUDE_MAX_ATTEMPTS = int(os.environ.get('CLAUDE_MAX_ATTEMPTS', 3))
+CLAUDE_RETRY_BASE_DELAY = float(os.environ.get('CLAUDE_RETRY_BASE_DELAY', 0.5))
+CLAUDE_RETRY_MAX_DELAY = float(os.environ.get('CLAUDE_RETRY_MAX_DELAY', 8))
+CLAUDE_RETRY_BUDGET = float(os.environ.get('CLAUDE_RETRY_BUDGET', 20))
+CLAUDE_BREAKER_THRESHOLD = int(os.environ.get('CLAUDE_BREAKER_THRESHOLD', 5))
+CLAUDE_BREAKER_RECOVERY = float(os.environ.get('CLAUDE_BREAKER_RECOVERY', 30))
+CLAUDE_HEDGING = os.environ.get('CLAUDE_HEDGING', '0') == '1'
+CLAUDE_HEDGE_PERCENTILE = float(os.environ.get('CLAUDE_HEDGE_PERCENTILE', 95))
+CLAUDE_HEDGE_MIN_DELAY = float(os.environ.get('CLAUDE_HEDGE_MIN_DELAY', 0.5))
+CLAUDE_HEDGE_MIN_SAMPLES = int(os.environ.get('CLAUDE_HEDGE_MIN_SAMPLES', 20))
+
+# 429 = rate limit, 529 = overloaded, 5xx = erro transitório
+RETRYABLE_STATUS = {429, 500, 502, 503, 504, 529}
+# Rate limit não indica upstream degradado: não abre o circuito
+BREAKER_FAILURE_STATUS = {500, 502, 503, 504, 529}
+
+NETWORK_ERRORS = (requests.RequestException,)
+if httpx is not None:
+    NETWORK_ERRORS += (httpx.TransportError,)
+
+class CircuitOpenError(Exception):
+    """Circuito aberto: o Claude está degradado e a chamada falha imediatamente"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Claude indisponível (circuit breaker aberto), tente em {retry_after}s")
+        self.retry_after = retry_after
+
+class RetryPolicy:
+    """Backoff exponencial com full jitter, respeitando o header retry-after"""
+
+    def __init__(self, max_attempts=None, base_delay=None, max_delay=None, budget_seconds=None):
+        self.max_attempts = max_attempts or CLAUDE_MAX_ATTEMPTS
+        self.base_delay = base_delay if base_delay is not None else CLAUDE_RETRY_BASE_DELAY
+        self.max_delay = max_delay if max_delay is not None else CLAUDE_RETRY_MAX_DELAY
+        self.budget_seconds = budget_seconds if budget_seconds is not None else CLAUDE_RETRY_BUDGET
+
+    def delay(self, attempt, retry_after=None):
+        """Espera antes da tentativa attempt+1 (attempt começa em 1)"""
+        if retry_after:
+            try:
+                # Respeita o servidor; se passar do orçamento, _retry_wait desiste
+                return float(retry_after)
+            except ValueError:
+                pass  # retry-after em formato de data: usa o backoff normal
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+class CircuitBreaker:
+    """closed -> open após N falhas seguidas -> half_open após o tempo de recuperação"""
+
+    def __init__(self, failure_threshold=None, recovery_seconds=None):
+        self.failure_threshold = failure_threshold or CLAUDE_BREAKER_THRESHOLD
+        self.recovery_seconds = recovery_seconds or CLAUDE_BREAKER_RECOVERY
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True: pode chamar; 'probe': pode, e é a chamada de teste do half_open (ver release_probe)"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.recovery_seconds:
+                self.state = 'half_open'
+                self._probe_in_flight = False
+            if self.state == 'half_open' and not self._probe_in_flight:
+                # Uma única chamada de teste por vez
+                self._probe_in_flight = True
+                return 'probe'
+            return False
+
+    def release_probe(self):
+        """Fim da chamada de teste sem record_success/record_failure (exceção inesperada,
+        cancelamento): libera outra chamada de teste em vez de travar o half_open"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def retry_after(self):
+        with self._lock:
+            remaining = self.recovery_seconds - (time.monotonic() - self.opened_at)
+            return max(1, int(remaining + 0.999))
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.trips += 1
+                    logging.warning(f"Circuit breaker do Claude ABERTO após {self.failures} falhas")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            return {'state': self.state, 'consecutive_failures': self.failures, 'trips': self.trips}
+
+class LatencyTracker:
+    """Janela das últimas latências (ms) para calcular o atraso do hedging"""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, latency_ms):
+        if latency_ms is not None:
+            with self._lock:
+                self._samples.append(latency_ms)
+
+    def percentile(self, pct):
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def count(self):
+        with self._lock:
+            return len(self._samples)
+
+def _close_future_response(future):
+    """Fechar a resposta de uma requisição de hedging que não foi usada"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    try:
+        future.result().close()
+    except Exception:
+        pass
+
+def _aclose_task_response(task):
+    """Versão asyncio de _close_future_response (tarefa que terminou antes do cancelamento)"""
+    if task.cancelled() or task.exception() is not None:
+        return
+    asyncio.ensure_future(task.result().aclose())
+
+class _ResilienceBase:
+    def __init__(self, client, retry=None, breaker=None, latency=None, hedging=None, scheduler=None):
+        self.client = client
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = latency or LatencyTracker()
+        self.hedging = CLAUDE_HEDGING if hedging is None else hedging
+        # FairScheduler (llm_scheduler.py): a requisição duplicada ocupa um slot do tenant
+        self.scheduler = scheduler
+        self.calls = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.hedges_skipped = 0
+
+    def hedge_delay(self):
+        """Atraso (s) antes da requisição duplicada, ou None se não há amostras suficientes"""
+        if not self.hedging or self.latency.count() < CLAUDE_HEDGE_MIN_SAMPLES:
+            return None
+        p = self.latency.percentile(CLAUDE_HEDGE_PERCENTILE)
+        return max(CLAUDE_HEDGE_MIN_DELAY, p / 1000)
+
+    def _check_breaker(self):
+        """True se esta tentativa é a chamada de teste do circuito (liberar no finally)"""
+        allowed = self.breaker.allow()
+        if not allowed:
+            raise CircuitOpenError(self.breaker.retry_after())
+        return allowed == 'probe'
+
+    def _hedge_slot(self):
+        """(pode duplicar, ticket do slot extra ou None)
+
+        Com escalonador, a duplicada só sai se o tenant tem slot livre agora; senão
+        espera só a primeira requisição.
+        """
+        if self.scheduler is None:
+            return True, None
+        ticket = self.scheduler.try_acquire_extra()
+        if ticket is None:
+            self.hedges_skipped += 1
+            return False, None
+        return True, ticket
+
+    def _record_status(self, status_code):
+        if status_code in BREAKER_FAILURE_STATUS:
+            self.breaker.record_failure()
+        else:
+            # Inclui 429: o upstream está respondendo, só limitando a taxa
+            self.breaker.record_success()
+
+    def _retry_wait(self, attempt, started, retry_after=None):
+        """Espera da próxima tentativa, ou None se acabaram tentativas/orçamento"""
+        if attempt >= self.retry.max_attempts:
+            return None
+        delay = self.retry.delay(attempt, retry_after)
+        if time.monotonic() - started + delay > self.retry.budget_seconds:
+            return None
+        self.retries += 1
+        return delay
+
+    def stats(self):
+        p95 = self.latency.percentile(95)
+        return {
+            'calls': self.calls,
+            'retries': self.retries,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'hedges_skipped': self.hedges_skipped,
+            'hedging_enabled': self.hedging,
+            'latency_p95_ms': round(p95, 1) if p95 is not None else None,
+            'circuit_breaker': self.breaker.stats()
+        }
+
+class ResilientClaudeClient(_ResilienceBase):
+    """ClaudeClient com retry, circuit breaker e hedging opcional (threads)"""
+
+    def __init__(self, client, retry=None, breaker=None, latency=None, hedging=None, scheduler=None,
+                 hedge_workers=8):
+        super().__init__(client, retry, breaker, latency, hedging, scheduler)
+        self._hedge_executor = ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix='claude-hedge')
+
+    def __getattr__(self, name):
+        # headers, resolve_model, post... continuam vindo do cliente original
+        if name == 'client':
+            raise AttributeError(name)
+        return getattr(self.client, name)
+
+    def iter_events(self, response):
+        return self.client.iter_events(response)
+
+    def create_message(self, payload, timeout=30, stream=False):
+        """Mesma assinatura de ClaudeClient.create_message; `response.attempts` indica tentativas"""
+        self.calls += 1
+        started = time.monotonic()
+        attempt = 0
+
+        while True:
+            attempt += 1
+            probe = self._check_breaker()
+
+            try:
+                try:
+                    if stream:
+                        response = self.client.create_message(payload, timeout=timeout, stream=True)
+                    else:
+                        response = self._send_hedged(payload, timeout)
+                except NETWORK_ERRORS as e:
+                    self.breaker.record_failure()
+                    error = e
+                    response = None
+                else:
+                    self._record_status(response.status_code)
+            finally:
+                if probe:
+                    self.breaker.release_probe()
+
+            if response is None:
+                delay = self._retry_wait(attempt, started)
+                if delay is None:
+                    raise error
+                logging.warning(f"Claude erro de rede ({error}), tentativa {attempt}, nova tentativa em {delay:.2f}s")
+                time.sleep(delay)
+                continue
+
+            if response.status_code in RETRYABLE_STATUS:
+                delay = self._retry_wait(attempt, started, response.headers.get('retry-after'))
+                if delay is not None:
+                    logging.warning(f"Claude {response.status_code}, tentativa {attempt}, nova tentativa em {delay:.2f}s")
+                    response.close()
+                    time.sleep(delay)
+                    continue
+
+            if response.status_code == 200 and not stream:
+                self.latency.add(response.timing['total_ms'])
+            response.attempts = attempt
+            return response
+
+    def _send_hedged(self, payload, timeout):
+        delay = self.hedge_delay()
+        if delay is None:
+            return self.client.create_message(payload, timeout=timeout)
+
+        futures = [self._hedge_executor.submit(self.client.create_message, payload, timeout)]
+        done, _ = wait(futures, timeout=delay)
+        if not done:
+            allowed, ticket = self._hedge_slot()
+            if allowed:
+                self.hedges += 1
+                hedge = self._hedge_executor.submit(self.client.create_message, payload, timeout)
+                if ticket is not None:
+                    hedge.add_done_callback(lambda _: self.scheduler.release(ticket))
+                futures.append(hedge)
+
+        last_error = None
+        last_response = None
+        returned = None
+        try:
+            for future in as_completed(futures):
+                try:
+                    response = future.result()
+                except NETWORK_ERRORS as e:
+                    last_error = e
+                    continue
+                if response.status_code in RETRYABLE_STATUS:
+                    returned, last_response = future, response
+                    continue
+                if len(futures) > 1 and future is futures[1]:
+                    self.hedge_wins += 1
+                response.hedged = len(futures) > 1
+                returned = future
+                return response
+
+            if last_response is not None:
+                return last_response
+            raise last_error
+        finally:
+            # A perdedora: cancelada se nem começou, fechada quando terminar
+            for future in futures:
+                if future is not returned:
+                    future.cancel()
+                    future.add_done_callback(_close_future_response)
+
+class AsyncResilientClaudeClient(_ResilienceBase):
+    """AsyncClaudeClient com retry, circuit breaker e hedging opcional (asyncio)"""
+
+    def __getattr__(self, name):
+        if name == 'client':
+            raise AttributeError(name)
+        return getattr(self.client, name)
+
+    def aiter_events(self, response):
+        return self.client.aiter_events(response)
+
+    async def create_message(self, payload, api_key, timeout=30):
+        return await self._call(payload, api_key, timeout, stream=False)
+
+    async def open_stream(self, payload, api_key, timeout=30):
+        return await self._call(payload, api_key, timeout, stream=True)
+
+    async def _call(self, payload, api_key, timeout, stream):
+        self.calls += 1
+        started = time.monotonic()
+        attempt = 0
+
+        while True:
+            attempt += 1
+            probe = self._check_breaker()
+
+            try:
+                try:
+                    if stream:
+                        response = await self.client.open_stream(payload, api_key, timeout=timeout)
+                    else:
+                        response = await self._send_hedged(payload, api_key, timeout)
+                except NETWORK_ERRORS as e:
+                    self.breaker.record_failure()
+                    error = e
+                    response = None
+                else:
+                    self._record_status(response.status_code)
+            finally:
+                # Inclui CancelledError (cliente desconectou no meio da chamada de teste)
+                if probe:
+                    self.breaker.release_probe()
+
+            if response is None:
+                delay = self._retry_wait(attempt, started)
+                if delay is None:
+                    raise error
+                logging.warning(f"Claude erro de rede ({error}), tentativa {attempt}, nova tentativa em {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            if response.status_code in RETRYABLE_STATUS:
+                delay = self._retry_wait(attempt, started, response.headers.get('retry-after'))
+                if delay is not None:
+                    logging.warning(f"Claude {response.status_code}, tentativa {attempt}, nova tentativa em {delay:.2f}s")
+                    await response.aclose()
+                    await asyncio.sleep(delay)
+                    continue
+
+            if response.status_code == 200 and not stream:
+                self.latency.add(response.timing['total_ms'])
+            response.attempts = attempt
+            return response
+
+    async def _send_hedged(self, payload, api_key, timeout):
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self.client.create_message(payload, api_key, timeout=timeout)
+
+        primary = asyncio.ensure_future(self.client.create_message(payload, api_key, timeout=timeout))
+        tasks = [primary]
+        # Cancelamento da chamada (cliente desconectou) durante a espera cai no finally abaixo
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+        except BaseException:
+            primary.cancel()
+            raise
+        if not done:
+            allowed, ticket = self._hedge_slot()
+            if allowed:
+                self.hedges += 1
+                hedge = asyncio.ensure_future(self.client.create_message(payload, api_key, timeout=timeout))
+                if ticket is not None:
+                    hedge.add_done_callback(lambda _: self.scheduler.release(ticket))
+                tasks.append(hedge)
+
+        last_error = None
+        last_response = None
+        winner = None
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        response = task.result()
+                    except NETWORK_ERRORS as e:
+                        last_error = e
+                        continue
+                    if response.status_code in RETRYABLE_STATUS:
+                        if last_response is not None:
+                            await last_response.aclose()
+                        last_response = response
+                        continue
+                    if winner is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        response.hedged = len(tasks) > 1
+                        winner = response
+                    else:
+                        # Terminaram juntas: fechar a que não vai ser usada
+                        await response.aclose()
+                if winner is not None:
+                    return winner
+        finally:
+            for task in pending:
+                task.cancel()
+                task.add_done_callback(_aclose_task_response)
+            if winner is not None and last_response is not None:
+                await last_response.aclose()
+
+        if last_response is not None:
+            return last_response
+        raise last_error
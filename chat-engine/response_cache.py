@@ -0,0 +1,106 @@
+"""
+Cache de respostas por chat - perguntas repetidas (FAQ) sem BigQuery nem Claude
+Chave: (chat_id, pergunta normalizada, versão do system_prompt, versão dos documentos)
+"""
+
+import os
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 2000))
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+
+def normalize_question(text):
+    """Minúsculas, sem acentos, sem pontuação e com espaços colapsados"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r'[^\w\s]', ' ', text.lower())
+    return ' '.join(text.split())
+
+class ResponseCache:
+    """LRU com TTL, thread-safe, com índice por chat para invalidação"""
+
+    def __init__(self, max_entries=None, ttl_seconds=None):
+        self.max_entries = max_entries or RESPONSE_CACHE_MAX_ENTRIES
+        self.ttl_seconds = ttl_seconds or RESPONSE_CACHE_TTL
+        self._entries = OrderedDict()  # key -> (expira_em, valor)
+        self._keys_by_chat = {}        # chat_id -> set(keys)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.saved_latency_ms = 0.0
+
+    @staticmethod
+    def make_key(chat_id, question, prompt_version, documents_version):
+        return (chat_id, normalize_question(question), prompt_version, documents_version)
+
+    def get(self, key):
+        """Valor cacheado ou None; conta hit/miss e latência economizada"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= now:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_latency_ms += value.get('response_time_ms', 0)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._keys_by_chat.setdefault(key[0], set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_chat(self, chat_id):
+        """Remover todas as respostas de um chat; retorna quantas foram removidas"""
+        with self._lock:
+            keys = list(self._keys_by_chat.get(chat_id, ()))
+            for key in keys:
+                self._remove(key)
+            self.invalidations += 1
+            return len(keys)
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        chat_keys = self._keys_by_chat.get(key[0])
+        if chat_keys is not None:
+            chat_keys.discard(key)
+            if not chat_keys:
+                del self._keys_by_chat[key[0]]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'saved_latency_ms': round(self.saved_latency_ms, 1)
+            }
+
+# Instância global
+response_cache = ResponseCache()
@@ -0,0 +1,125 @@
+"""
+Single-flight - chamadas idênticas e simultâneas ao Claude viram uma só
+Quem chega enquanto a chamada está em andamento espera e recebe o mesmo resultado.
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+
+def flight_key(payload):
+    """Chave estável do payload completo (chat/prompt/contexto/mensagem/modelo)"""
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Versão para threads (Flask/gunicorn)"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, fn):
+        """Executa fn() uma vez por key em andamento; retorna (resultado, compartilhado)"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+                leader = True
+            else:
+                self.followers += 1
+                leader = False
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'followers': self.followers
+            }
+
+class _LeaderCancelled(Exception):
+    """Líder cancelado (cliente desconectou) antes do resultado: seguidores refazem a chamada"""
+
+class AsyncSingleFlight:
+    """Versão asyncio (modo ASGI) - chamadas compartilhadas dentro do mesmo event loop"""
+
+    def __init__(self):
+        self._calls = {}
+        self.leaders = 0
+        self.followers = 0
+        self.cancelled = 0
+
+    async def do(self, key, coro_fn):
+        """Aguarda coro_fn() uma vez por key em andamento; retorna (resultado, compartilhado)
+        
+        Se o líder for cancelado, o primeiro seguidor a acordar vira líder e chama
+        coro_fn() de novo; os demais passam a esperar por ele.
+        """
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                break
+            self.followers += 1
+            try:
+                return await asyncio.shield(future), True
+            except _LeaderCancelled:
+                continue
+
+        future = asyncio.get_running_loop().create_future()
+        # Evita aviso de "exception never retrieved" quando não há seguidores
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._calls[key] = future
+        self.leaders += 1
+
+        try:
+            result = await coro_fn()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            future.set_exception(_LeaderCancelled())
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            self._calls.pop(key, None)
+
+    def stats(self):
+        return {
+            'in_flight': len(self._calls),
+            'leaders': self.leaders,
+            'followers': self.followers,
+            'cancelled_leaders': self.cancelled
+        }
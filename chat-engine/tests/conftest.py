@@ -0,0 +1,6 @@
+"""Testes do chat-engine: módulos importados como no container (diretório do serviço no path)"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,46 @@
+"""Índice BM25: busca por termos normalizados e dumps/loads sem perda"""
+
+import pytest
+from bm25_index import BM25Index, INDEX_FORMAT_VERSION
+
+CHUNKS = [
+    {'document_id': 'precos', 'filename': 'precos.txt', 'chunk_index': 0, 'start_offset': 0, 'end_offset': 60,
+     'content': 'Consulta presencial custa R$ 450,00 e a consulta online R$ 350,00.', 'token_count': 18},
+    {'document_id': 'precos', 'filename': 'precos.txt', 'chunk_index': 1, 'start_offset': 60, 'end_offset': 110,
+     'content': 'Aceitamos Unimed, Bradesco Saúde e SulAmérica.', 'token_count': 12},
+    {'document_id': 'clinica', 'filename': 'clinica.md', 'chunk_index': 0, 'start_offset': 0, 'end_offset': 70,
+     'content': 'A clínica fica na Rua Cardoso de Almeida, 456, em Perdizes.', 'token_count': 16},
+]
+
+@pytest.fixture
+def index():
+    return BM25Index.from_chunks(CHUNKS)
+
+def test_search_finds_chunk_by_accentless_query(index):
+    top, score = index.search('voces atendem sulamerica?', k=1)[0]
+    assert (top['document_id'], top['chunk_index']) == ('precos', 1)
+    assert score > 0
+
+def test_dumps_loads_round_trip(index):
+    restored = BM25Index.loads(index.dumps())
+
+    assert len(restored) == len(index)
+    assert restored.documents == index.documents
+    assert restored.postings == index.postings
+    assert restored.total_length == index.total_length
+    assert (restored.k1, restored.b) == (index.k1, index.b)
+    for query in ('endereço da clínica', 'valor da consulta online', 'unimed'):
+        assert restored.search(query) == index.search(query)
+
+def test_round_trip_after_remove_document(index):
+    index.remove_document('precos')
+    restored = BM25Index.loads(index.dumps())
+    assert list(restored.documents) == ['clinica']
+    assert restored.search('unimed') == []
+
+def test_loads_rejects_other_format(index):
+    import gzip, json
+    data = json.loads(gzip.decompress(index.dumps()))
+    data['format'] = INDEX_FORMAT_VERSION - 1
+    with pytest.raises(ValueError):
+        BM25Index.loads(gzip.compress(json.dumps(data).encode('utf-8')))
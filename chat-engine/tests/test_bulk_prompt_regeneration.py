@@ -0,0 +1,43 @@
+"""Regeneração em lote: chats com agente e sem contexto ficam fora do lote"""
+
+import bulk_prompt_regeneration as bulk
+
+CHATS = [
+    {'chat_id': 'agente', 'chat_name': 'Cardio', 'chat_description': 'Clínica de cardiologia',
+     'chat_type': 'medical_secretary', 'personality': 'professional', 'has_agent': True},
+    {'chat_id': 'sem-descricao', 'chat_name': 'Loja', 'chat_description': '  ',
+     'chat_type': 'sales', 'personality': 'friendly', 'has_agent': False},
+    {'chat_id': 'sem-documentos', 'chat_name': 'Suporte', 'chat_description': 'Suporte de software',
+     'chat_type': 'support', 'personality': 'casual', 'has_agent': False},
+    {'chat_id': 'ok', 'chat_name': 'Pet Shop', 'chat_description': 'Banho e tosa em Pinheiros',
+     'chat_type': 'support', 'personality': 'friendly', 'has_agent': False},
+]
+
+def test_build_batch_requests_skips_agent_and_contextless_chats(monkeypatch):
+    contexts = {'ok': 'Tabela de preços do banho', 'sem-documentos': ''}
+    requested = []
+
+    def fake_context(chat_id, query):
+        requested.append(chat_id)
+        return contexts.get(chat_id, 'documentos')
+
+    monkeypatch.setattr(bulk.engine, 'get_knowledge_context', fake_context)
+    batch_requests, skipped = bulk.build_batch_requests(CHATS)
+
+    assert skipped == {
+        'agente': 'agente especializado',
+        'sem-descricao': 'sem descrição do negócio',
+        'sem-documentos': 'sem documentos',
+    }
+    assert [item['custom_id'] for item in batch_requests] == ['ok']
+    # Chat com agente nem chega a ler documentos
+    assert 'agente' not in requested
+
+    system_prompt = batch_requests[0]['params']['system'][0]['text']
+    assert 'Contexto do negócio: Banho e tosa em Pinheiros' in system_prompt
+    assert 'Tabela de preços do banho' in system_prompt
+
+def test_master_prompt_without_business_context_has_no_empty_line():
+    payload = bulk.engine.build_master_prompt_payload(
+        {'chat_name': 'X', 'chat_type': 'support', 'personality': 'casual', 'business_context': ''}, 'docs')
+    assert 'Contexto do negócio' not in payload['system'][0]['text']
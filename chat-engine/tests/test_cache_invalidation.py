@@ -0,0 +1,24 @@
+"""Invalidação de cache: rota interna, só com o segredo compartilhado"""
+
+import pytest
+import app as engine
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(engine, 'INTERNAL_API_TOKEN', 'segredo')
+    monkeypatch.setattr(engine, 'invalidate_chat_caches', lambda chat_id: 3)
+    return engine.app.test_client()
+
+def test_invalidate_requires_token(client):
+    assert client.post('/api/cache/invalidate/chat-1').status_code == 401
+    assert client.post('/api/cache/invalidate/chat-1', headers={'X-Internal-Token': 'errado'}).status_code == 401
+
+def test_invalidate_with_token(client):
+    response = client.post('/api/cache/invalidate/chat-1', headers={'X-Internal-Token': 'segredo'})
+    assert response.status_code == 200
+    assert response.get_json() == {'success': True, 'chat_id': 'chat-1', 'removed_responses': 3}
+
+def test_invalidate_closed_without_configured_token(monkeypatch):
+    monkeypatch.setattr(engine, 'INTERNAL_API_TOKEN', '')
+    response = engine.app.test_client().post('/api/cache/invalidate/chat-1', headers={'X-Internal-Token': ''})
+    assert response.status_code == 503
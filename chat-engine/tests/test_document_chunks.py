@@ -0,0 +1,52 @@
+"""Trechos: offsets exatos no texto original, sobreposição limitada e cobertura total"""
+
+import pytest
+from context_budget import estimate_tokens
+from document_chunks import chunk_text
+
+TEXT = (
+    "Clínica CardioVida — Dr. João Silva, CRM 12345.\n\n"
+    "Atendemos de segunda a sexta, das 8h às 17h. Aos sábados, das 8h às 12h!\n"
+    "Consulta presencial: R$ 450,00. Consulta online: R$ 350,00… Retorno em até 30 dias é gratuito.\n"
+    "   Aceitamos Unimed, Bradesco Saúde e SulAmérica.   \n"
+    "Endereço: Rua Cardoso de Almeida, 456 - Perdizes, São Paulo. Estacionamento conveniado no local?\n"
+) * 6
+
+@pytest.mark.parametrize('chunk_tokens, overlap_tokens', [(40, 10), (80, 20), (300, 60), (25, 0)])
+def test_offsets_match_content(chunk_tokens, overlap_tokens):
+    chunks = chunk_text(TEXT, chunk_tokens, overlap_tokens)
+
+    assert [chunk['chunk_index'] for chunk in chunks] == list(range(len(chunks)))
+    for chunk in chunks:
+        assert chunk['content'] == TEXT[chunk['start_offset']:chunk['end_offset']]
+        assert chunk['content'] == chunk['content'].strip()
+        assert chunk['token_count'] == estimate_tokens(chunk['content'])
+
+@pytest.mark.parametrize('chunk_tokens, overlap_tokens', [(40, 10), (80, 20), (25, 0)])
+def test_chunks_advance_and_cover_the_text(chunk_tokens, overlap_tokens):
+    chunks = chunk_text(TEXT, chunk_tokens, overlap_tokens)
+    assert len(chunks) > 1
+
+    assert chunks[0]['start_offset'] == len(TEXT) - len(TEXT.lstrip())
+    assert chunks[-1]['end_offset'] == len(TEXT.rstrip())
+    for previous, current in zip(chunks, chunks[1:]):
+        # Sempre avança; sobreposição no máximo até o fim do trecho anterior
+        assert current['start_offset'] > previous['start_offset']
+        assert current['end_offset'] > previous['end_offset']
+        # Sem buracos: o que fica entre dois trechos é só espaço
+        assert not TEXT[previous['end_offset']:current['start_offset']].strip()
+        if overlap_tokens == 0:
+            assert current['start_offset'] >= previous['end_offset']
+
+def test_long_sentence_is_split_on_words():
+    text = ' '.join(f"palavra{i}" for i in range(400))
+    chunks = chunk_text(text, 30, 0)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk['content'] == text[chunk['start_offset']:chunk['end_offset']]
+        assert not chunk['content'].startswith(' ') and 'palavra' in chunk['content']
+    assert ' '.join(chunk['content'] for chunk in chunks) == text
+
+@pytest.mark.parametrize('text', ['', '   \n\n  ', None])
+def test_empty_text_has_no_chunks(text):
+    assert chunk_text(text) == []
@@ -0,0 +1,54 @@
+"""Respostas rápidas: só perguntas factuais puras, nunca mensagens com sintoma/urgência"""
+
+import json
+import os
+import pytest
+from fast_answers import FastAnswerEngine
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'backend', 'medical_agent_test.json')
+
+@pytest.fixture(scope='module')
+def engine():
+    with open(CONFIG_PATH, encoding='utf-8') as config_file:
+        return FastAnswerEngine(json.load(config_file)['agent_configuration'])
+
+# Mensagens da revisão: antes recebiam telefone/endereço/horário da clínica
+@pytest.mark.parametrize('message', [
+    "estou com dor no peito, qual o telefone?",
+    "sinto falta de ar, qual o endereço?",
+    "qual o telefone do SAMU?",
+    "qual o horário de amanhã, estou com febre?",
+])
+def test_symptom_messages_never_get_template_reply(engine, message):
+    assert engine.match(message) is None
+
+@pytest.mark.parametrize('message, intent, expected', [
+    ("qual o telefone?", 'contact', "(11) 99999-1234"),
+    ("qual o endereço?", 'address', "Rua Cardoso de Almeida, 456"),
+    ("que horas abre?", 'working_hours', "Segunda a Sexta: 8h às 17h"),
+    ("quais as formas de pagamento", 'payment', "PIX, cartão de crédito e parcelamento"),
+    ("quanto custa a consulta online?", 'price', "Consulta Online: R$ 350,00"),
+    ("aceita unimed?", 'health_plans', "Sim, atendemos Unimed"),
+])
+def test_factual_questions(engine, message, intent, expected):
+    answer = engine.match(message)
+    assert answer is not None
+    assert answer['intent'] == intent
+    assert expected in answer['reply']
+
+def test_long_questions_go_to_model(engine):
+    assert engine.match("olá, gostaria de saber qual o telefone da clínica para eu ligar amanhã cedo") is None
+
+def test_unrelated_message(engine):
+    assert engine.match("bom dia") is None
+
+def test_without_configuration():
+    assert FastAnswerEngine().match("qual o telefone?") is None
+
+def test_chat_template(engine):
+    custom = FastAnswerEngine({
+        'address': 'Rua A, 1',
+        'secretary_name': 'Carla',
+        'answer_templates': {'address': 'Estamos na {value}. Fale com {secretary_name}!'}
+    })
+    assert custom.match("qual o endereço?")['reply'] == 'Estamos na Rua A, 1. Fale com Carla!'
@@ -0,0 +1,34 @@
+"""Reciprocal rank fusion: soma de 1 / (k + posição) entre as listas"""
+
+import pytest
+from hybrid_retrieval import reciprocal_rank_fusion
+
+def chunk(document_id, chunk_index):
+    return {'document_id': document_id, 'chunk_index': chunk_index, 'content': f"{document_id} {chunk_index}"}
+
+def keys(fused):
+    return [(item['document_id'], item['chunk_index']) for item, score in fused]
+
+def test_chunk_in_both_lists_wins():
+    bm25 = [chunk('a', 0), chunk('b', 0), chunk('c', 0)]
+    vector = [chunk('d', 0), chunk('b', 0), chunk('a', 0)]
+    fused = reciprocal_rank_fusion([bm25, vector], k=60)
+
+    assert keys(fused)[:2] == [('a', 0), ('b', 0)]
+    assert set(keys(fused)) == {('a', 0), ('b', 0), ('c', 0), ('d', 0)}
+    scores = dict(zip(keys(fused), (score for item, score in fused)))
+    assert scores[('a', 0)] == pytest.approx(1 / 61 + 1 / 63)
+    assert scores[('b', 0)] == pytest.approx(2 / 62)
+    assert scores[('d', 0)] == pytest.approx(1 / 61)
+
+def test_single_list_keeps_order():
+    ranking = [chunk('a', 2), chunk('a', 0), chunk('b', 1)]
+    assert keys(reciprocal_rank_fusion([ranking])) == [('a', 2), ('a', 0), ('b', 1)]
+
+def test_same_chunk_index_in_different_documents_is_not_merged():
+    fused = reciprocal_rank_fusion([[chunk('a', 0)], [chunk('b', 0)]], k=1)
+    assert sorted(keys(fused)) == [('a', 0), ('b', 0)]
+    assert [score for item, score in fused] == [pytest.approx(0.5), pytest.approx(0.5)]
+
+def test_empty_rankings():
+    assert reciprocal_rank_fusion([[], []]) == []
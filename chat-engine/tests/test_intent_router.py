@@ -0,0 +1,61 @@
+"""Roteamento por intenção: limiares e mensagens mistas (sintoma + pergunta simples)"""
+
+import pytest
+from intent_router import (
+    IntentClassifier, choose_route, complex_match, CLAUDE_FAST_MODEL, ROUTER_COMPLEX_MATCH
+)
+
+# Mensagens da revisão (configuração de cardiologia em backend/medical_agent_test.json)
+URGENT_MESSAGES = [
+    "estou com dor no peito, qual o telefone?",
+    "sinto falta de ar, qual o endereço?",
+    "qual o telefone do SAMU?",
+    "qual o horário de amanhã, estou com febre?",
+]
+
+SIMPLE_MESSAGES = [
+    "qual o telefone?",
+    "qual o endereço?",
+    "qual o horário de atendimento",
+    "quais as formas de pagamento",
+    "quanto custa a consulta online?",
+    "aceita cartão de crédito?",
+    "tem estacionamento?",
+]
+
+@pytest.fixture(scope='module')
+def classifier():
+    return IntentClassifier.for_agent()
+
+@pytest.mark.parametrize('message', URGENT_MESSAGES)
+def test_urgent_part_forces_chat_model(classifier, message):
+    route = choose_route(classifier, message, chat_model='claude-sonnet', chat_max_tokens=800)
+    assert route['route'] == 'complex'
+    assert route['model'] == 'claude-sonnet'
+    assert route['max_tokens'] == 800
+
+@pytest.mark.parametrize('message', URGENT_MESSAGES)
+def test_complex_match_above_threshold(message):
+    assert complex_match(message) >= ROUTER_COMPLEX_MATCH
+
+@pytest.mark.parametrize('message', SIMPLE_MESSAGES)
+def test_simple_questions_stay_on_fast_model(classifier, message):
+    route = choose_route(classifier, message, chat_model='claude-sonnet', chat_max_tokens=800)
+    assert route['route'] == 'simple'
+    assert route['model'] == CLAUDE_FAST_MODEL
+    assert complex_match(message) < ROUTER_COMPLEX_MATCH
+
+@pytest.mark.parametrize('message', ["oi", "bom dia", "obrigado"])
+def test_greetings(classifier, message):
+    route = choose_route(classifier, message, chat_max_tokens=800)
+    assert route['route'] == 'greeting'
+    assert route['max_tokens'] == 150
+
+def test_low_confidence_goes_to_chat_model(classifier):
+    route = choose_route(classifier, "xyzw qwerty", chat_model='claude-sonnet')
+    assert route['route'] == 'complex'
+    assert route['model'] == 'claude-sonnet'
+
+def test_long_messages_are_never_simple(classifier):
+    message = "qual o telefone " + "e mais uma coisa " * 10
+    assert choose_route(classifier, message)['route'] == 'complex'
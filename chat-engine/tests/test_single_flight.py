@@ -0,0 +1,63 @@
+"""Single-flight asyncio: líder cancelado não derruba os seguidores"""
+
+import asyncio
+import pytest
+from single_flight import AsyncSingleFlight
+
+def test_followers_share_leader_result():
+    async def scenario():
+        flights = AsyncSingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'resposta'
+
+        results = await asyncio.gather(*(flights.do('k', fetch) for _ in range(3)))
+        return results, calls, flights.stats()
+
+    results, calls, stats = asyncio.run(scenario())
+    assert results == [('resposta', False), ('resposta', True), ('resposta', True)]
+    assert len(calls) == 1
+    assert stats['in_flight'] == 0
+
+def test_cancelled_leader_hands_call_to_a_follower():
+    async def scenario():
+        flights = AsyncSingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'resposta'
+
+        leader = asyncio.create_task(flights.do('k', fetch))
+        await asyncio.sleep(0)
+        followers = [asyncio.create_task(flights.do('k', fetch)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        results = await asyncio.gather(*followers)
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return results, calls, flights.stats()
+
+    results, calls, stats = asyncio.run(scenario())
+    # Um seguidor refaz a chamada (vira líder), o outro recebe o resultado dele
+    assert sorted(results) == [('resposta', False), ('resposta', True)]
+    assert len(calls) == 2
+    assert stats['cancelled_leaders'] == 1
+    assert stats['in_flight'] == 0
+
+def test_leader_error_reaches_followers():
+    async def scenario():
+        flights = AsyncSingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise RuntimeError('Claude error 529')
+
+        return await asyncio.gather(*(flights.do('k', fetch) for _ in range(2)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
@@ -0,0 +1,65 @@
+"""Índice vetorial: dumps/loads preserva matriz, trechos, lápides compactadas e IVF"""
+
+import numpy as np
+import pytest
+import vector_index
+from vector_index import VectorIndex
+
+TOPICS = ['consulta cardiológica', 'eletrocardiograma', 'ecocardiograma', 'holter 24 horas',
+          'teste ergométrico', 'convênio Unimed', 'pagamento por PIX', 'endereço em Perdizes']
+
+def make_chunks(document_id, count):
+    return [
+        {'document_id': document_id, 'filename': f"{document_id}.txt", 'chunk_index': i,
+         'start_offset': i * 100, 'end_offset': i * 100 + 90, 'token_count': 20,
+         'content': f"{TOPICS[i % len(TOPICS)]} item {i} do documento {document_id} código {i * 37}"}
+        for i in range(count)
+    ]
+
+def assert_same_search(original, restored, queries):
+    for query in queries:
+        expected = [(chunk['document_id'], chunk['chunk_index'], round(score, 5))
+                    for chunk, score in original.search(query, k=5)]
+        actual = [(chunk['document_id'], chunk['chunk_index'], round(score, 5))
+                  for chunk, score in restored.search(query, k=5)]
+        assert actual == expected
+
+QUERIES = ['quanto custa o holter?', 'aceita unimed', 'onde fica a clínica', 'código 74']
+
+def test_dumps_loads_round_trip():
+    index = VectorIndex.from_chunks(make_chunks('a', 12) + make_chunks('b', 6))
+    restored = VectorIndex.loads(index.dumps())
+
+    assert len(restored) == len(index)
+    assert restored.documents == index.documents
+    assert np.array_equal(restored.matrix, index.matrix)
+    assert restored.ann is None
+    assert_same_search(index, restored, QUERIES)
+
+def test_round_trip_drops_removed_documents():
+    index = VectorIndex.from_chunks(make_chunks('a', 12) + make_chunks('b', 30))
+    index.remove_document('a')
+    restored = VectorIndex.loads(index.dumps())
+
+    assert len(restored) == len(index) == 30
+    assert list(restored.documents) == ['b']
+    assert restored.deleted == 0
+    assert all(chunk['document_id'] == 'b' for chunk, score in restored.search('holter', k=10))
+
+def test_round_trip_keeps_trained_ivf(monkeypatch):
+    monkeypatch.setattr(vector_index, 'ANN_MIN_CHUNKS', 16)
+    index = VectorIndex.from_chunks(make_chunks('a', 40))
+    index._train_ann()
+    assert index.ann is not None
+
+    restored = VectorIndex.loads(index.dumps())
+    assert restored.ann is not None
+    assert np.array_equal(restored.ann.centroids, index.ann.centroids)
+    assert restored.ann.trained_size == index.ann.trained_size
+    assert_same_search(index, restored, QUERIES)
+
+def test_loads_rejects_other_format(monkeypatch):
+    payload = VectorIndex.from_chunks(make_chunks('a', 3)).dumps()
+    monkeypatch.setattr(vector_index, 'INDEX_FORMAT_VERSION', vector_index.INDEX_FORMAT_VERSION + 1)
+    with pytest.raises(ValueError):
+        VectorIndex.loads(payload)
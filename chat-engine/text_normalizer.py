@@ -0,0 +1,175 @@
+"""
+Normalização de texto em português para a busca nos documentos
+Sem acento, minúsculas, sem stopwords, números normalizados ("R$ 1.200,00" -> "1200")
+e radicais no estilo RSLP ("consultas", "consultar" -> "consult").
+Os trechos são normalizados no upload (coluna tokens de chat_document_chunks); na
+mensagem só a pergunta é normalizada.
+Mesmo arquivo em backend/ e chat-engine/.
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+
+# Número (com separadores de milhar/decimal) ou palavra; "18h" vira "18" + "h"
+TOKEN_RE = re.compile(r'\d+(?:[.,]\d+)*|[^\W\d_]+')
+THOUSANDS_RE = re.compile(r'^\d{1,3}(?:\.\d{3})+(?:,\d+)?$')
+
+STOPWORDS = frozenset("""
+a ao aos as ate com como da das de dela dele delas deles depois do dos e ela elas ele eles
+em entre era eram essa essas esse esses esta estas este estes eu foi for ha isso isto ja
+lhe lhes mais mas me mesmo meu minha muito na nas nem no nos nossa nosso num numa o os ou
+para pela pelas pelo pelos por pra qual quais quando que quem se sem ser seu seus sua suas
+so tambem te tem tu tua um uma umas uns voce voces vos
+""".split())
+
+def fold(text):
+    """Minúsculas e sem acento"""
+    text = unicodedata.normalize('NFKD', (text or '').lower())
+    return ''.join(ch for ch in text if not unicodedata.combining(ch))
+
+def normalize_number(raw):
+    """"1.200,00" -> "1200", "1,5" -> "1.5", "350,00" -> "350" """
+    if THOUSANDS_RE.match(raw):
+        raw = raw.replace('.', '')
+    raw = raw.replace(',', '.')
+    if '.' in raw:
+        whole, _, decimals = raw.rpartition('.')
+        decimals = decimals.rstrip('0')
+        raw = f"{whole.replace('.', '')}.{decimals}" if decimals else whole.replace('.', '')
+    return raw
+
+# Regras RSLP (Orengo & Huyck) simplificadas, já sem acento:
+# (sufixo, tamanho mínimo do radical, substituição, exceções)
+PLURAL_RULES = (
+    ('ns', 1, 'm', ()),
+    ('oes', 3, 'ao', ()),
+    ('aes', 1, 'ao', ('maes',)),
+    ('ais', 1, 'al', ('cais', 'mais')),
+    ('eis', 2, 'el', ()),
+    ('ois', 2, 'ol', ('depois',)),
+    ('is', 2, 'il', ('lapis', 'cais', 'mais', 'crucis', 'biquinis', 'pois', 'depois', 'dois', 'leis')),
+    ('les', 3, 'l', ()),
+    ('res', 3, 'r', ('arvores',)),
+    ('s', 2, '', ('alias', 'pires', 'lapis', 'cais', 'mais', 'mas', 'menos', 'ferias', 'fezes',
+                  'pesames', 'crucis', 'gas', 'atras', 'moises', 'atraves', 'convites', 'pais',
+                  'apos', 'ambas', 'ambos', 'messias', 'depois')),
+)
+FEMININE_RULES = (
+    ('ona', 3, 'ao', ('abandona', 'lona', 'iona', 'cortisona', 'monotona', 'maratona', 'acetona')),
+    ('ora', 3, 'or', ()),
+    ('na', 4, 'no', ('carona', 'abandona', 'lona', 'iona', 'cortisona', 'monotona', 'maratona',
+                     'acetona', 'detona', 'guiana', 'campana', 'grana', 'caravana', 'banana', 'paisana')),
+    ('inha', 3, 'inho', ('rainha', 'linha', 'minha')),
+    ('esa', 3, 'es', ('mesa', 'obesa', 'princesa', 'turquesa', 'ilesa', 'pesa', 'presa')),
+    ('osa', 3, 'oso', ('mucosa', 'prosa')),
+    ('iaca', 3, 'iaco', ()),
+    ('ica', 3, 'ico', ('dica',)),
+    ('ada', 2, 'ado', ('pitada',)),
+    ('ida', 3, 'ido', ('vida',)),
+    ('ima', 3, 'imo', ('vitima',)),
+    ('iva', 3, 'ivo', ('saliva', 'oliva')),
+    ('eira', 3, 'eiro', ('beira', 'cadeira', 'frigideira', 'bandeira', 'feira', 'capoeira',
+                         'barreira', 'fronteira', 'besteira', 'poeira')),
+)
+ADVERB_RULES = (
+    ('mente', 4, '', ('experimente',)),
+)
+AUGMENTATIVE_RULES = (
+    ('dissimo', 5, '', ()), ('abilissimo', 5, '', ()), ('issimo', 3, '', ()),
+    ('errimo', 4, '', ()), ('zinho', 2, '', ()), ('quinho', 4, 'c', ()),
+    ('uinho', 4, '', ()), ('adinho', 3, '', ()), ('inho', 3, '', ('caminho', 'cominho')),
+    ('alhao', 4, '', ()), ('uca', 4, '', ()), ('aca', 4, '', ('barriga',)),
+    ('adao', 4, '', ()), ('ao', 3, '', ('camarao', 'chimarrao', 'canela', 'alemao', 'anfitriao',
+                                        'avelao', 'aviao', 'balao', 'bobalhao', 'cao', 'chao',
+                                        'coracao', 'feijao', 'limao', 'mamao', 'melao', 'pao',
+                                        'sabao', 'tubarao', 'verao', 'vilao')),
+)
+NOUN_RULES = (
+    ('encialista', 4, '', ()), ('alista', 5, '', ()), ('agem', 3, '', ('coragem', 'chantagem', 'vantagem')),
+    ('iamento', 4, '', ()), ('amento', 3, '', ('firmamento', 'fundamento', 'departamento')),
+    ('imento', 3, '', ()), ('mento', 6, '', ('firmamento', 'elemento', 'complemento', 'instrumento', 'departamento')),
+    ('alizado', 4, '', ()), ('atizado', 4, '', ()), ('tizado', 4, '', ('alfabetizado',)),
+    ('izado', 5, '', ('organizado', 'pulverizado')), ('ativo', 4, '', ('pejorativo', 'relativo')),
+    ('tivo', 4, '', ('relativo',)), ('ivo', 4, '', ('passivo', 'possessivo', 'pejorativo', 'positivo')),
+    ('ado', 2, '', ('grado',)), ('ido', 3, '', ('cândido', 'consolido', 'rapido', 'decido', 'timido',
+                                                 'duvido', 'marido')),
+    ('ador', 3, '', ()), ('edor', 3, '', ()), ('idor', 4, '', ('ouvidor',)), ('dor', 4, '', ('ouvidor',)),
+    ('sor', 4, '', ('assessor',)), ('atoria', 5, '', ()), ('tor', 3, '', ('benfeitor', 'leitor', 'editor',
+                                                                          'pastor', 'produtor', 'promotor',
+                                                                          'consultor')),
+    ('ante', 2, '', ('gigante', 'elefante', 'adiante', 'possante', 'instante', 'restaurante')),
+    ('ancia', 3, '', ('ambulancia',)), ('encia', 3, '', ()), ('avel', 2, '', ('movel',)),
+    ('ivel', 5, '', ('possivel',)), ('ista', 4, '', ('pianista', 'lista', 'artista', 'dentista')),
+    ('ismo', 3, '', ('cinismo',)), ('ico', 4, '', ('tico', 'publico', 'explico')),
+    ('ional', 4, '', ()), ('idade', 4, '', ('autoridade', 'comunidade')), ('ez', 4, '', ()),
+    ('eza', 3, '', ()), ('osa', 3, '', ()), ('oso', 3, '', ('precioso',)), ('al', 4, '', ('afinal', 'animal',
+                                                                                      'estatal', 'bissexual',
+                                                                                      'desleal', 'fiscal',
+                                                                                      'formal', 'pessoal',
+                                                                                      'liberal', 'postal',
+                                                                                      'virtual', 'visual',
+                                                                                      'pontual', 'sideral',
+                                                                                      'sucursal')),
+    ('ario', 3, '', ('voluntario', 'salario', 'aniversario', 'diario', 'lionario', 'armario')),
+    ('eiro', 3, '', ('desfiladeiro', 'pioneiro', 'mosteiro')), ('ura', 4, '', ('imatura', 'acupuntura',
+                                                                              'costura')),
+)
+VERB_RULES = (
+    ('ariamos', 2), ('eriamos', 2), ('iriamos', 3), ('assemos', 2), ('essemos', 2), ('issemos', 3),
+    ('arieis', 2), ('erieis', 2), ('irieis', 3), ('aremos', 2), ('eremos', 2), ('iremos', 3),
+    ('avamos', 2), ('ariam', 2), ('eriam', 2), ('iriam', 3), ('aramos', 2), ('eramos', 2),
+    ('iramos', 3), ('arias', 2), ('erias', 2), ('irias', 3), ('ardes', 2), ('erdes', 2),
+    ('irdes', 2), ('assem', 2), ('essem', 2), ('issem', 3), ('ando', 2), ('endo', 3), ('indo', 3),
+    ('ondo', 3), ('aram', 2), ('arao', 2), ('erao', 2), ('iram', 3), ('irao', 3), ('eram', 3),
+    ('aria', 2), ('eria', 2), ('iria', 3), ('avam', 2), ('ava', 2), ('arei', 2), ('erei', 2),
+    ('irei', 3), ('amos', 2), ('emos', 2), ('imos', 3), ('ara', 2), ('era', 3), ('ira', 3),
+    ('ado', 2), ('ido', 3), ('ar', 2), ('er', 2), ('ir', 3), ('ou', 3), ('eu', 3), ('iu', 3),
+    ('ia', 3), ('am', 2), ('em', 2), ('as', 2), ('es', 3), ('ei', 3),
+)
+VOWEL_RULES = (('a', 3, '', ()), ('e', 3, '', ()), ('o', 3, '', ()))
+
+def _apply(word, rules):
+    """Aplicar a primeira regra que casar; retorna (palavra, aplicou)"""
+    for rule in rules:
+        suffix, min_stem = rule[0], rule[1]
+        replacement = rule[2] if len(rule) > 2 else ''
+        exceptions = rule[3] if len(rule) > 3 else ()
+        if word.endswith(suffix) and len(word) - len(suffix) >= min_stem and word not in exceptions:
+            return word[:len(word) - len(suffix)] + replacement, True
+    return word, False
+
+@lru_cache(maxsize=100000)
+def stem(word):
+    """Radical de uma palavra já sem acento e em minúsculas"""
+    if len(word) < 3:
+        return word
+    if word.endswith('s'):
+        word, _ = _apply(word, PLURAL_RULES)
+    if word.endswith('a'):
+        word, _ = _apply(word, FEMININE_RULES)
+    word, _ = _apply(word, ADVERB_RULES)
+    word, _ = _apply(word, AUGMENTATIVE_RULES)
+    word, removed = _apply(word, NOUN_RULES)
+    if not removed:
+        word, removed = _apply(word, VERB_RULES)
+    if not removed:
+        word, _ = _apply(word, VOWEL_RULES)
+    return word
+
+def normalize_tokens(text):
+    """Termos para a busca: radicais sem stopwords e números normalizados"""
+    tokens = []
+    for token in TOKEN_RE.findall(fold(text)):
+        if token[0].isdigit():
+            tokens.append(normalize_number(token))
+        elif len(token) > 1 and token not in STOPWORDS:
+            tokens.append(stem(token))
+    return tokens
+
+def chunk_tokens(chunk):
+    """Termos do trecho: os gravados no upload ou normalizados na hora (trechos antigos)"""
+    tokens = chunk.get('tokens')
+    if tokens is not None:
+        return tokens.split() if isinstance(tokens, str) else list(tokens)
+    return normalize_tokens(chunk.get('content'))
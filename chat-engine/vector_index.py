@@ -0,0 +1,301 @@
+"""
+Busca vetorial local por chat - sem rede, sem GPU, sem serviço de embeddings
+Embedding = n-gramas de caractere com hashing (feature hashing com sinal) + conceitos
+comuns de atendimento ("quanto custa" ~ "valor da consulta"), calculado no upload e
+guardado em float32. A busca é um único produto matriz-vetor (similaridade de cosseno),
+ou aproximada (IVF) em bases grandes.
+Mesmo arquivo em backend/ e chat-engine/.
+"""
+
+import os
+import io
+import json
+import math
+import zlib
+import heapq
+import base64
+from collections import Counter
+import numpy as np
+from text_normalizer import TOKEN_RE, STOPWORDS, fold
+from bm25_index import CHUNK_FIELDS, chunk_key
+from chunk_dedup import ChunkDeduplicator, chunk_fingerprint
+from ann_index import IVFIndex, ANN_MIN_CHUNKS
+
+EMBEDDING_DIM = int(os.environ.get('EMBEDDING_DIM', 256))
+# Similaridade mínima para um trecho contar como resultado
+VECTOR_MIN_SIMILARITY = float(os.environ.get('VECTOR_MIN_SIMILARITY', 0.05))
+# Fração de lápides (trechos removidos) que dispara a compactação da matriz
+VECTOR_COMPACT_RATIO = float(os.environ.get('VECTOR_COMPACT_RATIO', 0.25))
+INDEX_FORMAT_VERSION = 2
+
+NGRAM_SIZES = (3, 4, 5)
+CONCEPT_WEIGHT = 4.0
+
+# Palavras diferentes para a mesma pergunta (sem acento, minúsculas)
+CONCEPTS = {
+    'preco': "preco precos valor valores custa custam custo custos quanto cobra cobram "
+             "investimento tabela orcamento",
+    'horario': "horario horarios abre abrem fecha fecham funciona funcionamento expediente aberto",
+    'endereco': "endereco localizacao onde fica rua avenida bairro chegar",
+    'pagamento': "pagamento pagar pago pix cartao credito debito parcela parcelas parcelar "
+                 "parcelamento boleto dinheiro",
+    'agendamento': "agendar agenda agendamento marcar marcacao reservar disponibilidade vaga vagas",
+    'convenio': "convenio convenios plano planos unimed amil bradesco sulamerica reembolso",
+    'contato': "telefone whatsapp contato email ligar celular"
+}
+CONCEPT_OF = {word: concept for concept, words in CONCEPTS.items() for word in words.split()}
+
+def _features(text):
+    features = Counter()
+    for word in TOKEN_RE.findall(fold(text)):
+        concept = CONCEPT_OF.get(word)
+        if concept:
+            features['@' + concept] += CONCEPT_WEIGHT
+        if word in STOPWORDS:
+            continue
+        padded = f" {word} "
+        for n in NGRAM_SIZES:
+            for i in range(len(padded) - n + 1):
+                features[padded[i:i + n]] += 1
+    return features
+
+def embed_text(text, dim=None):
+    """Vetor float32 normalizado (norma 1, ou zero para texto vazio)"""
+    dim = dim or EMBEDDING_DIM
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature, count in _features(text).items():
+        h = zlib.crc32(feature.encode('utf-8'))
+        sign = 1.0 if h & 0x80000000 else -1.0
+        vector[h % dim] += sign * (1 + math.log(count))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def encode_embedding(vector):
+    """float32 -> base64 (coluna BYTES do BigQuery via insert_rows_json)"""
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode('ascii')
+
+def decode_embedding(value, dim=None):
+    """bytes ou base64 -> vetor float32; None se ausente ou de outra dimensão"""
+    dim = dim or EMBEDDING_DIM
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = base64.b64decode(value)
+    vector = np.frombuffer(value, dtype=np.float32)
+    return vector if vector.size == dim else None
+
+class VectorIndex:
+    """Matriz float32 (uma linha por trecho) + metadados dos trechos
+
+    Trechos removidos viram lápides (linha marcada como morta) até a compactação;
+    acima de ANN_MIN_CHUNKS trechos a busca usa o índice IVF (ann_index.py).
+    """
+
+    def __init__(self, dim=None):
+        self.dim = dim or EMBEDDING_DIM
+        self.keys = []        # chave do trecho de cada linha (None = removido)
+        self.rows = {}        # chave -> linha
+        self.chunks = {}      # chave -> trecho
+        self.documents = {}   # document_id -> [chaves]
+        self.size = 0         # linhas usadas (vivas + lápides)
+        self.deleted = 0
+        self._matrix = np.zeros((0, self.dim), dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self.ann = None
+        self.dedup = ChunkDeduplicator()
+
+    @classmethod
+    def from_chunks(cls, chunks, **kwargs):
+        index = cls(**kwargs)
+        index.add_chunks(chunks)
+        return index
+
+    def __len__(self):
+        return self.size - self.deleted
+
+    @property
+    def matrix(self):
+        return self._matrix[:self.size]
+
+    def add_chunks(self, chunks):
+        """Adiciona trechos; usa o embedding salvo no upload ou calcula na hora
+
+        Trechos quase idênticos a um já indexado ficam fora da matriz (chunk_dedup.py).
+        """
+        vectors = []
+        for chunk in chunks:
+            key = chunk_key(chunk)
+            if key in self.chunks or key in self.dedup.shadowed:
+                continue
+            entry = {field: chunk.get(field) for field in CHUNK_FIELDS}
+            entry['fingerprint'] = chunk_fingerprint(chunk)
+            if not self.dedup.add(key, entry):
+                continue
+            vector = decode_embedding(chunk.get('embedding'), self.dim)
+            vectors.append(vector if vector is not None else embed_text(chunk['content'], self.dim))
+            self.rows[key] = self.size + len(vectors) - 1
+            self.keys.append(key)
+            self.chunks[key] = entry
+            self.documents.setdefault(chunk['document_id'], []).append(key)
+        if vectors:
+            self._append(np.stack(vectors))
+
+    def _append(self, vectors):
+        """Copiar vetores para o fim da matriz (capacidade dobra quando enche)"""
+        first, needed = self.size, self.size + len(vectors)
+        if needed > len(self._matrix):
+            capacity = max(needed, 2 * len(self._matrix), 64)
+            matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+            matrix[:first] = self._matrix[:first]
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:first] = self._alive[:first]
+            self._matrix, self._alive = matrix, alive
+        self._matrix[first:needed] = vectors
+        self._alive[first:needed] = True
+        self.size = needed
+
+        if self.ann is None or self.ann.needs_retrain(self.size):
+            self._train_ann()
+        else:
+            self.ann.add(first, vectors)
+
+    def _train_ann(self):
+        self.ann = None
+        if len(self) < ANN_MIN_CHUNKS:
+            return
+        self.ann = IVFIndex.train(self.matrix[self._alive[:self.size]])
+        self.ann.add(0, self.matrix)
+        print(f"🧭 Índice IVF treinado: {len(self)} trechos, {self.ann.nlist} listas")
+
+    def add_document(self, document_id, filename, chunks):
+        """Indexar (ou reindexar) os trechos de um documento"""
+        self.remove_document(document_id)
+        self.add_chunks([dict(chunk, document_id=document_id, filename=filename) for chunk in chunks])
+
+    def remove_document(self, document_id):
+        """Marcar os trechos do documento como removidos (compacta se houver muitas lápides)"""
+        keys = self.documents.pop(document_id, [])
+        for key in keys:
+            row = self.rows.pop(key)
+            self.keys[row] = None
+            self._alive[row] = False
+            self.chunks.pop(key, None)
+            self.deleted += 1
+        if self.deleted and self.deleted > self.size * VECTOR_COMPACT_RATIO:
+            self.compact()
+        # Trechos de outros documentos que estavam colapsados sobre os removidos
+        self.add_chunks(self.dedup.remove_document(document_id, keys))
+
+    def compact(self):
+        """Remover lápides da matriz (o IVF mantém os centróides)"""
+        live = np.flatnonzero(self._alive[:self.size])
+        ann = self.ann
+        self._matrix = self._matrix[live]
+        self._alive = np.ones(len(live), dtype=bool)
+        self.keys = [self.keys[row] for row in live]
+        self.rows = {key: row for row, key in enumerate(self.keys)}
+        self.size, self.deleted = len(live), 0
+        self.ann = None
+        if ann is not None and len(self) >= ANN_MIN_CHUNKS:
+            self.ann = IVFIndex(ann.centroids, nprobe=ann.nprobe)
+            self.ann.trained_size = ann.trained_size
+            self.ann.add(0, self.matrix, ann.assignments[live])
+
+    def search_vector(self, vector, k=10, nprobe=None):
+        """(linhas, similaridades) dos k vetores mais próximos, em ordem decrescente"""
+        if self.ann is not None:
+            rows = self.ann.candidates(vector, nprobe)
+            rows = rows[self._alive[rows]]
+            scores = self._matrix[rows] @ vector
+        else:
+            rows = None
+            scores = self.matrix @ vector
+            scores[~self._alive[:self.size]] = -np.inf
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return (top if rows is None else rows[top]), scores[top]
+
+    def search(self, query, k=10, nprobe=None):
+        """[(trecho, similaridade)] dos k trechos mais próximos da pergunta"""
+        if not len(self):
+            return []
+        rows, scores = self.search_vector(embed_text(query, self.dim), k, nprobe)
+        return [
+            (self.chunks[self.keys[row]], float(score))
+            for row, score in zip(rows, scores) if score >= VECTOR_MIN_SIMILARITY
+        ]
+
+    def ranked_chunks(self, query, k=10):
+        """Trechos mais próximos; se faltar, completa com o começo dos documentos"""
+        ranked = [chunk for chunk, score in self.search(query, k)]
+        if len(ranked) < k:
+            seen = {chunk_key(chunk) for chunk in ranked}
+            leading = heapq.nsmallest(
+                k, self.chunks.values(), key=lambda chunk: (chunk['chunk_index'], chunk['document_id'])
+            )
+            ranked += [chunk for chunk in leading if chunk_key(chunk) not in seen][:k - len(ranked)]
+        return ranked
+
+    def dumps(self):
+        """Forma serializada (npz compactado: matriz float32, metadados em JSON e IVF)"""
+        live = np.flatnonzero(self._alive[:self.size])
+        meta = {
+            'format': INDEX_FORMAT_VERSION,
+            'chunks': [self.chunks[self.keys[row]] for row in live],
+            'collapsed': self.dedup.shadowed_chunks(),
+            'ann_trained_size': self.ann.trained_size if self.ann is not None else 0
+        }
+        arrays = {
+            'matrix': self._matrix[live],
+            'meta': np.frombuffer(json.dumps(meta, ensure_ascii=False).encode('utf-8'), dtype=np.uint8)
+        }
+        if self.ann is not None:
+            arrays.update(centroids=self.ann.centroids, assignments=self.ann.assignments[live])
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def loads(cls, payload):
+        with np.load(io.BytesIO(payload)) as data:
+            matrix = data['matrix'].astype(np.float32, copy=False)
+            meta = json.loads(data['meta'].tobytes().decode('utf-8'))
+            centroids = data['centroids'] if 'centroids' in data else None
+            assignments = data['assignments'] if 'assignments' in data else None
+        if meta.get('format') != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Formato de índice não suportado: {meta.get('format')}")
+        index = cls(dim=matrix.shape[1])
+        for row, chunk in enumerate(meta['chunks']):
+            key = chunk_key(chunk)
+            index.keys.append(key)
+            index.rows[key] = row
+            index.chunks[key] = chunk
+            index.documents.setdefault(chunk['document_id'], []).append(key)
+            index.dedup.add(key, chunk)
+        index._matrix = matrix
+        index._alive = np.ones(len(matrix), dtype=bool)
+        index.size = len(matrix)
+        if centroids is not None:
+            # Centróides e listas salvos: não precisa treinar nem reatribuir
+            index.ann = IVFIndex(centroids)
+            index.ann.trained_size = meta.get('ann_trained_size') or len(matrix)
+            index.ann.add(0, matrix, assignments)
+        else:
+            index._train_ann()
+        # Colapsados: guardados sem vetor (calculado se um dia voltarem para a matriz)
+        index.add_chunks(meta['collapsed'])
+        return index
+
+    def stats(self):
+        return {
+            'chunks': len(self),
+            'deleted': self.deleted,
+            'collapsed': len(self.dedup),
+            'documents': len(self.documents),
+            'dim': self.dim,
+            'matrix_bytes': int(self.matrix.nbytes),
+            'ann': self.ann.stats() if self.ann is not None else None
+        }
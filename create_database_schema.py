@@ -7,6 +7,25 @@ from google.cloud import bigquery
 from datetime import datetime
 import os
 
+def add_missing_columns(client, table_ref, schema):
+    """Migração idempotente: create_table(exists_ok=True) não altera tabela existente,
+    então as colunas novas do schema são acrescentadas aqui (só NULLABLE pode ser adicionada)"""
+    table = client.get_table(table_ref)
+    existing_fields = [field.name for field in table.schema]
+    missing = [field for field in schema if field.name not in existing_fields]
+    if not missing:
+        return []
+
+    required = [field.name for field in missing if field.mode == "REQUIRED"]
+    if required:
+        print(f"  ⚠️ Colunas REQUIRED não podem ser adicionadas em {table.table_id}: {', '.join(required)}")
+    addable = [field for field in missing if field.mode != "REQUIRED"]
+    if addable:
+        table.schema = list(table.schema) + addable
+        client.update_table(table, ["schema"])
+        print(f"  🔧 Colunas adicionadas em {table.table_id}: {', '.join(field.name for field in addable)}")
+    return [field.name for field in addable]
+
 def create_saas_database_schema():
     """Criar todas as tabelas necessárias para o SaaS"""
     
@@ -87,6 +106,16 @@ def create_saas_database_schema():
             bigquery.SchemaField("metadata", "STRING"),  # JSON com dados extras
         ],
         
+        # Resumo incremental das conversas longas (uma linha por atualização)
+        'conversation_summaries': [
+            bigquery.SchemaField("chat_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("conversation_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("summary", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("summarized_until", "TIMESTAMP", mode="REQUIRED"),  # última mensagem resumida
+            bigquery.SchemaField("messages_summarized", "INTEGER", mode="REQUIRED"),
+            bigquery.SchemaField("updated_at", "TIMESTAMP", mode="REQUIRED"),
+        ],
+        
         # Documentos dos chats
         'chat_documents': [
             bigquery.SchemaField("document_id", "STRING", mode="REQUIRED"),
@@ -102,8 +131,29 @@ def create_saas_database_schema():
             bigquery.SchemaField("processing_status", "STRING", mode="REQUIRED"),  # processing, completed, failed
             bigquery.SchemaField("uploaded_at", "TIMESTAMP", mode="REQUIRED"),
             bigquery.SchemaField("processed_at", "TIMESTAMP"),
+            bigquery.SchemaField("processing_error", "STRING"),  # motivo quando failed
+            bigquery.SchemaField("content_hash", "STRING"),  # SHA-256 dos bytes (deduplicação)
+            bigquery.SchemaField("text_hash", "STRING"),  # SHA-256 do texto normalizado
         ],
-        
+
+        # Trechos dos documentos (gerados no upload; a busca seleciona trechos)
+        'chat_document_chunks': [
+            bigquery.SchemaField("chunk_id", "STRING", mode="REQUIRED"),  # {document_id}-{chunk_index}
+            bigquery.SchemaField("document_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("chat_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("user_id", "STRING"),
+            bigquery.SchemaField("filename", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("chunk_index", "INTEGER", mode="REQUIRED"),
+            bigquery.SchemaField("start_offset", "INTEGER", mode="REQUIRED"),  # posição no processed_content
+            bigquery.SchemaField("end_offset", "INTEGER", mode="REQUIRED"),
+            bigquery.SchemaField("content", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("token_count", "INTEGER", mode="REQUIRED"),
+            bigquery.SchemaField("tokens", "STRING"),  # termos normalizados (text_normalizer.py)
+            bigquery.SchemaField("embedding", "BYTES"),  # float32[EMBEDDING_DIM] (vector_index.py)
+            bigquery.SchemaField("fingerprint", "STRING"),  # simhash do trecho (chunk_dedup.py)
+            bigquery.SchemaField("created_at", "TIMESTAMP", mode="REQUIRED"),
+        ],
+
         # Logs administrativos
         'admin_logs': [
             bigquery.SchemaField("log_id", "STRING", mode="REQUIRED"),
@@ -166,6 +216,7 @@ def create_saas_database_schema():
         try:
             table = client.create_table(table, exists_ok=True)
             print(f"  ✅ Tabela criada: {table_name}")
+            add_missing_columns(client, table_ref, schema)
         except Exception as e:
             print(f"  ❌ Erro ao criar tabela {table_name}: {e}")
     
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark da busca vetorial: latência x número de trechos (busca exata vs IVF)
+Vetores sintéticos agrupados em tópicos (como trechos de documentos de clínicas),
+recall@k medido contra a busca exata para cada nprobe.
+
+Uso:
+    python utils/ann_benchmark.py --sizes 10000,100000,1000000 --nprobe 1,4,8,16,32
+    (1M trechos de 256 dimensões ocupam ~1GB de RAM)
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chat-engine'))
+
+from vector_index import VectorIndex, EMBEDDING_DIM
+
+def synthetic_vectors(count, dim, topics, rng, batch=100000):
+    """Vetores normalizados em torno de `topics` centros"""
+    centers = rng.standard_normal((topics, dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    vectors = np.empty((count, dim), dtype=np.float32)
+    for start in range(0, count, batch):
+        size = min(batch, count - start)
+        part = centers[rng.integers(0, topics, size)] + 0.03 * rng.standard_normal((size, dim)).astype(np.float32)
+        vectors[start:start + size] = part / np.linalg.norm(part, axis=1, keepdims=True)
+    return vectors
+
+def percentile_ms(samples, p):
+    return float(np.percentile(samples, p)) * 1000
+
+def exact_top(index, query, k):
+    scores = index.matrix @ query
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+def run(size, args, rng):
+    vectors = synthetic_vectors(size, args.dim, args.topics, rng)
+    queries = vectors[rng.integers(0, size, args.queries)] + 0.02 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    index = VectorIndex(dim=args.dim)
+    started = time.perf_counter()
+    index._append(vectors)  # só a matriz: o benchmark não precisa dos metadados dos trechos
+    build_s = time.perf_counter() - started
+    del vectors
+
+    timings, truth = [], []
+    for query in queries:
+        started = time.perf_counter()
+        truth.append(set(exact_top(index, query, args.k).tolist()))
+        timings.append(time.perf_counter() - started)
+    print(f"\n📊 {size:,} trechos - build {build_s:.1f}s - {index.stats()['ann'] or 'sem IVF'}")
+    print(f"   exato      p50 {percentile_ms(timings, 50):7.2f}ms  p95 {percentile_ms(timings, 95):7.2f}ms  recall@{args.k} 1.000")
+
+    if index.ann is None:
+        return
+    for nprobe in args.nprobe:
+        timings, hits = [], 0
+        for query, expected in zip(queries, truth):
+            started = time.perf_counter()
+            rows, _ = index.search_vector(query, args.k, nprobe=nprobe)
+            timings.append(time.perf_counter() - started)
+            hits += len(expected & set(rows.tolist()))
+        print(f"   nprobe={nprobe:<4} p50 {percentile_ms(timings, 50):7.2f}ms  p95 {percentile_ms(timings, 95):7.2f}ms  "
+              f"recall@{args.k} {hits / (len(queries) * args.k):.3f}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark da busca vetorial (exata x IVF)')
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='números de trechos, separados por vírgula')
+    parser.add_argument('--nprobe', default='1,4,8,16,32', help='valores de nprobe, separados por vírgula')
+    parser.add_argument('--dim', type=int, default=EMBEDDING_DIM)
+    parser.add_argument('--topics', type=int, default=2000)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(',')]
+    args.nprobe = [int(nprobe) for nprobe in args.nprobe.split(',')]
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    for size in args.sizes:
+        run(size, args, rng)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Servidor Anthropic FAKE para testes locais (sem rede, sem custo)
+Responde POST /v1/messages (normal e stream: true) com latência e erros configuráveis,
+e a Message Batches API (/v1/messages/batches) com lotes que encerram após --batch-seconds.
+
+Uso:
+    python utils/fake_anthropic_server.py --port 8999 --latency-ms 300 --error-rate 0.2 --error-status 529
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8999 python chat-engine/app.py
+"""
+
+import argparse
+import json
+import random
+import time
+import uuid
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Lotes em memória: batch_id -> {'created', 'ends_at', 'results'}
+BATCHES = {}
+BATCHES_LOCK = threading.Lock()
+
+class FakeAnthropicHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    options = None
+
+    def log_message(self, format, *args):
+        if self.options.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _latency(self):
+        base = self.options.latency_ms
+        jitter = random.uniform(0, self.options.jitter_ms)
+        # Cauda longa: uma fração das requisições fica bem mais lenta
+        if random.random() < self.options.slow_rate:
+            base *= self.options.slow_factor
+        time.sleep((base + jitter) / 1000)
+
+    def _inject_error(self):
+        if random.random() >= self.options.error_rate:
+            return False
+        status = self.options.error_status
+        error_type = {429: 'rate_limit_error', 529: 'overloaded_error'}.get(status, 'api_error')
+        headers = {'retry-after': str(self.options.retry_after)} if self.options.retry_after else {}
+        self._send_json(status, {'type': 'error', 'error': {'type': error_type, 'message': 'fake error'}}, headers)
+        return True
+
+    def _reply_text(self, body):
+        messages = body.get('messages') or [{}]
+        last = messages[-1].get('content', '')
+        if isinstance(last, list):
+            last = ' '.join(block.get('text', '') for block in last if isinstance(block, dict))
+        return f"[fake {body.get('model', '')}] {str(last)[:200]}"
+
+    def _usage(self, body, text):
+        prompt = json.dumps(body.get('system', '')) + json.dumps(body.get('messages', []))
+        return {'input_tokens': len(prompt) // 4, 'output_tokens': max(1, len(text) // 4)}
+
+    def do_POST(self):
+        try:
+            self._handle_post()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # cliente desistiu (ex.: requisição hedged cancelada)
+
+    def do_GET(self):
+        try:
+            self._handle_get()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _handle_post(self):
+        body = self._read_json()
+
+        if self.path.rstrip('/') == '/v1/messages/batches':
+            self._create_batch(body)
+            return
+
+        if self.path.rstrip('/') != '/v1/messages':
+            self._send_json(404, {'type': 'error', 'error': {'type': 'not_found_error', 'message': self.path}})
+            return
+
+        self._latency()
+        if self._inject_error():
+            return
+
+        text = self._reply_text(body)
+        usage = self._usage(body, text)
+
+        if body.get('stream'):
+            self._stream(text, usage)
+            return
+
+        self._send_json(200, self._message(body, text, usage))
+
+    def _message(self, body, text, usage):
+        return {
+            'id': f"msg_fake_{uuid.uuid4().hex[:12]}",
+            'type': 'message',
+            'role': 'assistant',
+            'model': body.get('model'),
+            'content': [{'type': 'text', 'text': text}],
+            'stop_reason': 'end_turn',
+            'usage': usage
+        }
+
+    def _create_batch(self, body):
+        batch_id = f"msgbatch_fake_{uuid.uuid4().hex[:12]}"
+        results = []
+        for item in body.get('requests') or []:
+            params = item.get('params') or {}
+            # Erros injetados viram resultados 'errored' (o lote em si é aceito)
+            if random.random() < self.options.error_rate:
+                result = {'type': 'errored', 'error': {'type': 'error', 'error': {'type': 'overloaded_error', 'message': 'fake error'}}}
+            else:
+                text = self._reply_text(params)
+                result = {'type': 'succeeded', 'message': self._message(params, text, self._usage(params, text))}
+            results.append({'custom_id': item.get('custom_id'), 'result': result})
+
+        with BATCHES_LOCK:
+            BATCHES[batch_id] = {
+                'created': time.time(),
+                'ends_at': time.time() + self.options.batch_seconds,
+                'results': results
+            }
+        self._send_json(200, self._batch_status(batch_id))
+
+    def _batch_status(self, batch_id):
+        with BATCHES_LOCK:
+            batch = BATCHES[batch_id]
+        ended = time.time() >= batch['ends_at']
+        counts = {'processing': 0, 'succeeded': 0, 'errored': 0, 'canceled': 0, 'expired': 0}
+        for item in batch['results']:
+            if ended:
+                counts[item['result']['type']] += 1
+            else:
+                counts['processing'] += 1
+        return {
+            'id': batch_id,
+            'type': 'message_batch',
+            'processing_status': 'ended' if ended else 'in_progress',
+            'request_counts': counts,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(batch['created'])),
+            'ended_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(batch['ends_at'])) if ended else None,
+            'results_url': (f"http://{self.options.host}:{self.options.port}/v1/messages/batches/{batch_id}/results"
+                            if ended else None)
+        }
+
+    def _handle_get(self):
+        parts = self.path.strip('/').split('/')
+        # /v1/messages/batches/{id}[/results]
+        if len(parts) < 4 or parts[:3] != ['v1', 'messages', 'batches'] or parts[3] not in BATCHES:
+            self._send_json(404, {'type': 'error', 'error': {'type': 'not_found_error', 'message': self.path}})
+            return
+
+        batch_id = parts[3]
+        if len(parts) == 4:
+            self._send_json(200, self._batch_status(batch_id))
+            return
+
+        status = self._batch_status(batch_id)
+        if status['processing_status'] != 'ended':
+            self._send_json(400, {'type': 'error', 'error': {'type': 'invalid_request_error', 'message': 'batch still in progress'}})
+            return
+        data = ''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in BATCHES[batch_id]['results']).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/binary')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, text, usage):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        def event(name, data):
+            self.wfile.write(f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        event('message_start', {'type': 'message_start', 'message': {'usage': {'input_tokens': usage['input_tokens'], 'output_tokens': 0}}})
+        for word in text.split(' '):
+            event('content_block_delta', {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': word + ' '}})
+            time.sleep(self.options.token_delay_ms / 1000)
+        event('message_delta', {'type': 'message_delta', 'delta': {'stop_reason': 'end_turn'}, 'usage': {'output_tokens': usage['output_tokens']}})
+        event('message_stop', {'type': 'message_stop'})
+        self.close_connection = True
+
+def build_server(host='127.0.0.1', port=8999, **overrides):
+    """Criar servidor (útil para scripts de teste); chamar serve_forever() em uma thread"""
+    options = parse_args([])
+    options.host, options.port = host, port
+    for key, value in overrides.items():
+        setattr(options, key, value)
+    handler = type('Handler', (FakeAnthropicHandler,), {'options': options})
+    return ThreadingHTTPServer((options.host, options.port), handler)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Servidor Anthropic fake para testes locais')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8999)
+    parser.add_argument('--latency-ms', type=float, default=200, help='latência base por requisição')
+    parser.add_argument('--jitter-ms', type=float, default=50, help='variação aleatória somada à latência')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='fração de requisições lentas (cauda)')
+    parser.add_argument('--slow-factor', type=float, default=10, help='multiplicador da latência nas lentas')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fração de requisições com erro')
+    parser.add_argument('--error-status', type=int, default=529, help='status HTTP dos erros injetados')
+    parser.add_argument('--retry-after', type=int, default=0, help='valor do header retry-after nos erros')
+    parser.add_argument('--token-delay-ms', type=float, default=20, help='intervalo entre deltas no streaming')
+    parser.add_argument('--batch-seconds', type=float, default=5, help='tempo até um lote (batches) encerrar')
+    parser.add_argument('--verbose', action='store_true')
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = build_server(**vars(args))
+    print(f"🧪 Fake Anthropic em http://{args.host}:{args.port} "
+          f"(latência {args.latency_ms}ms, erros {args.error_rate:.0%} -> {args.error_status})")
+    server.serve_forever()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Benchmark da extração de PDF: páginas/segundo em série (loop antigo) x pool de processos
+
+Uso:
+    python utils/pdf_benchmark.py --corpus ~/pdfs-clinicas --workers 4 --pages-per-task 16
+"""
+
+import os
+import sys
+import glob
+import time
+import argparse
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+def serial_extract(pdf_data):
+    """Extração página a página no processo atual (comportamento anterior)"""
+    import PyPDF2
+    reader = PyPDF2.PdfReader(BytesIO(pdf_data))
+    return "\n".join((page.extract_text() or '') for page in reader.pages), len(reader.pages)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark da extração de texto de PDF')
+    parser.add_argument('--corpus', required=True, help='pasta com PDFs (busca recursiva)')
+    parser.add_argument('--workers', type=int, help='processos do pool (PDF_WORKERS)')
+    parser.add_argument('--pages-per-task', type=int, help='páginas por tarefa (PDF_PAGES_PER_TASK)')
+    parser.add_argument('--skip-serial', action='store_true', help='medir só o pool')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.workers:
+        os.environ['PDF_WORKERS'] = str(args.workers)
+    if args.pages_per_task:
+        os.environ['PDF_PAGES_PER_TASK'] = str(args.pages_per_task)
+
+    from pdf_extraction import extract_pdf_text, PDF_WORKERS, PDF_PAGES_PER_TASK
+
+    paths = sorted(glob.glob(os.path.join(os.path.expanduser(args.corpus), '**', '*.pdf'), recursive=True))
+    if not paths:
+        sys.exit(f"Nenhum PDF em {args.corpus}")
+    corpus = [(path, open(path, 'rb').read()) for path in paths]
+    print(f"📚 {len(corpus)} PDFs - pool com {PDF_WORKERS} processos, {PDF_PAGES_PER_TASK} páginas por tarefa")
+
+    # Aquecer o pool (os processos sobem na primeira extração)
+    extract_pdf_text(corpus[0][1])
+
+    totals = {'serial': [0, 0.0], 'pool': [0, 0.0]}
+    for path, data in corpus:
+        line = f"   {os.path.basename(path)[:40]:<40}"
+        if not args.skip_serial:
+            started = time.perf_counter()
+            _, pages = serial_extract(data)
+            elapsed = time.perf_counter() - started
+            totals['serial'][0] += pages
+            totals['serial'][1] += elapsed
+            line += f" série {pages / elapsed:8.1f} pág/s"
+
+        started = time.perf_counter()
+        _, stats = extract_pdf_text(data)
+        elapsed = time.perf_counter() - started
+        totals['pool'][0] += stats['extracted']
+        totals['pool'][1] += elapsed
+        line += f"  pool {stats['extracted'] / elapsed:8.1f} pág/s ({stats['pages']} págs, {len(stats['skipped'])} puladas)"
+        print(line)
+
+    print()
+    for mode, (pages, seconds) in totals.items():
+        if seconds:
+            print(f"📊 {mode:<6} {pages} páginas em {seconds:.2f}s = {pages / seconds:.1f} pág/s")
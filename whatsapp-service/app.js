@@ -24,6 +24,9 @@ const app = express();
 const PORT = process.env.PORT || 8080;
 const BACKEND_URL = process.env.BACKEND_URL || 'https://saas-chat-backend-365442086139.us-east1.run.app';
 const CHAT_ENGINE_URL = process.env.CHAT_ENGINE_URL || 'https://saas-chat-engine-365442086139.us-east1.run.app';
+// Chat-engine sobrecarregado responde 503 + Retry-After: aguardar e tentar de novo
+const CHAT_ENGINE_MAX_ATTEMPTS = parseInt(process.env.CHAT_ENGINE_MAX_ATTEMPTS || '3', 10);
+const CHAT_ENGINE_MAX_WAIT_SECONDS = parseInt(process.env.CHAT_ENGINE_MAX_WAIT_SECONDS || '30', 10);
 
 // Middlewares
 app.use(helmet());
@@ -159,21 +162,61 @@ async function findChatByPhoneNumber(phoneNumber) {
   }
 }
 
+const sleep = (seconds) => new Promise(resolve => setTimeout(resolve, seconds * 1000));
+
+// Consultar /api/load antes de enviar: enquanto accepting=false, aguardar retry_after
+async function waitForChatEngineCapacity() {
+  for (let attempt = 1; attempt < CHAT_ENGINE_MAX_ATTEMPTS; attempt++) {
+    let load;
+    try {
+      load = (await axios.get(`${CHAT_ENGINE_URL}/api/load`, { timeout: 5000 })).data;
+    } catch (error) {
+      // Sem leitura de carga, segue para o envio (que ainda respeita 503 + Retry-After)
+      logger.warn('Não foi possível consultar a carga do chat-engine:', error.message);
+      return;
+    }
+    if (load.accepting) {
+      return;
+    }
+    const waitSeconds = Math.min(load.retry_after || 1, CHAT_ENGINE_MAX_WAIT_SECONDS);
+    logger.warn('Chat-engine sem capacidade, aguardando antes de enviar:', { waitSeconds, attempt });
+    await sleep(waitSeconds);
+  }
+}
+
+// POST /api/send/<chat_id> no chat-engine respeitando Retry-After quando ele está sobrecarregado
+async function postToChatEngine(chatId, payload) {
+  await waitForChatEngineCapacity();
+  const url = `${CHAT_ENGINE_URL}/api/send/${encodeURIComponent(chatId)}`;
+  for (let attempt = 1; ; attempt++) {
+    try {
+      return await axios.post(url, payload);
+    } catch (error) {
+      const retryAfter = parseInt(error.response?.headers?.['retry-after'], 10);
+      if (error.response?.status !== 503 || !retryAfter || attempt >= CHAT_ENGINE_MAX_ATTEMPTS) {
+        throw error;
+      }
+      const waitSeconds = Math.min(retryAfter, CHAT_ENGINE_MAX_WAIT_SECONDS);
+      logger.warn('Chat-engine sobrecarregado, aguardando:', { waitSeconds, attempt });
+      await sleep(waitSeconds);
+    }
+  }
+}
+
 // Processar mensagem com chat-engine
 async function processMessageWithChatEngine(chatInfo, whatsappMessage) {
   try {
     const payload = {
-      chat_id: chatInfo.chat_id,
       conversation_id: `wa_${whatsappMessage.from}`,
       message: whatsappMessage.body,
       source: 'whatsapp',
       phone_number: whatsappMessage.from.replace('@c.us', '')
     };
 
-    const response = await axios.post(`${CHAT_ENGINE_URL}/api/chat/message`, payload);
+    const response = await postToChatEngine(chatInfo.chat_id, payload);
     
-    if (response.data && response.data.response) {
-      await sendWhatsAppMessage(whatsappMessage.from, response.data.response);
+    if (response.data && response.data.success && response.data.message) {
+      await sendWhatsAppMessage(whatsappMessage.from, response.data.message);
     }
   } catch (error) {
     logger.error('Erro ao processar com chat-engine:', error.message);